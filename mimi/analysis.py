@@ -32,42 +32,47 @@
 
 from mimi.atom import *
 from mimi.molecule import *
+from mimi.cache import load_cache, read_cache_header, resolve_cache_file, write_cache
+from mimi.cache_sqlite import is_sqlite_cache
+from mimi.serve_cache import attach_shared_cache
+from mimi.matching import (blank_peak_mask, first_ppm_hits_grid, mz_partitions, ppm_pair_mask, ppm_window_pairs,
+                           verify_isotope_envelopes, ISOTOPE_RATIO_TOLERANCE)
 import sys
 import argparse
 import os
-import pickle
+import re
+import multiprocessing
+import warnings
 import numpy as np
+import pandas as pd
 from datetime import datetime
 import pkg_resources
 from tqdm import tqdm
 
 
-def load_molecular_mass_database(db_file):
-    """Load precalculated molecular mass database from TSV file.
-    
+def iter_molecular_mass_database(db_file):
+    """Stream compound entries from a molecular mass database TSV file.
+
     Args:
         db_file: Path to TSV file containing molecular mass data
-        
-    Returns:
-        List of molecular mass entries, where each entry is a list containing:
-        1. Chemical Formula (CF)
-        2. Compound ID
-        3. Compound Name
 
-        Other fields from the input file are ignored.
+    Yields:
+        list: [CF, Compound ID, Compound Name] for each compound line; other
+            fields from the input file are ignored
+
+    Raises:
+        FileNotFoundError: If the database file does not exist
     """
-    mass_ref_list = []
-    try:
-        fd = open(db_file, encoding="ISO-8859-1")
+    with open(db_file, encoding="ISO-8859-1") as fd:
         skip = True
         header_indices = {'CF': 0, 'ID': 1, 'Name': 2}  # Default indices
-        
+
         for line in fd:
             if line.startswith('#'):
                 continue
             line = line.strip()
             fields = line.split('\t')
-            
+
             if skip:
                 # Process header to determine field positions
                 for i, field in enumerate(fields):
@@ -84,10 +89,27 @@ def load_molecular_mass_database(db_file):
             cf = fields[header_indices['CF']] if header_indices['CF'] < len(fields) else ""
             compound_id = fields[header_indices['ID']] if header_indices['ID'] < len(fields) else ""
             name = fields[header_indices['Name']] if header_indices['Name'] < len(fields) else ""
-            
-            # Add fields in the required order: CF, ID, Name
-            mass_ref_list.append([cf, compound_id, name])
-        fd.close()
+
+            # Yield fields in the required order: CF, ID, Name
+            yield [cf, compound_id, name]
+
+
+def load_molecular_mass_database(db_file):
+    """Load precalculated molecular mass database from TSV file.
+    
+    Args:
+        db_file: Path to TSV file containing molecular mass data
+        
+    Returns:
+        List of molecular mass entries, where each entry is a list containing:
+        1. Chemical Formula (CF)
+        2. Compound ID
+        3. Compound Name
+
+        Other fields from the input file are ignored.
+    """
+    try:
+        mass_ref_list = list(iter_molecular_mass_database(db_file))
     except FileNotFoundError:
         print(f"Error: Database file '{db_file}' not found.")
         sys.exit(1)
@@ -99,65 +121,179 @@ def load_molecular_mass_database(db_file):
 
 
 
-def load_mass_spectrometry_data(asc_file):
-    """Load mass intensity data from mass spectrometry output file.
+def count_leading_lines(asc_file):
+    """Count the lines before the first data row of a sample file.
+
+    Blank lines, comment lines starting with '#' and header lines whose first
+    field is not a number are skipped, as in a sample file with or without a
+    header row.
+
+    Args:
+        asc_file (str): Path to ASC format mass spectrometry output file
+
+    Returns:
+        int: Number of lines to skip before the first data row
+    """
+    skipped = 0
+    with open(asc_file) as fd:
+        for line in fd:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                try:
+                    float(line.split('\t')[0])
+                    break
+                except ValueError:
+                    pass
+            skipped += 1
+    return skipped
+
+
+def segment_medians(values, starts, counts):
+    """Get the median of every segment values[starts[i]:starts[i] + counts[i]].
+
+    Args:
+        values (np.ndarray): Values, sorted in ascending order within every segment
+        starts (np.ndarray): First index of every segment
+        counts (np.ndarray): Length of every segment (at least 1)
+
+    Returns:
+        np.ndarray: float64 median of every segment
+    """
+    return (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+
+
+def estimate_noise_levels(masses, intensities, window=10.0):
+    """Estimate the noise level around every peak from the peaks of its m/z window.
+
+    The m/z axis is cut into windows of a fixed width. Within each window the
+    noise level is the median intensity and its spread is the median absolute
+    deviation (MAD) from it, scaled by 1.4826 to estimate a standard
+    deviation. Both are robust to the few signal peaks among the noise.
+
+    Args:
+        masses (np.ndarray): Sorted float64 peak masses
+        intensities (np.ndarray): Peak intensities, aligned with masses
+        window (float): Width of the m/z windows
+
+    Returns:
+        tuple: (noise, sigma) float64 arrays aligned with the peaks
+    """
+    window_ids = np.floor(masses / window).astype(np.int64)
+    # Masses are sorted, so every window is one segment; sort within segments
+    order = np.lexsort((intensities, window_ids))
+    _, starts, counts = np.unique(window_ids[order], return_index=True, return_counts=True)
+    segments = np.repeat(np.arange(len(starts)), counts)
+
+    sorted_intensities = intensities[order]
+    medians = segment_medians(sorted_intensities, starts, counts)
+    deviations = np.abs(sorted_intensities - medians[segments])
+    deviations = deviations[np.lexsort((deviations, segments))]
+    sigmas = 1.4826 * segment_medians(deviations, starts, counts)
+
+    peak_segments = np.empty(len(masses), dtype=np.int64)
+    peak_segments[order] = segments
+    return medians[peak_segments], sigmas[peak_segments]
+
+
+def prefilter_sample_peaks(peaks, window=10.0, min_snr=None, top_peaks=None):
+    """Drop noise peaks from a sample before matching.
+
+    Args:
+        peaks (dict): Peak arrays from load_sample_peaks, sorted by mass
+        window (float): Width of the m/z windows
+        min_snr (float, optional): Keep peaks at least min_snr noise
+            standard deviations above the noise level of their window
+        top_peaks (int, optional): Keep the top_peaks most intense peaks of
+            every window
+
+    Returns:
+        tuple: (peaks, removed) with the kept peak arrays, still sorted by
+            mass, and the number of peaks removed
+    """
+    masses, intensities = peaks['mass'], peaks['intensity']
+    keep = np.ones(len(masses), dtype=bool)
+    if len(masses) and min_snr is not None:
+        noise, sigma = estimate_noise_levels(masses, intensities, window)
+        keep &= intensities - noise >= min_snr * sigma
+    if len(masses) and top_peaks is not None:
+        window_ids = np.floor(masses / window).astype(np.int64)
+        # Rank the peaks of every window by decreasing intensity
+        order = np.lexsort((-intensities, window_ids))
+        _, starts, counts = np.unique(window_ids[order], return_index=True, return_counts=True)
+        ranks = np.arange(len(masses)) - np.repeat(starts, counts)
+        top = np.empty(len(masses), dtype=bool)
+        top[order] = ranks < top_peaks
+        keep &= top
+    return {key: values[keep] for key, values in peaks.items()}, int(len(masses) - np.count_nonzero(keep))
+
+
+def load_sample_peaks(asc_file, noise_window=10.0, min_snr=None, top_peaks=None):
+    """Load a mass spectrometry peak list into typed arrays sorted by mass.
     
     Args:
         asc_file (str): Path to ASC format mass spectrometry output file. File should contain
                        tab-separated values with three columns per line:
                        1. mass value
                        2. intensity value
-                       3. error/uncertainty value
+                       3. error/uncertainty value (optional)
                        
                        Lines starting with '#' are treated as comments and ignored.
-                       The file may or may not have a header row.
+                       The file may or may not have a header row. Rows with
+                       fewer than two columns are ignored.
+        noise_window (float): Width of the m/z windows used by min_snr and top_peaks
+        min_snr (float, optional): Drop peaks below this signal-to-noise ratio
+            (see prefilter_sample_peaks)
+        top_peaks (int, optional): Keep only this many most intense peaks per window
         
     Returns:
         tuple: Contains:
-            - list: List of [mass, intensity, error] data rows
+            - dict: Peak arrays of equal length, sorted by mass:
+                - mass: float64 masses
+                - intensity: float64 intensities
+                - resolution: float64 third column (NaN where missing)
+                - mass_text, intensity_text: the original mass and intensity
+                  strings, written unchanged to the report
             - dict: Metadata about the file including:
                 - file_path: Original file path
                 - line_count: Number of data lines (excluding comments and headers)
+                - removed_peaks: Number of peaks dropped as noise
     """
-    mass_intensity_pair_list = []
     metadata = {
         'file_path': asc_file,
-        'line_count': 0
+        'line_count': 0,
+        'removed_peaks': 0
     }
     
     try:
-        fd = open(asc_file)
-        first_data_line = True
-        
-        for line in fd:
-            line = line.strip()
-            
-            # Skip empty lines
-            if not line:
-                continue
-                
-            # Skip comment lines starting with '#'
-            if line.startswith('#'):
-                continue
-            
-            fields = line.split('\t')
-            
-            # Skip potential header row by checking if first field looks like a number
-            if first_data_line:
-                try:
-                    # Try to convert first field to float to detect if it's a header
-                    float(fields[0])
-                    first_data_line = False
-                except (ValueError, IndexError):
-                    # Likely a header row, skip it
-                    continue
-            
-            # Ensure we have at least mass and intensity columns
-            if len(fields) >= 2:
-                mass_intensity_pair_list.append(fields)
-                metadata['line_count'] += 1
-            
-        fd.close()
+        try:
+            # Columns beyond the third are dropped; pandas warns about that
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', pd.errors.ParserWarning)
+                table = pd.read_csv(asc_file, sep='\t', header=None, comment='#', skip_blank_lines=True,
+                                    skiprows=count_leading_lines(asc_file), skipinitialspace=True,
+                                    names=['mass', 'intensity', 'resolution'], index_col=False,
+                                    dtype={'mass': str, 'intensity': str, 'resolution': np.float64})
+        except pd.errors.EmptyDataError:
+            table = pd.DataFrame({'mass': [], 'intensity': [], 'resolution': []})
+
+        # Ensure we have at least mass and intensity columns
+        table = table[table['intensity'].notna()]
+        mass_text = table['mass'].to_numpy(dtype=object)
+        intensity_text = table['intensity'].to_numpy(dtype=object)
+        masses = mass_text.astype(np.float64)
+
+        # Sort once; a stable sort keeps the file order of equal masses
+        order = np.argsort(masses, kind='stable')
+        peaks = {
+            'mass': masses[order],
+            'intensity': intensity_text.astype(np.float64)[order],
+            'resolution': table['resolution'].to_numpy(dtype=np.float64)[order],
+            'mass_text': mass_text[order],
+            'intensity_text': intensity_text[order],
+        }
+        metadata['line_count'] = len(masses)
+        if min_snr is not None or top_peaks is not None:
+            peaks, metadata['removed_peaks'] = prefilter_sample_peaks(peaks, noise_window, min_snr, top_peaks)
     except FileNotFoundError:
         print(f"Error: Sample file '{asc_file}' not found.")
         sys.exit(1)
@@ -165,33 +301,63 @@ def load_mass_spectrometry_data(asc_file):
         print(f"Error loading sample file '{asc_file}': {str(e)}")
         sys.exit(1)
         
-    return mass_intensity_pair_list, metadata
+    return peaks, metadata
 
 
-def create_mass_hash_index(compounds):
-    """Create a hash index of compounds by integer mass for faster lookup.
-    
+def get_sample_mass_range(asc_file):
+    """Get the lowest and highest mass of a sample file.
+
+    Only the mass column is read. Rows that load_sample_peaks drops for a
+    missing intensity are counted, so the range may be wider, never narrower.
+
     Args:
-        compounds (dict): Dictionary of compound data
-        
+        asc_file (str): Path to ASC format mass spectrometry output file
+
     Returns:
-        dict: Mass-based index where keys are integer masses and values are
-              lists of compounds with masses in that range. Each compound is
-              also added to adjacent integer mass bins to handle boundary cases.
+        tuple: (lowest, highest) mass, or None if the file has no peaks
     """
-    mass_index = {}
-    for co in compounds:
-        mass = compounds[co]['mass']
-        mass_float = float(mass)
-        mass_int = int(mass_float)
-        
-        # Add compound to its primary mass bin and adjacent bins
-        for m in [mass_int - 1, mass_int, mass_int + 1]:
-            if m not in mass_index:
-                mass_index[m] = []
-            mass_index[m].append(co)
-            
-    return mass_index
+    def read_masses(dtype):
+        return pd.read_csv(asc_file, sep='\t', header=None, comment='#', skip_blank_lines=True,
+                           skiprows=count_leading_lines(asc_file), skipinitialspace=True,
+                           usecols=[0], names=['mass'], index_col=False, dtype={'mass': dtype})['mass']
+
+    try:
+        try:
+            masses = read_masses(np.float64).to_numpy()
+        except pd.errors.EmptyDataError:
+            return None
+        except ValueError:
+            # Rows with a non-numeric first field (e.g. trailing text) are not peaks
+            masses = pd.to_numeric(read_masses(str), errors='coerce').to_numpy(dtype=np.float64)
+        masses = masses[~np.isnan(masses)]
+    except FileNotFoundError:
+        print(f"Error: Sample file '{asc_file}' not found.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error loading sample file '{asc_file}': {str(e)}")
+        sys.exit(1)
+
+    if not len(masses):
+        return None
+    return float(masses.min()), float(masses.max())
+
+
+def load_blank_peaks(blank_files, noise_window=10.0, min_snr=None, top_peaks=None):
+    """Load blank and solvent injections and merge their peaks into one sorted array.
+
+    Args:
+        blank_files (list): Paths to the blank peak lists
+        noise_window, min_snr, top_peaks: Noise prefilter applied to every
+            blank, as in load_sample_peaks
+
+    Returns:
+        dict: Merged 'mass' and 'intensity' float64 arrays, sorted by mass
+    """
+    blanks = [load_sample_peaks(blank_file, noise_window, min_snr, top_peaks)[0] for blank_file in blank_files]
+    masses = np.concatenate([blank['mass'] for blank in blanks])
+    intensities = np.concatenate([blank['intensity'] for blank in blanks])
+    order = np.argsort(masses, kind='stable')
+    return {'mass': masses[order], 'intensity': intensities[order]}
 
 
 def get_atom_counts(exp):
@@ -211,6 +377,266 @@ def get_atom_counts(exp):
     return (counts['C'], counts['H'], counts['N'], counts['O'], counts['P'], counts['S'])
 
 
+def get_compound_atom_counts(compound):
+    """Get the (C, H, N, O, P, S) counts of a cache entry.
+
+    Entries attached from a shared-memory cache carry the counts precomputed
+    in 'atom_counts' instead of the parsed formula in 'exp'.
+    """
+    if 'atom_counts' in compound:
+        return compound['atom_counts']
+    return get_atom_counts(compound['exp'])
+
+
+def filter_isotope_variants(isotope_mass_list, noise_cutoff=None):
+    """Select the isotope variants at or above a relative abundance cutoff.
+    
+    Variants after the monoisotopic entry are stored in decreasing order of
+    relative abundance, so the selection is a prefix found by binary search.
+    
+    Args:
+        isotope_mass_list (list): Cached [mass, abundance, isotope_name] entries,
+            starting with the monoisotopic entry
+        noise_cutoff (float, optional): Minimum relative abundance to keep.
+            If None, all variants are returned.
+        
+    Returns:
+        list: Isotope variants (excluding the monoisotopic entry) to verify
+    """
+    if noise_cutoff is None:
+        return isotope_mass_list[1:]
+
+    lo, hi = 1, len(isotope_mass_list)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if isotope_mass_list[mid][1] >= noise_cutoff:
+            lo = mid + 1
+        else:
+            hi = mid
+    return isotope_mass_list[1:lo]
+
+
+def expand_isotope_variants(compound, ion, noise_cutoff):
+    """Compute the isotope variants of an entry from a masses-only cache.
+
+    The parsed formula stored in the entry already carries the (possibly
+    labelled) isotope data it was built with, so the variants come out the same
+    as in a full cache built with the same ionization mode and noise cutoff.
+
+    Args:
+        compound (dict): Cache entry with an 'exp' parsed formula
+        ion (str): Ionization mode of the cache ('pos' or 'neg')
+        noise_cutoff (float): Noise cutoff the cache was built with
+
+    Returns:
+        list: [mass, abundance, isotope_name] entries as in 'isotope_mass_list'
+    """
+    return get_isotop_variants_mass(compound['exp'], ion,
+                                    argparse.Namespace(noise_cutoff=noise_cutoff, debug=False))
+
+
+def get_isotope_offset_range(compounds):
+    """Get the range of isotope variant mass offsets from the monoisotopic mass.
+
+    Entries of masses-only caches have no variants yet; for those the range is
+    bounded by replacing every atom of the formula with its lightest or its
+    heaviest isotope.
+
+    Args:
+        compounds (dict): Compound entries keyed by compound ID
+
+    Returns:
+        tuple: (lowest, highest) offset of any variant; lowest <= 0 <= highest
+    """
+    low, high = 0.0, 0.0
+    for data in compounds.values():
+        isotope_mass_list = data['isotope_mass_list']
+        if isotope_mass_list:
+            variant_masses = [each_mass[0] for each_mass in isotope_mass_list]
+            low = min(low, min(variant_masses) - variant_masses[0])
+            high = max(high, max(variant_masses) - variant_masses[0])
+        elif 'exp' in data:
+            formula_low, formula_high = 0.0, 0.0
+            for isotopes, n_atoms in data['exp']:
+                isotope_masses = [isotope['exact_mass'] for isotope in isotopes]
+                formula_low += n_atoms * (min(isotope_masses) - isotope_masses[0])
+                formula_high += n_atoms * (max(isotope_masses) - isotope_masses[0])
+            low, high = min(low, formula_low), max(high, formula_high)
+    return low, high
+
+
+def get_detection_floor(intensities, floor=None, percentile=None):
+    """Get the lowest intensity at which an isotope variant peak can be observed.
+
+    Args:
+        intensities (np.ndarray): Peak intensities of the sample
+        floor (float, optional): Absolute intensity floor
+        percentile (float, optional): Percentile (0-100) of the sample
+            intensities to use as the floor
+
+    Returns:
+        float: The higher of the given floors, or None if no positive floor
+            is given
+    """
+    floors = []
+    if floor is not None:
+        floors.append(floor)
+    if percentile is not None and len(intensities):
+        floors.append(float(np.percentile(intensities, percentile)))
+    if not floors or max(floors) <= 0:
+        return None
+    return max(floors)
+
+
+def get_expansion_cache_file(cache_file):
+    """Get the side cache file holding expanded variants of a masses-only cache."""
+    return os.path.splitext(cache_file)[0] + '.expanded.pkl'
+
+
+def load_expanded_variants(cache_file, metadata):
+    """Load previously expanded isotope variants of a masses-only cache.
+
+    Args:
+        cache_file (str): Path to the masses-only cache file
+        metadata (dict): Metadata of the masses-only cache
+
+    Returns:
+        dict: isotope_mass_list keyed by compound ID; empty if there is no side
+            cache or it was expanded from another build of the cache
+    """
+    side_file = get_expansion_cache_file(cache_file)
+    if not os.path.exists(side_file):
+        return {}
+    side_cache = load_cache(side_file)
+    expanded_from = side_cache['metadata'].get('expanded_from', {})
+    if expanded_from.get('creation_date') != metadata.get('creation_date'):
+        return {}
+    return {co: data['isotope_mass_list'] for co, data in side_cache['compounds'].items()}
+
+
+def save_expanded_variants(cache_file, metadata, compounds, expanded):
+    """Persist expanded isotope variants of a masses-only cache to its side cache.
+
+    The side cache is a regular cache holding only the expanded compounds.
+
+    Args:
+        cache_file (str): Path to the masses-only cache file
+        metadata (dict): Metadata of the masses-only cache
+        compounds (dict): Compound entries of the masses-only cache
+        expanded (dict): isotope_mass_list keyed by compound ID
+    """
+    side_metadata = dict(metadata)
+    side_metadata['command_line'] = dict(metadata.get('command_line', {}), masses_only=False)
+    side_metadata['expanded_from'] = {
+        'cache_file': cache_file,
+        'creation_date': metadata.get('creation_date')
+    }
+    side_compounds = {co: dict(compounds[co], isotope_mass_list=isotope_mass_list)
+                      for co, isotope_mass_list in expanded.items() if co in compounds}
+    write_cache(get_expansion_cache_file(cache_file), side_metadata, side_compounds)
+
+
+def get_grid_output_file(output_file, ppm, vppm):
+    """Get the report file of one grid point of a parameter sweep.
+
+    Args:
+        output_file (str): Output file given on the command line
+        ppm (float): PPM tolerance of the grid point
+        vppm (float): Verification PPM of the grid point
+
+    Returns:
+        str: output_file with _p<PPM>_vp<VPPM> added before the extension
+    """
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_p{ppm:g}_vp{vppm:g}{ext}"
+
+
+def read_ids_file(ids_file):
+    """Read compound IDs, one per line, from a file.
+
+    Only the first tab-separated field of each line is used. Empty lines and
+    comment lines starting with '#' are skipped.
+
+    Args:
+        ids_file (str): Path to the ID list
+
+    Returns:
+        list: Compound IDs in file order
+    """
+    ids = []
+    with open(ids_file) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            ids.append(line.split('\t')[0].strip())
+    return ids
+
+
+def build_composition_matrix(compounds):
+    """Build the element composition matrix of a set of compounds.
+
+    Elements are read from the chemical formula strings, so this works for
+    every kind of cache entry.
+
+    Args:
+        compounds (dict): Compound entries keyed by compound ID
+
+    Returns:
+        tuple: (matrix, elements) where matrix is a boolean array with one row
+            per compound (in dict order) and one column per element symbol in
+            elements, True where the compound contains the element
+    """
+    element_sets = [set(re.findall(r'[A-Z][a-z]?', data['cf'])) for data in compounds.values()]
+    elements = sorted(set().union(*element_sets))
+    columns = {element: i for i, element in enumerate(elements)}
+    matrix = np.zeros((len(element_sets), len(elements)), dtype=bool)
+    for row, element_set in enumerate(element_sets):
+        matrix[row, [columns[element] for element in element_set]] = True
+    return matrix, elements
+
+
+def select_compound_rows(compounds, elements=None, required_elements=None, ids=None, mass_range=None):
+    """Select the compounds passing all given filters.
+
+    The filters are evaluated as boolean masks over the composition matrix,
+    the compound ID array and the monoisotopic mass array.
+
+    Args:
+        compounds (dict): Compound entries keyed by compound ID
+        elements (list, optional): Keep compounds made only of these elements
+        required_elements (list, optional): Keep compounds containing all of these elements
+        ids (list, optional): Keep these compound IDs; an empty list keeps none
+        mass_range (tuple, optional): (min, max) monoisotopic mass, inclusive
+
+    Returns:
+        dict: The selected compound entries in cache order
+    """
+    keys = list(compounds)
+    mask = np.ones(len(keys), dtype=bool)
+
+    if elements or required_elements:
+        matrix, matrix_elements = build_composition_matrix(compounds)
+        if elements:
+            other = [i for i, element in enumerate(matrix_elements) if element not in elements]
+            mask &= ~matrix[:, other].any(axis=1)
+        if required_elements:
+            missing = [element for element in required_elements if element not in matrix_elements]
+            if missing:
+                mask[:] = False
+            else:
+                required = [matrix_elements.index(element) for element in required_elements]
+                mask &= matrix[:, required].all(axis=1)
+    if ids is not None:
+        id_set = set(ids)
+        mask &= np.fromiter((co in id_set for co in keys), dtype=bool, count=len(keys))
+    if mass_range:
+        masses = np.array([compounds[co]['mass'] for co in keys], dtype=np.float64)
+        mask &= (masses >= mass_range[0]) & (masses <= mass_range[1])
+
+    return {keys[i]: compounds[keys[i]] for i in np.flatnonzero(mask)}
+
+
 def calculate_formula_mass(chemical_formula):
     """Calculate molecular mass from a chemical formula string.
     
@@ -229,6 +655,123 @@ def calculate_formula_mass(chemical_formula):
         return None
 
 
+def build_compound_table(compound_sets):
+    """Combine the compounds of several caches into one table keyed by compound ID.
+
+    Args:
+        compound_sets (list): Compound mappings of the caches, in method order
+
+    Returns:
+        dict: Table with the keys
+            - ids: compound IDs in order of first appearance across the caches
+            - compound_ids: per cache, its compound IDs in cache order
+            - positions: int64 array (IDs x caches) with the position of each ID
+              in compound_ids of every cache, or -1 where a cache lacks it
+            - masses: float64 array (IDs x caches) of monoisotopic masses, NaN
+              where a cache lacks the ID
+            - owner: int64 array with the first cache listing each ID; the
+              report takes formula, name and atom counts from that cache
+    """
+    id_rows = {}
+    row_positions = []
+    compound_ids = []
+    for cache_idx, compounds in enumerate(compound_sets):
+        ids = list(compounds)
+        compound_ids.append(ids)
+        for pos, co in enumerate(ids):
+            row = id_rows.get(co)
+            if row is None:
+                row = id_rows[co] = len(row_positions)
+                row_positions.append([-1] * len(compound_sets))
+            row_positions[row][cache_idx] = pos
+
+    positions = np.array(row_positions, dtype=np.int64).reshape(len(row_positions), len(compound_sets))
+    masses = np.full(positions.shape, np.nan)
+    for cache_idx, compounds in enumerate(compound_sets):
+        cache_masses = np.fromiter((compounds[co]['mass'] for co in compound_ids[cache_idx]),
+                                   dtype=np.float64, count=len(compound_ids[cache_idx]))
+        present = positions[:, cache_idx] >= 0
+        masses[present, cache_idx] = cache_masses[positions[present, cache_idx]]
+
+    return {
+        'ids': list(id_rows),
+        'compound_ids': compound_ids,
+        'positions': positions,
+        'masses': masses,
+        'owner': np.argmax(positions >= 0, axis=1),
+    }
+
+
+def find_formula_conflicts(table, compound_sets):
+    """Find compound IDs listed with different formulas by different caches.
+
+    Formulas are compared with the formula of the owning cache of each ID.
+    Differently written formulas of the same mass (within 1e-6) are not
+    conflicts. The mass of each distinct formula is calculated once.
+
+    Args:
+        table (dict): Compound table from build_compound_table()
+        compound_sets (list): Compound mappings of the caches, in method order
+
+    Returns:
+        list: (row, cache_idx, formula, owner_formula, mass, owner_mass, is_conflict)
+            tuples in cache order and, within a cache, in compound order;
+            masses are None for formulas that cannot be parsed
+    """
+    positions = table['positions']
+    owner = table['owner']
+    formulas = np.full(positions.shape, None, dtype=object)
+    for cache_idx, compounds in enumerate(compound_sets):
+        present = np.flatnonzero(positions[:, cache_idx] >= 0)
+        ids = table['compound_ids'][cache_idx]
+        formulas[present, cache_idx] = [compounds[ids[pos]]['cf'] for pos in positions[present, cache_idx]]
+    owner_formulas = formulas[np.arange(len(owner)), owner]
+
+    differs = (positions >= 0) & (formulas != owner_formulas[:, None])
+    rows, caches = np.nonzero(differs)
+    # Report in cache order, then in the compound order of the cache
+    order = np.lexsort((positions[rows, caches], caches))
+    rows, caches = rows[order], caches[order]
+
+    formula_masses = {}
+    for formula in set(formulas[rows, caches]) | set(owner_formulas[rows]):
+        formula_masses[formula] = calculate_formula_mass(formula)
+
+    conflicts = []
+    for row, cache_idx in zip(rows.tolist(), caches.tolist()):
+        formula, owner_formula = formulas[row, cache_idx], owner_formulas[row]
+        mass, owner_mass = formula_masses[formula], formula_masses[owner_formula]
+        is_conflict = mass is None or owner_mass is None or abs(mass - owner_mass) > 1e-6
+        conflicts.append((row, cache_idx, formula, owner_formula, mass, owner_mass, is_conflict))
+    return conflicts
+
+
+# Per-sample matching function of the running analysis. Sample worker processes
+# inherit it, together with the loaded caches, when the pool is forked.
+_sample_matcher = None
+
+
+def _match_sample_job(sample_file):
+    """Match one sample in a worker process with the inherited matcher."""
+    try:
+        return _sample_matcher(sample_file)
+    except SystemExit:
+        # load_sample_peaks prints the reason and exits on unreadable files; a
+        # worker must hand the failure back to the parent instead
+        sys.stdout.flush()
+        raise RuntimeError(f"Could not load sample file '{sample_file}'")
+
+
+# Matching function for one m/z partition of a sample, inherited by partition
+# worker processes like _sample_matcher
+_partition_matcher = None
+
+
+def _match_partition_job(task):
+    """Match one m/z partition (cells, peaks, floor) in a worker process."""
+    return _partition_matcher(*task)
+
+
 def create_logger(log_fp, debug_fp, args):
     """Create a logger function with access to file handles and args.
     
@@ -270,25 +813,102 @@ def main():
     """Main entry point for analysis tool."""
     ap = argparse.ArgumentParser(description="Molecular Isotope Mass Identifier")
 
-    ap.add_argument("-p", "--ppm", dest="ppm", type=float,
-                    help="Parts per million for the mono isotopic mass of chemical formula",  required=True)
-    ap.add_argument("-vp", dest="vppm", type=float,
-                    help="Parts per million for verification of isotopes",  required=True)
+    ppm_group = ap.add_mutually_exclusive_group(required=True)
+    ppm_group.add_argument("-p", "--ppm", dest="ppm", type=float,
+                           help="Parts per million for the mono isotopic mass of chemical formula")
+    ppm_group.add_argument("--ppm-grid", dest="ppm_grid", type=float, nargs='+', metavar="PPM",
+                           help="Sweep over these PPM values, writing one report per grid point")
+    vppm_group = ap.add_mutually_exclusive_group(required=True)
+    vppm_group.add_argument("-vp", dest="vppm", type=float,
+                            help="Parts per million for verification of isotopes")
+    vppm_group.add_argument("--vppm-grid", dest="vppm_grid", type=float, nargs='+', metavar="VPPM",
+                            help="Sweep over these verification PPM values, writing one report per grid point")
     ap.add_argument("-g", '--debug', dest="debug", action='store_true', help=argparse.SUPPRESS, default=False)
 
     ap.add_argument("-c", "--cache", dest="cache_files", help="Binary DB input file(s)",
                     metavar="DBBINARY", nargs='+', required=True)
     ap.add_argument("-s", "--sample", dest="samples", help="Input sample file",
                     metavar="SAMPLE", nargs='+',  required=True)
+    ap.add_argument("-n", "--noise", dest="noise_cutoff", type=float, default=None, metavar="CUTOFF",
+                    help="Verify only cached isotope variants with molecular relative abundance of at least CUTOFF; must not be lower than the cutoff the caches were built with (defaults to all cached variants). This is not the same as rebuilding the caches with -n CUTOFF, which also drops variants containing any isotope group below CUTOFF")
+    ap.add_argument("--min-snr", dest="min_snr", type=float, metavar="S",
+                    help="Drop sample peaks less than S noise standard deviations above the noise level of their m/z window before matching")
+    ap.add_argument("--top-peaks", dest="top_peaks", type=int, metavar="N",
+                    help="Keep only the N most intense sample peaks of every m/z window before matching")
+    ap.add_argument("--noise-window", dest="noise_window", type=float, default=10.0, metavar="DA",
+                    help="Width of the m/z windows used by --min-snr and --top-peaks (default: 10.0)")
+    ap.add_argument("--blank", dest="blank_files", nargs='+', metavar="BLANK",
+                    help="Blank or solvent peak list(s); sample peaks within tolerance of a blank peak are removed before matching")
+    ap.add_argument("--blank-ppm", dest="blank_ppm", type=float, metavar="PPM",
+                    help="Parts per million for matching sample peaks to blank peaks (defaults to the -p tolerance; required with --ppm-grid)")
+    ap.add_argument("--blank-fold", dest="blank_fold", type=float, metavar="FOLD",
+                    help="Keep sample peaks at least FOLD times as intense as the blank peaks they match")
+    ap.add_argument("--detection-floor", dest="detection_floor", type=float, metavar="INTENSITY",
+                    help="Skip verifying isotope variants whose expected intensity (monoisotopic peak intensity x relative abundance) is below INTENSITY")
+    ap.add_argument("--detection-percentile", dest="detection_percentile", type=float, metavar="P",
+                    help="Skip verifying isotope variants whose expected intensity is below the P-th percentile of the sample's peak intensities")
+    ap.add_argument("--min-iso-count", dest="min_iso_count", type=int, metavar="K",
+                    help="Report only matches with at least K matched isotope variants")
+    ap.add_argument("--min-iso-valid", dest="min_iso_valid", type=int, metavar="K",
+                    help="Report only matches with at least K valid isotope variants")
+    ap.add_argument("-i", "--ion", dest="ion", choices=['pos', 'neg'], required=False,
+                    help="Expected ionisation mode of the cache file(s); caches built for another mode are rejected")
 
   
     ap.add_argument("--iso-valid", dest="include_iso_valid", action='store_true', 
                     help="Include valid isotope count column in output", default=False)
+    ap.add_argument("--no-shared-cache", dest="use_shared_cache", action='store_false', default=True,
+                    help="Always load the cache files, even when they are served by mimi_cache_serve")
+    ap.add_argument("--elements", dest="elements", nargs='+', metavar="ELEMENT",
+                    help="Analyze only compounds made of these elements (e.g. C H N O)")
+    ap.add_argument("--require-elements", dest="required_elements", nargs='+', metavar="ELEMENT",
+                    help="Analyze only compounds containing all of these elements (e.g. P)")
+    ap.add_argument("--ids-file", dest="ids_file",
+                    help="Analyze only the compound IDs listed in this file, one per line")
+    ap.add_argument("--mass-range", dest="mass_range", nargs=2, type=float, metavar=("MIN", "MAX"),
+                    help="Analyze only compounds with monoisotopic mass between MIN and MAX")
+    ap.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, metavar="N",
+                    help="Number of worker processes analysing samples in parallel (default: 1)")
+    ap.add_argument("--partitions", dest="partitions", type=int, default=1, metavar="N",
+                    help="Split each sample into N m/z partitions that are matched separately, in parallel with -j (default: 1)")
+    ap.add_argument("--save-expanded", dest="save_expanded", action='store_true', default=False,
+                    help="Save the isotope variants expanded for masses-only caches to a side cache (CACHE.expanded.pkl) that later runs reuse")
     
     ap.add_argument("-o", "--output", dest="out", required=True,
                     help="Output file", metavar="OUTPUT")
     args = ap.parse_args()
 
+    if args.jobs < 1:
+        ap.error("-j/--jobs must be at least 1")
+    if args.partitions < 1:
+        ap.error("--partitions must be at least 1")
+    if args.blank_fold is not None and args.blank_fold <= 0:
+        ap.error("--blank-fold must be positive")
+    if args.noise_window <= 0:
+        ap.error("--noise-window must be positive")
+    if args.top_peaks is not None and args.top_peaks < 1:
+        ap.error("--top-peaks must be at least 1")
+    if args.detection_percentile is not None and not 0 <= args.detection_percentile <= 100:
+        ap.error("--detection-percentile must be between 0 and 100")
+    if args.blank_files and args.ppm_grid and args.blank_ppm is None:
+        ap.error("--blank with --ppm-grid requires --blank-ppm")
+
+    # A sweep matches once at the widest tolerances and derives every grid
+    # point from those matches; each grid point gets its own report
+    ppm_values = args.ppm_grid or [args.ppm]
+    vppm_values = args.vppm_grid or [args.vppm]
+    is_sweep = bool(args.ppm_grid or args.vppm_grid)
+    grid = [(i, j) for i in range(len(ppm_values)) for j in range(len(vppm_values))]
+    if is_sweep:
+        output_files = [get_grid_output_file(args.out, ppm_values[i], vppm_values[j]) for i, j in grid]
+    else:
+        output_files = [args.out]
+    # Blanks are subtracted at the -p tolerance unless --blank-ppm is given;
+    # take it before args.ppm becomes the widest grid tolerance
+    blank_ppm = (args.blank_ppm if args.blank_ppm is not None else args.ppm) / 1000000 if args.blank_files else None
+    args.ppm = max(ppm_values)
+    args.vppm = max(vppm_values)
+
     full_command = ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:])
 
     # Create log directory if it doesn't exist and we're not logging to report
@@ -320,7 +940,7 @@ def main():
                 print(f"Error: Failed to create output directory '{output_dir}': {str(e)}")
                 sys.exit(1)
                 
-        out_fp = open(args.out, 'w')
+        out_fps = [open(output_file, 'w') for output_file in output_files]
     except FileNotFoundError as e:
         print(f"Error: Could not open output file: {str(e)}")
         sys.exit(1)
@@ -331,147 +951,217 @@ def main():
         print(f"Error: An unexpected error occurred: {str(e)}")
         sys.exit(1)
     
-    # Function to process a match between sample and database
-    def process_match(co, mass_idx, sample_idx, precomputed_chem, mi_pair_list, 
-                     aux_index_list, final_report, precomputed_chem_idx, data_sets,
-                     computation_methods, fields_per_method):
-        """Process a matching mass between sample and database."""
-        entry = [precomputed_chem[co]['cf'], co, precomputed_chem[co]['cname']]
-        exp = precomputed_chem[co]['exp']
-        mass = precomputed_chem[co]['mass']
-        isotope_mass_list = precomputed_chem[co]['isotope_mass_list']
-
-        # Get atom counts
-        C_count, H_count, N_count, O_count, P_count, S_count = get_atom_counts(exp)
-
-        # Initialize or get existing report entry
-        if entry[1] not in final_report:
-            output = [entry[0], entry[1], entry[2], 
-                     C_count, H_count, N_count, O_count, P_count, S_count] + ['NO_MAPPED_ID'] * len(computation_methods)
-            output[9 + precomputed_chem_idx] = str(mass)
-            output = output + [''] * fields_per_method * len(data_sets) * len(computation_methods)
-            final_report[entry[1]] = output
-        else:
-            output = final_report[entry[1]]
-            output[9 + precomputed_chem_idx] = str(mass)
-
-        # Validate isotope patterns
-        first_intensity = float(mi_pair_list[mass_idx][1])
-        matched_isotop_count = 0
-        valid_isotop_count = 0
+    def gather_variants(matched, first_intensities=None, floor=None, min_variants=0):
+        """Collect the isotope variants to verify of all compounds matched in one sample.
 
-        if args.debug:
+        Args:
+            matched (list): (cache index, compound ID) of every match
+            first_intensities (np.ndarray, optional): Monoisotopic peak intensity
+                of every match, used with floor
+            floor (float, optional): Detection floor; variants whose expected
+                intensity (first intensity x relative abundance) is below it
+                are not verified
+            min_variants (int): Matches with fewer variants left to verify
+                cannot reach the minimum isotope support; none of their
+                variants are collected
+
+        Returns the variant masses, abundances and owning match index as flat
+        arrays, the variant list of every match and the number of variants of
+        every match above the noise cutoff, whether verified or not.
+        """
+        variant_masses = []
+        variant_abundances = []
+        variant_owner = []
+        variant_lists = []
+        variant_totals = np.zeros(len(matched), dtype=np.int64)
+        for k, (cache_idx, co) in enumerate(matched):
+            isotope_mass_list = get_isotope_mass_list(co, precomputed_chem_files[cache_idx], cache_idx)
+            variants = filter_isotope_variants(isotope_mass_list, args.noise_cutoff)
+            variant_totals[k] = len(variants)
+            if floor is not None:
+                # Variants are ordered by abundance, so the observable ones are a
+                # prefix found with the floor as an abundance cutoff
+                abundance_floor = floor / first_intensities[k] if first_intensities[k] > 0 else np.inf
+                variants = filter_isotope_variants(isotope_mass_list, max(abundance_floor, args.noise_cutoff or 0.0))
+            if len(variants) < min_variants:
+                variants = []
+            variant_lists.append(variants)
+            variant_masses.extend(each_mass[0] for each_mass in variants)
+            variant_abundances.extend(each_mass[1] for each_mass in variants)
+            variant_owner.extend([k] * len(variants))
+        return (np.array(variant_masses, dtype=np.float64), np.array(variant_abundances, dtype=np.float64),
+                np.array(variant_owner, dtype=np.int64), variant_lists, variant_totals)
+
+    def log_isotope_hits(matched, variant_lists, first_intensities, peaks, hits):
+        """Write the isotope variant hits of every verified compound to the debug log."""
+        variant_idx, peak_idx, ratios, error_rates = hits
+        variant_starts = np.cumsum([0] + [len(variants) for variants in variant_lists])
+        hit_bounds = np.searchsorted(variant_idx, np.arange(variant_starts[-1] + 1))
+        for k, (cache_idx, co) in enumerate(matched):
             write_log('-' * 80, is_debug=True)
-
-        for each_mass in isotope_mass_list[1:]:
-            molecular_mass = each_mass[0]
-            molecular_abundance = each_mass[1]
-            
-            isotops_hits_index = search(mi_pair_list, molecular_mass, aux_index_list, args.vppm)
-
-            if len(isotops_hits_index) > 0:
-                matched_isotop_count += 1
-
-            found_valid_isotop = False
-            for each_isotop_hit_index in isotops_hits_index:
-                intensity = float(mi_pair_list[each_isotop_hit_index][1])
-                ms_isotopic_ratio = intensity / first_intensity
-                error_rate = abs(molecular_abundance - ms_isotopic_ratio) / abs(molecular_abundance)
-
-                if args.debug:
+            write_log(f'Isotope variants of {co} ({computation_methods[cache_idx]})', is_debug=True)
+            first_intensity = float(first_intensities[k])
+            matched_isotop_count = 0
+            for v, each_mass in enumerate(variant_lists[k], start=variant_starts[k]):
+                if hit_bounds[v] < hit_bounds[v + 1]:
+                    matched_isotop_count += 1
+                for h in range(hit_bounds[v], hit_bounds[v + 1]):
+                    intensity = float(peaks['intensity'][peak_idx[h]])
                     write_log('Hit ' + str(matched_isotop_count) + ':', is_debug=True)
                     write_log(f'{each_mass[2]} : {each_mass[0]}', is_debug=True)
-                    write_log('molecular_abundance: ' + str(molecular_abundance), is_debug=True)
+                    write_log('molecular_abundance: ' + str(each_mass[1]), is_debug=True)
                     write_log('intensity: ' + str(intensity), is_debug=True)
                     write_log('first_intensity: ' + str(first_intensity), is_debug=True)
                     write_log('Formula for ms_isotopic_ratio = intensity / first_intensity', is_debug=True)
-                    write_log('ms_isotopic_ratio = ' + f'{intensity} / {first_intensity} = {ms_isotopic_ratio}', is_debug=True)
+                    write_log('ms_isotopic_ratio = ' + f'{intensity} / {first_intensity} = {float(ratios[h])}', is_debug=True)
                     write_log('Formula for error_rate = |molecular_abundance - ms_isotopic_ratio| / |molecular_abundance|', is_debug=True)
-                    write_log('error_rate = ' + f'|{molecular_abundance} - {ms_isotopic_ratio}| / |{molecular_abundance}| = {error_rate}', is_debug=True)
-
-                if error_rate < 0.3:
-                    found_valid_isotop = True
-                    if args.debug:
-                        write_log('Valid hit(error_rate < 0.3)', is_debug=True)
-                    break
-                else:
-                    if args.debug:
-                        write_log('Invalid hit(error_rate >= 0.3)', is_debug=True)
-
-                if args.debug:
+                    write_log('error_rate = ' + f'|{each_mass[1]} - {float(ratios[h])}| / |{each_mass[1]}| = {float(error_rates[h])}', is_debug=True)
+                    if error_rates[h] < ISOTOPE_RATIO_TOLERANCE:
+                        write_log(f'Valid hit(error_rate < {ISOTOPE_RATIO_TOLERANCE})', is_debug=True)
+                        break
+                    write_log(f'Invalid hit(error_rate >= {ISOTOPE_RATIO_TOLERANCE})', is_debug=True)
                     write_log('-' * 80, is_debug=True)
-
-            if found_valid_isotop:
-                valid_isotop_count += 1
-
-        # Record results
-        base_idx = 9 + len(computation_methods)
-        entry_idx = base_idx + (sample_idx * fields_per_method * len(computation_methods))
-        entry_idx = entry_idx + fields_per_method * precomputed_chem_idx
-        
-        output[entry_idx] = mi_pair_list[mass_idx][0]
-        error = ((float(mass) - float(mi_pair_list[mass_idx][0]))/(float(mass))) * 1000000
-        output[entry_idx + 1] = str(error)
-        output[entry_idx + 2] = mi_pair_list[mass_idx][1]
-        output[entry_idx + 3] = str(matched_isotop_count)
-        if args.include_iso_valid:
-            output[entry_idx + 4] = str(valid_isotop_count)
-
-        # print()
-        # print('hello')
-        # print(len(output))
-        # print(len(computation_methods))
-        # print(len(data_sets))
-        # print(output)
-
-        # sys.exit()
-        # output[entry_idx + 4] = str(valid_isotop_count)
     
     # Load and display cache metadata
     precomputed_chem_files = []
     computation_methods = []
     cache_metadata = []
+    cache_sources = []
+    # Isotope variants expanded for masses-only caches, per cache and compound ID
+    expanded_variants = []
+    expanded_counts = []
+
+    def get_isotope_mass_list(co, precomputed_chem, precomputed_chem_idx):
+        """Get the isotope variants of a compound, expanding masses-only entries once."""
+        isotope_mass_list = precomputed_chem[co]['isotope_mass_list']
+        cmd_line = cache_metadata[precomputed_chem_idx].get('command_line', {})
+        if isotope_mass_list or not cmd_line.get('masses_only'):
+            return isotope_mass_list
+        expanded = expanded_variants[precomputed_chem_idx]
+        if co not in expanded:
+            expanded[co] = expand_isotope_variants(precomputed_chem[co], cmd_line['ionization_mode'],
+                                                   cmd_line.get('noise_cutoff') or 1e-5)
+            expanded_counts[precomputed_chem_idx] += 1
+        return expanded[co]
 
     write_log = create_logger(log_fp, debug_fp, args)
     cf_conflict_count = 0  # Track number of CF_CONFLICT cases
 
-    for cache in args.cache_files:
+    def close_files():
+        if log_fp:
+            log_fp.close()
+        if debug_fp:
+            debug_fp.close()
+        for out_fp in out_fps:
+            out_fp.close()
+
+    # Pre-flight check on the cache headers before loading any compounds
+    cache_paths = [resolve_cache_file(cache) for cache in args.cache_files]
+    cache_ion_modes = []
+    for cache_file in cache_paths:
+        try:
+            header = read_cache_header(cache_file)
+        except FileNotFoundError:
+            print(f"Error: Cache file '{cache_file}' not found.")
+            close_files()
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error reading cache header '{cache_file}': {str(e)}")
+            close_files()
+            sys.exit(1)
+        cmd_line = header['metadata'].get('command_line', {})
+        cache_ion_modes.append((cache_file, cmd_line.get('ionization_mode')))
+
+        cache_noise = cmd_line.get('noise_cutoff')
+        if args.noise_cutoff is not None and cache_noise is not None and args.noise_cutoff < cache_noise:
+            print(f"Warning: Noise cutoff {args.noise_cutoff} is below the cutoff of cache '{cache_file}' ({cache_noise}); "
+                  f"variants below {cache_noise} are not available in that cache.")
+
+    expected_ion = args.ion
+    for cache_file, ion_mode in cache_ion_modes:
+        if ion_mode is None:
+            continue
+        if expected_ion is None:
+            expected_ion = ion_mode
+        elif ion_mode != expected_ion:
+            print(f"Error: Cache file '{cache_file}' was built for ionization mode '{ion_mode}', "
+                  f"expected '{expected_ion}'.")
+            print("All cache files must use the same ionization mode: " +
+                  ", ".join(f"{c} ({m or 'Unknown'})" for c, m in cache_ion_modes))
+            close_files()
+            sys.exit(1)
+
+    # Samples are loaded one at a time while they are matched, so that memory
+    # does not grow with the number of samples
+    for each_asc_file in args.samples:
+        if not os.path.isfile(each_asc_file):
+            print(f"Error: Sample file '{each_asc_file}' not found.")
+            close_files()
+            sys.exit(1)
+    for blank_file in args.blank_files or []:
+        if not os.path.isfile(blank_file):
+            print(f"Error: Blank file '{blank_file}' not found.")
+            close_files()
+            sys.exit(1)
+
+    # Only compounds within PPM tolerance of a sample mass can match, so caches
+    # that store isotope variants separately (SQLite) only read those compounds'
+    # variants. The window is widened by one extra tolerance to absorb rounding.
+    # The sample mass range is only needed, and read, for such caches.
+    isotope_mass_range = None
+    if any(is_sqlite_cache(cache_file) for cache_file in cache_paths):
+        sample_masses = []
+        for each_asc_file in args.samples:
+            mass_range = get_sample_mass_range(each_asc_file)
+            if mass_range:
+                sample_masses.extend(mass_range)
+        if sample_masses:
+            margin = 2 * args.ppm / 1000000
+            isotope_mass_range = (min(sample_masses) * (1 - margin), max(sample_masses) * (1 + margin))
+
+    for cache, cache_file in zip(args.cache_files, cache_paths):
         # method_name = cache.split('_')
         method_name = os.path.basename(cache)
         computation_methods.append(method_name)
         try:
-            with open(cache + '.pkl', 'rb') as file:
-                cache_data = pickle.load(file)
-                cache_metadata.append(cache_data['metadata'])
-                precomputed_chem_files.append(cache_data['compounds'])
+            cache_data = attach_shared_cache(cache_file) if args.use_shared_cache else None
+            if cache_data is None:
+                cache_data = load_cache(cache_file, isotope_mass_range)
+            cache_sources.append(f"shared memory ({cache_data['segment']})" if 'segment' in cache_data else cache_file)
+            cache_metadata.append(cache_data['metadata'])
+            if cache_data['metadata'].get('command_line', {}).get('masses_only'):
+                expanded_variants.append(load_expanded_variants(cache_file, cache_data['metadata']))
+            else:
+                expanded_variants.append({})
+            expanded_counts.append(0)
+            precomputed_chem_files.append(cache_data['compounds'])
         except FileNotFoundError:
-            print(f"Error: Cache file '{cache}.pkl' not found.")
-            if log_fp:
-                log_fp.close()
-            if debug_fp:
-                debug_fp.close()
-            if out_fp:
-                out_fp.close()
+            print(f"Error: Cache file '{cache_file}' not found.")
+            close_files()
             sys.exit(1)
         except Exception as e:
-            print(f"Error loading cache file '{cache}.pkl': {str(e)}")
-            if log_fp:
-                log_fp.close()
-            if debug_fp:
-                debug_fp.close()
-            if out_fp:
-                out_fp.close()
+            print(f"Error loading cache file '{cache_file}': {str(e)}")
+            close_files()
             sys.exit(1)
 
-    # Load  sample metadata
-   
-    data_sets = []
-    for each_asc_file in args.samples:
-        mi_pair_list, sample_metadata = load_mass_spectrometry_data(each_asc_file)
-        mi_pair_list = sorted(mi_pair_list, key=lambda i: float(i[0]))
-        aux_index_list = get_hashed_index(mi_pair_list)
-        data_sets.append([mi_pair_list, aux_index_list, sample_metadata])
-        
+    # Restrict each cache to the selected compounds, so the matching below only
+    # sees those rows
+    filter_ids = None
+    if args.ids_file:
+        try:
+            filter_ids = read_ids_file(args.ids_file)
+        except FileNotFoundError:
+            print(f"Error: ID file '{args.ids_file}' not found.")
+            close_files()
+            sys.exit(1)
+    # Element lists may also be given comma-separated (e.g. C,H,N,O)
+    filter_elements = [e for arg in args.elements or [] for e in arg.split(',') if e]
+    filter_required = [e for arg in args.required_elements or [] for e in arg.split(',') if e]
+    cache_compound_counts = [len(compounds) for compounds in precomputed_chem_files]
+    if filter_elements or filter_required or args.ids_file or args.mass_range:
+        for idx, compounds in enumerate(precomputed_chem_files):
+            precomputed_chem_files[idx] = select_compound_rows(compounds, filter_elements, filter_required,
+                                                               filter_ids, args.mass_range)
 
     args.ppm = args.ppm/1000000
     args.vppm = args.vppm/1000000
@@ -488,8 +1178,38 @@ def main():
     write_log(f"Date: {datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}")
     mimi_version = pkg_resources.get_distribution('mimi').version
     write_log(f"MIMI Version: {mimi_version}")
-    write_log(f"PPM Tolerance: {args.ppm * 1000000}")
-    write_log(f"Verification PPM: {args.vppm * 1000000}")
+    if is_sweep:
+        write_log(f"PPM Grid: {' '.join(str(ppm) for ppm in ppm_values)}")
+        write_log(f"Verification PPM Grid: {' '.join(str(vppm) for vppm in vppm_values)}")
+    else:
+        write_log(f"PPM Tolerance: {args.ppm * 1000000}")
+        write_log(f"Verification PPM: {args.vppm * 1000000}")
+    write_log(f"Noise Cutoff: {args.noise_cutoff if args.noise_cutoff is not None else 'All cached variants'}")
+    if args.min_snr is not None:
+        write_log(f"Minimum S/N: {args.min_snr} (noise window {args.noise_window})")
+    if args.top_peaks is not None:
+        write_log(f"Top Peaks: {args.top_peaks} per {args.noise_window} window")
+    if args.blank_files:
+        write_log(f"Blank Files: {' '.join(args.blank_files)}")
+        write_log(f"Blank PPM: {args.blank_ppm if args.blank_ppm is not None else 'same as PPM tolerance'}")
+        if args.blank_fold is not None:
+            write_log(f"Blank Fold: {args.blank_fold}")
+    if args.detection_floor is not None:
+        write_log(f"Detection Floor: {args.detection_floor}")
+    if args.detection_percentile is not None:
+        write_log(f"Detection Percentile: {args.detection_percentile}")
+    if args.min_iso_count:
+        write_log(f"Minimum Isotope Count: {args.min_iso_count}")
+    if args.min_iso_valid:
+        write_log(f"Minimum Valid Isotopes: {args.min_iso_valid}")
+    if filter_elements:
+        write_log(f"Elements: only {' '.join(filter_elements)}")
+    if filter_required:
+        write_log(f"Required Elements: {' '.join(filter_required)}")
+    if args.ids_file:
+        write_log(f"ID File: {args.ids_file} ({len(filter_ids)} IDs)")
+    if args.mass_range:
+        write_log(f"Mass Range: {args.mass_range[0]} - {args.mass_range[1]}")
 
     
     write_log("-" * 80)
@@ -505,29 +1225,21 @@ def main():
         write_log(f"Full Command: {cmd_line.get('full_command') or 'Unknown'}")
         write_log(f"Creation Date: {metadata.get('creation_date') or 'Unknown'}")
         write_log(f"MIMI Version: {metadata.get('mimi_version') or 'Unknown'}")
-        write_log(f"Compounds: {len(precomputed_chem_files[idx])}")
+        write_log(f"Compounds: {cache_compound_counts[idx]}")
+        if len(precomputed_chem_files[idx]) != cache_compound_counts[idx]:
+            write_log(f"Selected Compounds: {len(precomputed_chem_files[idx])}")
+        write_log(f"Loaded From: {cache_sources[idx]}")
+        if cmd_line.get('masses_only'):
+            write_log(f"Masses Only: Yes ({len(expanded_variants[idx])} compounds already expanded)")
         write_log(f"Ionization Mode: {cmd_line.get('ionization_mode') or 'Unknown'}")
         write_log(f"Labeled Atoms File: {cmd_line.get('labeled_atoms_file') or 'None'}")
+        write_log(f"Noise Cutoff: {cmd_line.get('noise_cutoff') or 'Unknown'}")
         db_files = cmd_line.get('compound_db_files') if cmd_line else []
         if db_files:
             write_log(f"Compound DB Files: " + " ".join(str(x or 'Unknown') for x in db_files))
         else:
             write_log("Compound DB Files: None")
         write_log("-" * 80)
-    # Write sample information to log
-    write_log("\nSample Information:")
-    write_log("=" * 80)
-    for idx, sample_data in enumerate(data_sets):
-        metadata = sample_data[2]
-        write_log(f"\nSample {idx + 1}:{args.samples[idx]}")
-        write_log(f"Data points: {metadata['line_count']}")
-        write_log("-" * 80)
-    # Write blank line before data
-    write_log("\n")
-
-
-    
-  
     # first_row[4] = 'Reference Mass'
 
     # Define the fields per sample method (consistent across all samples)
@@ -554,215 +1266,347 @@ def main():
 
     field_names = field_names + field_per_sample
     
-    # Add log file path at the top of the report
-    out_fp.write(f"Log file\t{log_file}\n")
-    
-    out_fp.write('\t'.join(first_row))
-    out_fp.write('\n')
-    if len(computation_methods) > 1:
-        out_fp.write('\t'.join(second_row))
-        out_fp.write('\n')
-    out_fp.write('\t'.join(field_names))
-    out_fp.write('\n')
-
-    final_report = {}
+    for out_fp in out_fps:
+        # Add log file path at the top of the report
+        out_fp.write(f"Log file\t{log_file}\n")
 
-    # Create mass-based indices for efficient compound lookup
-    mass_indices = []
-    for precomputed_chem in precomputed_chem_files:
-        mass_indices.append(create_mass_hash_index(precomputed_chem))
-
-    # Determine search strategy based on relative sizes
-    for precomputed_chem_idx, precomputed_chem in enumerate(precomputed_chem_files):
-        db_size = len(precomputed_chem)
-        sample_sizes = [len(data[0]) for data in data_sets]
-        avg_sample_size = sum(sample_sizes) / len(sample_sizes)
-        
-        mass_index = mass_indices[precomputed_chem_idx]
-        
-        if db_size > 10 * avg_sample_size:
-            # Database much larger than samples - search from samples
-            ordered_matches = []  # Store matches in order of database appearance
-            compound_matches = set()  # Track which compounds have been matched
-            
-            # First pass - find all matches
-            for sample_idx, data_set in enumerate(data_sets):
-                mi_pair_list = data_set[0]
-                aux_index_list = data_set[1]
-                
-                # Add progress bar for sample processing
-                sample_desc = f"Processing sample {sample_idx+1}/{len(data_sets)}"
-                for mass_idx, mass_intensity in enumerate(tqdm(mi_pair_list, desc=sample_desc)):
-                    mass = float(mass_intensity[0])
-                    mass_int = int(mass)
-                    
-                    if args.debug:
-                        write_log('*' * 80, is_debug=True)
-                        write_log(f"Searching mass {mass} in sample {sample_idx}", is_debug=True)
-                    
-                    # Check compounds with similar integer mass
-                    candidate_compounds = []
-                    for m in range(mass_int - 1, mass_int + 2):
-                        if m in mass_index:
-                            candidate_compounds.extend(mass_index[m])
-                    
-                    # Check each candidate within PPM tolerance
-                    for co in candidate_compounds:
-                        if co not in compound_matches:  # Only process new matches
-                            compound_mass = precomputed_chem[co]['mass']
-                            if abs(mass - compound_mass) <= (compound_mass * args.ppm):
-                                compound_matches.add(co)
-                                ordered_matches.append((co, mass_idx, sample_idx))
-                                if args.debug:
-                                    write_log('-' * 80, is_debug=True)
-                                    write_log(f"Found match: {precomputed_chem[co]['cf']}", is_debug=True)
-            
-            # Second pass - process matches in database order
-            match_desc = f"Processing matches for database {precomputed_chem_idx+1}/{len(precomputed_chem_files)}"
-            for co in tqdm(precomputed_chem, desc=match_desc):
-                entry = [precomputed_chem[co]['cf'], co, precomputed_chem[co]['cname']]
-                
-                if entry[1] not in final_report:
-                    exp = precomputed_chem[co]['exp']
-                    mass = precomputed_chem[co]['mass']
-                    C_count, H_count, N_count, O_count, P_count, S_count = get_atom_counts(exp)
-                    output = [entry[0], entry[1], entry[2], 
-                            C_count, H_count, N_count, O_count, P_count, S_count] + ['NO_MAPPED_ID'] * len(computation_methods)
-                    output[9 + precomputed_chem_idx] = str(mass)
-                    output = output + [''] * fields_per_method * len(data_sets) * len(computation_methods)
-                    final_report[entry[1]] = output
-                    
-                
-                output = final_report[entry[1]]
-                output[9 + precomputed_chem_idx] = 'NO_MASS_MATCH'
-
-                if output[0] != precomputed_chem[co]['cf']:
-                    # Calculate masses to determine if this is a real conflict
-                    current_formula = precomputed_chem[co]['cf']
-                    existing_formula = output[0]
-                    current_mass = calculate_formula_mass(current_formula)
-                    existing_mass = calculate_formula_mass(existing_formula)
-                    
-                    # Only flag as CF_CONFLICT if masses are actually different
-                    if current_mass is None or existing_mass is None or abs(current_mass - existing_mass) > 1e-6:
-                        # Log CF_CONFLICT with detailed reason
-                        cf_conflict_count += 1
-                        write_log(f"CF_CONFLICT detected for compound ID: {co}")
-                        write_log(f"  Database {precomputed_chem_idx+1} ({computation_methods[precomputed_chem_idx]}): {current_formula} (mass: {current_mass:.6f})")
-                        write_log(f"  Existing entry: {existing_formula} (mass: {existing_mass:.6f})")
-                        write_log(f"  Compound name: {precomputed_chem[co]['cname']}")
-                        write_log(f"  Reason: Same compound ID found with different chemical formulas and masses across databases")
-                        output[9 + precomputed_chem_idx] = 'CF_CONFLICT'
-                    else:
-                        # Same mass, just different formula representation - log as info but don't flag conflict
-                        write_log(f"INFO: Formula representation difference for compound ID: {co}")
-                        write_log(f"  Database {precomputed_chem_idx+1} ({computation_methods[precomputed_chem_idx]}): {current_formula}")
-                        write_log(f"  Existing entry: {existing_formula}")
-                        write_log(f"  Both have same mass: {current_mass:.6f} - treating as equivalent formulas")
+        out_fp.write('\t'.join(first_row))
+        out_fp.write('\n')
+        if len(computation_methods) > 1:
+            out_fp.write('\t'.join(second_row))
+            out_fp.write('\n')
+        out_fp.write('\t'.join(field_names))
+        out_fp.write('\n')
 
-                final_report[entry[1]] = output
-                
-                if co in compound_matches:
-                    # Find all instances where this compound matched
-                    matches = [(m_idx, s_idx) for (c, m_idx, s_idx) in ordered_matches if c == co]
-                    for mass_idx, sample_idx in matches:
-                        process_match(co, mass_idx, sample_idx, precomputed_chem,
-                                   data_sets[sample_idx][0], data_sets[sample_idx][1], 
-                                   final_report, precomputed_chem_idx, data_sets, computation_methods, fields_per_method)
+    # Combine the caches into one table keyed by compound ID, with one mass
+    # column per method
+    table = build_compound_table(precomputed_chem_files)
+    positions = table['positions']
+    num_methods = len(computation_methods)
+
+    # Every (compound, method) cell with a mass is matched against each sample
+    # once, over the masses of all methods together
+    cell_rows, cell_caches = np.nonzero(positions >= 0)
+    cell_masses = table['masses'][cell_rows, cell_caches]
+
+    all_cells = np.arange(len(cell_masses))
+
+    # Blank peaks are merged once and removed from every sample before matching
+    blank_peaks = None
+    if args.blank_files:
+        blank_peaks = load_blank_peaks(args.blank_files, args.noise_window, args.min_snr, args.top_peaks)
+    ppm_tolerances = [ppm / 1000000 for ppm in ppm_values]
+    vppm_tolerances = [vppm / 1000000 for vppm in vppm_values]
+    point_keys = ('cells', 'mass', 'mass_text', 'intensity_text', 'iso_count', 'iso_valid')
+    point_counts = ('probes', 'skipped_probes', 'matches', 'dropped_matches')
+    min_iso_count = args.min_iso_count or 0
+    min_iso_valid = args.min_iso_valid or 0
+
+    def match_peaks(cells, peaks, floor=None):
+        """Match and verify compound cells against sample peaks.
+
+        Compounds are matched and their isotope variants collected and looked
+        up once, at the widest tolerances; the matches of every grid point
+        are selected from those. Variants expected below the detection floor
+        are not verified, nor are the variants of matches that cannot reach
+        the minimum isotope support; matches below it are dropped.
+
+        Returns the matches of every grid point in compact form: the matched
+        cells in ascending order with their peak mass, the peak text for the
+        report and the isotope counts, plus the number of isotope variants
+        probed and skipped and of matches dropped. Also returns the isotope variants expanded for
+        masses-only caches while verifying.
+        """
+        ppm_hits = first_ppm_hits_grid(cell_masses[cells], peaks['mass'], ppm_tolerances)
+        hit = np.logical_or.reduce([first_hits >= 0 for first_hits in ppm_hits])
+        matched_cells = cells[hit]
+        matched = [(cache_idx, table['compound_ids'][cache_idx][positions[row, cache_idx]])
+                   for row, cache_idx in zip(cell_rows[matched_cells].tolist(), cell_caches[matched_cells].tolist())]
+        first_intensities = [np.where(first_hits[hit] >= 0, peaks['intensity'][first_hits[hit]], np.nan)
+                             for first_hits in ppm_hits]
+
+        # In a sweep, variants are collected down to the floor of the most
+        # intense monoisotopic peak and pruned per grid point below
+        expanded_before = [len(expanded) for expanded in expanded_variants]
+        variant_masses, variant_abundances, variant_owner, variant_lists, variant_totals = gather_variants(
+            matched, np.fmax.reduce(first_intensities), floor, max(min_iso_count, min_iso_valid))
+        expanded = [(cache_idx, co, variants)
+                    for cache_idx, before in enumerate(expanded_before)
+                    for co, variants in list(expanded_variants[cache_idx].items())[before:]]
+
+        variant_idx, peak_idx = ppm_window_pairs(variant_masses, peaks['mass'], args.vppm)
+        vppm_pairs = []
+        for vppm in vppm_tolerances:
+            pair_hit = ppm_pair_mask(variant_masses, peaks['mass'], variant_idx, peak_idx, vppm)
+            vppm_pairs.append((variant_idx[pair_hit], peak_idx[pair_hit]))
+
+        points = []
+        for i, j in grid:
+            mass_idx = ppm_hits[i][hit]
+            found = mass_idx >= 0
+            pairs = vppm_pairs[j]
+            probed = np.ones(len(variant_masses), dtype=bool)
+            if floor is not None:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    abundance_floor = np.where(first_intensities[i] > 0, floor / first_intensities[i], np.inf)
+                probed = variant_abundances >= abundance_floor[variant_owner]
+                pairs = (pairs[0][probed[pairs[0]]], pairs[1][probed[pairs[0]]])
+            # Compounds matched only at a wider tolerance are verified too, but not reported
+            iso_count, iso_valid, isotope_hits = verify_isotope_envelopes(
+                variant_masses, variant_abundances, variant_owner, first_intensities[i],
+                peaks['mass'], peaks['intensity'], vppm_tolerances[j], pairs=pairs)
+            if args.debug and not is_sweep:
+                log_isotope_hits(matched, variant_lists, first_intensities[i], peaks, isotope_hits)
+            probes = int(variant_totals[found].sum())
+            skipped_probes = probes - int(np.count_nonzero(probed & found[variant_owner]))
+
+            # Matches below the minimum isotope support are dropped here, before
+            # any report field is formatted
+            supported = found & (iso_count >= min_iso_count) & (iso_valid >= min_iso_valid)
+            mass_idx = mass_idx[supported]
+            points.append({
+                'cells': matched_cells[supported],
+                'mass': peaks['mass'][mass_idx],
+                'mass_text': peaks['mass_text'][mass_idx],
+                'intensity_text': peaks['intensity_text'][mass_idx],
+                'iso_count': iso_count[supported],
+                'iso_valid': iso_valid[supported],
+                'probes': probes,
+                'skipped_probes': skipped_probes,
+                'matches': int(np.count_nonzero(found)),
+                'dropped_matches': int(np.count_nonzero(found & ~supported)),
+            })
+        return {'points': points, 'expanded': expanded}
+
+    def keep_expanded(expanded):
+        """Keep isotope variants expanded by a worker process for --save-expanded."""
+        for cache_idx, co, variants in expanded:
+            if co not in expanded_variants[cache_idx]:
+                expanded_variants[cache_idx][co] = variants
+                expanded_counts[cache_idx] += 1
+
+    # A sample split into m/z partitions gives every partition the peaks of its
+    # mass range plus margins for the monoisotopic and isotope variant windows
+    # of its compounds; the margins are widened by one extra tolerance to
+    # absorb rounding. The debug log follows compound order, so debug runs
+    # match samples whole.
+    partitions = 1 if args.debug else args.partitions
+    if partitions > 1:
+        isotope_offsets = [get_isotope_offset_range(compounds) for compounds in precomputed_chem_files]
+        offset_range = (min([low for low, _ in isotope_offsets], default=0.0),
+                        max([high for _, high in isotope_offsets], default=0.0))
+        partition_ppm = 2 * max(args.ppm, args.vppm)
+    partition_pool = None
+
+    def match_sample(sample_file):
+        """Match and verify all compound cells against one sample.
+
+        Returns the result of match_peaks for all cells, plus the sample
+        metadata and detection floor. With partitions, the partitions are
+        matched in turn or by the partition worker processes, and their
+        results are concatenated.
+        """
+        peaks, sample_metadata = load_sample_peaks(sample_file, args.noise_window, args.min_snr, args.top_peaks)
+        if blank_peaks is not None:
+            keep = blank_peak_mask(peaks['mass'], peaks['intensity'], blank_peaks['mass'], blank_peaks['intensity'],
+                                   blank_ppm, args.blank_fold)
+            sample_metadata['blank_removed'] = int(len(keep) - np.count_nonzero(keep))
+            peaks = {key: values[keep] for key, values in peaks.items()}
+        # The floor is taken over the whole sample, before any partitioning
+        floor = get_detection_floor(peaks['intensity'], args.detection_floor, args.detection_percentile)
+        if partitions == 1:
+            result = match_peaks(all_cells, peaks, floor)
+        else:
+            tasks = [(cells, {key: peaks[key][lo:hi] for key in ('mass', 'intensity', 'mass_text', 'intensity_text')},
+                      floor)
+                     for cells, lo, hi in mz_partitions(cell_masses, peaks['mass'], partitions,
+                                                        partition_ppm, offset_range)]
+            if partition_pool is not None:
+                partition_results = list(partition_pool.imap(_match_partition_job, tasks))
+            else:
+                partition_results = [match_peaks(*task) for task in tasks]
+
+            result = {'expanded': [item for part in partition_results for item in part['expanded']], 'points': []}
+            for k in range(len(grid)):
+                point = {}
+                for key in point_keys:
+                    point[key] = (np.concatenate([part['points'][k][key] for part in partition_results])
+                                  if partition_results else all_cells[:0])
+                order = np.argsort(point['cells'], kind='stable')
+                point = {key: values[order] for key, values in point.items()}
+                for key in point_counts:
+                    point[key] = sum(part['points'][k][key] for part in partition_results)
+                result['points'].append(point)
+        result['metadata'] = sample_metadata
+        result['floor'] = floor
+        return result
+
+    # Samples are matched in order, or by forked worker processes that share
+    # the loaded caches copy-on-write. imap keeps one sample per worker in
+    # flight and returns the results in sample order. With partitions, the
+    # workers match the partitions of one sample at a time instead. The debug
+    # log is a single open file, so debug runs stay in-process.
+    sample_desc = "Matching samples"
+    if args.debug:
+        jobs = 1
+    elif partitions > 1:
+        jobs = min(args.jobs, partitions)
+    else:
+        jobs = min(args.jobs, len(args.samples))
+    sample_results = []
+    if jobs > 1 and partitions == 1:
+        global _sample_matcher
+        _sample_matcher = match_sample
+        try:
+            with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                for result in tqdm(pool.imap(_match_sample_job, args.samples), total=len(args.samples), desc=sample_desc):
+                    keep_expanded(result.pop('expanded'))
+                    sample_results.append(result)
+        except RuntimeError as e:
+            print(f"Error: {str(e)}")
+            close_files()
+            sys.exit(1)
+        finally:
+            _sample_matcher = None
+    else:
+        if jobs > 1:
+            global _partition_matcher
+            _partition_matcher = match_peaks
+            partition_pool = multiprocessing.get_context('fork').Pool(jobs)
+        try:
+            for each_asc_file in tqdm(args.samples, desc=sample_desc):
+                result = match_sample(each_asc_file)
+                keep_expanded(result.pop('expanded'))
+                sample_results.append(result)
+        finally:
+            if partition_pool is not None:
+                partition_pool.terminate()
+                _partition_matcher = None
 
-                
+    # Write sample information to log
+    write_log("\nSample Information:")
+    write_log("=" * 80)
+    for idx, result in enumerate(sample_results):
+        metadata = result['metadata']
+        write_log(f"\nSample {idx + 1}:{args.samples[idx]}")
+        write_log(f"Data points: {metadata['line_count']}")
+        if args.min_snr is not None or args.top_peaks is not None:
+            write_log(f"Noise Peaks Removed: {metadata['removed_peaks']} "
+                      f"({metadata['line_count'] - metadata['removed_peaks']} peaks kept)")
+        if blank_peaks is not None:
+            write_log(f"Blank Peaks Removed: {metadata['blank_removed']}")
+        if result['floor'] is not None:
+            write_log(f"Detection Floor: {result['floor']}")
+        if result['floor'] is not None or min_iso_count or min_iso_valid:
+            for point_idx, point in enumerate(result['points']):
+                grid_label = ''
+                if is_sweep:
+                    ppm, vppm = ppm_values[grid[point_idx][0]], vppm_values[grid[point_idx][1]]
+                    grid_label = f" (PPM {ppm}, verification PPM {vppm})"
+                write_log(f"Isotope Probes{grid_label}: {point['probes'] - point['skipped_probes']} of "
+                          f"{point['probes']} verified, {point['skipped_probes']} skipped")
+                if min_iso_count or min_iso_valid:
+                    write_log(f"Matches Below Isotope Support{grid_label}: {point['dropped_matches']} of "
+                              f"{point['matches']} dropped")
+        write_log("-" * 80)
+    # Write blank line before data
+    write_log("\n")
 
+    conflict_cells = np.zeros(positions.shape, dtype=bool)
+    for row, cache_idx, formula, owner_formula, mass, owner_mass, is_conflict in \
+            find_formula_conflicts(table, precomputed_chem_files):
+        co = table['ids'][row]
+        mass_str = f"{mass:.6f}" if mass is not None else 'unknown'
+        owner_mass_str = f"{owner_mass:.6f}" if owner_mass is not None else 'unknown'
+        if is_conflict:
+            # Log CF_CONFLICT with detailed reason
+            cf_conflict_count += 1
+            conflict_cells[row, cache_idx] = True
+            write_log(f"CF_CONFLICT detected for compound ID: {co}")
+            write_log(f"  Database {cache_idx+1} ({computation_methods[cache_idx]}): {formula} (mass: {mass_str})")
+            write_log(f"  Existing entry: {owner_formula} (mass: {owner_mass_str})")
+            write_log(f"  Compound name: {precomputed_chem_files[cache_idx][co]['cname']}")
+            write_log(f"  Reason: Same compound ID found with different chemical formulas and masses across databases")
         else:
-            # Database smaller or comparable to samples - search from database 
-            db_desc = f"Processing database {precomputed_chem_idx+1}/{len(precomputed_chem_files)}"
-            for co in tqdm(precomputed_chem, desc=db_desc):
-                entry = [precomputed_chem[co]['cf'], co, precomputed_chem[co]['cname']]
-                
-                if args.debug:
-                    write_log('*' * 80, is_debug=True)
-                    write_log(entry[0], is_debug=True)
-            
-                exp = precomputed_chem[co]['exp']
-                mass = precomputed_chem[co]['mass']
-                isotope_mass_list = precomputed_chem[co]['isotope_mass_list']
-
-
-                if entry[1] not in final_report:
-                    exp = precomputed_chem[co]['exp']
-                    mass = precomputed_chem[co]['mass']
-                    C_count, H_count, N_count, O_count, P_count, S_count = get_atom_counts(exp)
-                    output = [entry[0], entry[1], entry[2], 
-                            C_count, H_count, N_count, O_count, P_count, S_count] + ['NO_MAPPED_ID'] * len(computation_methods)
-                    output[9 + precomputed_chem_idx] = str(mass)
-                    output = output + [''] * fields_per_method * len(data_sets) * len(computation_methods)
-                    final_report[entry[1]] = output
-                
-                output = final_report[entry[1]]
-                output[9 + precomputed_chem_idx] = 'NO_MASS_MATCH'
-
-                if output[0] != precomputed_chem[co]['cf']:
-                    # Calculate masses to determine if this is a real conflict
-                    current_formula = precomputed_chem[co]['cf']
-                    existing_formula = output[0]
-                    current_mass = calculate_formula_mass(current_formula)
-                    existing_mass = calculate_formula_mass(existing_formula)
-                    
-                    # Only flag as CF_CONFLICT if masses are actually different
-                    if current_mass is None or existing_mass is None or abs(current_mass - existing_mass) > 1e-6:
-                        # Log CF_CONFLICT with detailed reason
-                        cf_conflict_count += 1
-                        write_log(f"CF_CONFLICT detected for compound ID: {co}")
-                        write_log(f"  Database {precomputed_chem_idx+1} ({computation_methods[precomputed_chem_idx]}): {current_formula} (mass: {current_mass:.6f})")
-                        write_log(f"  Existing entry: {existing_formula} (mass: {existing_mass:.6f})")
-                        write_log(f"  Compound name: {precomputed_chem[co]['cname']}")
-                        write_log(f"  Reason: Same compound ID found with different chemical formulas and masses across databases")
-                        output[9 + precomputed_chem_idx] = 'CF_CONFLICT'
+            # Same mass, just different formula representation - log as info but don't flag conflict
+            write_log(f"INFO: Formula representation difference for compound ID: {co}")
+            write_log(f"  Database {cache_idx+1} ({computation_methods[cache_idx]}): {formula}")
+            write_log(f"  Existing entry: {owner_formula}")
+            write_log(f"  Both have same mass: {mass_str} - treating as equivalent formulas")
+
+    cell_index = np.full(positions.shape, -1, dtype=np.int64)
+    cell_index[cell_rows, cell_caches] = np.arange(len(cell_masses))
+
+    # Write one report per grid point; without a sweep, the only point is the
+    # command line tolerances
+    for point_idx, out_fp in enumerate(out_fps):
+        point_results = [result['points'][point_idx] for result in sample_results]
+
+        # Only compounds matched by at least one method in one sample are reported
+        cell_matched = np.zeros(len(cell_masses), dtype=bool)
+        for result in point_results:
+            cell_matched[result['cells']] = True
+        report_cells = np.flatnonzero(cell_matched)
+        report_rows = np.unique(cell_rows[report_cells])
+        row_index = {row: k for k, row in enumerate(report_rows.tolist())}
+
+        # Fill in the sample columns one sample at a time; the field of cell c in
+        # sample s starts at (s * methods + method of c) * fields_per_method
+        sample_fields = [[''] * fields_per_method * len(args.samples) * num_methods for _ in range(len(report_rows))]
+        for sample_idx, result in enumerate(point_results):
+            cell_masses_matched = cell_masses[result['cells']]
+            errors = ((cell_masses_matched - result['mass']) / cell_masses_matched) * 1000000
+            for k, cell in enumerate(result['cells'].tolist()):
+                fields = sample_fields[row_index[cell_rows[cell]]]
+                entry_idx = (sample_idx * num_methods + cell_caches[cell]) * fields_per_method
+                fields[entry_idx] = result['mass_text'][k]
+                fields[entry_idx + 1] = str(float(errors[k]))
+                fields[entry_idx + 2] = result['intensity_text'][k]
+                fields[entry_idx + 3] = str(result['iso_count'][k])
+                if args.include_iso_valid:
+                    fields[entry_idx + 4] = str(result['iso_valid'][k])
+
+        # Write results to output file with progress bar
+        if is_sweep:
+            ppm, vppm = ppm_values[grid[point_idx][0]], vppm_values[grid[point_idx][1]]
+            write_log(f"Writing results for PPM {ppm}, verification PPM {vppm} to {output_files[point_idx]}...")
+        else:
+            write_log("Writing results to output file...")
+        result_desc = "Writing results"
+        try:
+            for k, row in enumerate(tqdm(report_rows.tolist(), desc=result_desc)):
+                co = table['ids'][row]
+                owner = precomputed_chem_files[table['owner'][row]][co]
+                output = [owner['cf'], co, owner['cname']] + list(get_compound_atom_counts(owner))
+                for cache_idx in range(num_methods):
+                    cell = cell_index[row, cache_idx]
+                    if cell < 0:
+                        output.append('NO_MAPPED_ID')
+                    elif cell_matched[cell]:
+                        output.append(str(float(table['masses'][row, cache_idx])))
+                    elif conflict_cells[row, cache_idx]:
+                        output.append('CF_CONFLICT')
                     else:
-                        # Same mass, just different formula representation - log as info but don't flag conflict
-                        write_log(f"INFO: Formula representation difference for compound ID: {co}")
-                        write_log(f"  Database {precomputed_chem_idx+1} ({computation_methods[precomputed_chem_idx]}): {current_formula}")
-                        write_log(f"  Existing entry: {existing_formula}")
-                        write_log(f"  Both have same mass: {current_mass:.6f} - treating as equivalent formulas")
-
-                final_report[entry[1]] = output
-                
-                sample_idx = -1
-                for data_set in data_sets:
-                    mi_pair_list = data_set[0]
-                    aux_index_list = data_set[1]
-                    sample_idx += 1
-                    if args.debug:
-                        write_log('Searching in sample ' + str(sample_idx), is_debug=True)
-                    natural_hits_index = search(
-                        mi_pair_list, mass, aux_index_list, args.ppm)
-                    if len(natural_hits_index) > 0:
-                        process_match(co, natural_hits_index[0], sample_idx, precomputed_chem,
-                                   mi_pair_list, aux_index_list, final_report, 
-                                   precomputed_chem_idx, data_sets, computation_methods, fields_per_method)
-
-                
-             
-                
+                        output.append('NO_MASS_MATCH')
 
-                
-    # Write results to output file with progress bar
-    write_log("Writing results to output file...")
-    result_desc = "Writing results"
-    try:
-        for molecule in tqdm(final_report, desc=result_desc):
+                out_fp.write('\t'.join(str(x) for x in output + sample_fields[k]))
+                out_fp.write('\n')
+        except IOError as e:
+            print(f"Error: Failed to write to output file: {str(e)}")
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error: An unexpected error occurred while writing results: {str(e)}")
+            sys.exit(1)
 
-            if all(x == 'NO_MAPPED_ID' or x == 'NO_MASS_MATCH' or x == 'CF_CONFLICT' for x in final_report[molecule][9:9+len(computation_methods)]):
-                continue
+    # Report and optionally persist isotope variants expanded for masses-only caches
+    for idx, cache_file in enumerate(cache_paths):
+        if not cache_metadata[idx].get('command_line', {}).get('masses_only'):
+            continue
+        write_log(f"Expanded isotope variants of {expanded_counts[idx]} matching compounds in {cache_file}")
+        if args.save_expanded and expanded_counts[idx]:
+            save_expanded_variants(cache_file, cache_metadata[idx], precomputed_chem_files[idx], expanded_variants[idx])
+            write_log(f"Saved {len(expanded_variants[idx])} expanded compounds to {get_expansion_cache_file(cache_file)}")
 
-            out_fp.write('\t'.join(final_report[molecule]))
-            out_fp.write('\n')
-    except IOError as e:
-        print(f"Error: Failed to write to output file: {str(e)}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error: An unexpected error occurred while writing results: {str(e)}")
-        sys.exit(1)
-    
     # Print CF_CONFLICT summary if any were detected
     if cf_conflict_count > 0:
         print(f"\nWARNING: {cf_conflict_count} CF_CONFLICT(s) were detected during analysis.")
@@ -775,7 +1619,8 @@ def main():
         log_fp.close()
     if debug_fp:
         debug_fp.close()
-    out_fp.close()
+    for out_fp in out_fps:
+        out_fp.close()
 
 
 if __name__ == '__main__':
@@ -139,8 +139,8 @@ def load_labelled_atoms(jsonfile):
 
     :param jsonfile: Path to JSON file containing labeled atom data
     :type jsonfile: str
-    :returns: None
-    :rtype: None
+    :returns: Labeled isotope data keyed by element symbol
+    :rtype: dict
     :raises ValueError: If isotope data is invalid
     """
     global atom_dic
@@ -188,6 +188,7 @@ def load_labelled_atoms(jsonfile):
             raise ValueError(error_msg)
             
         atom_dic.update(sorted_data)
+        return sorted_data
     except ValueError as ve:
         raise
     except FileNotFoundError:
@@ -0,0 +1,520 @@
+# Copyright 2025 New York University. All Rights Reserved.
+
+# A license to use and copy this software and its documentation solely for your internal non-commercial
+# research and evaluation purposes, without fee and without a signed licensing agreement, is hereby granted
+# upon your download of the software, through which you agree to the following: 1) the above copyright
+# notice, this paragraph and the following three paragraphs will prominently appear in all internal copies
+# and modifications; 2) no rights to sublicense or further distribute this software are granted; 3) no rights
+# to modify this software are granted; and 4) no rights to assign this license are granted. Please contact
+# the NYU Technology Opportunities and Ventures TOVcommunications@nyulangone.org for commercial
+# licensing opportunities, or for further distribution, modification or license rights.
+
+# Created by Nabil Rahiman & Kristin Gunsalus
+
+# IN NO EVENT SHALL NYU, OR THEIR EMPLOYEES, OFFICERS, AGENTS OR TRUSTEES
+# ("COLLECTIVELY "NYU PARTIES") BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+# INCIDENTAL, OR CONSEQUENTIAL DAMAGES OF ANY KIND, INCLUDING LOST PROFITS, ARISING
+# OUT OF ANY CLAIM RESULTING FROM YOUR USE OF THIS SOFTWARE AND ITS
+# DOCUMENTATION, EVEN IF ANY OF NYU PARTIES HAS BEEN ADVISED OF THE POSSIBILITY
+# OF SUCH CLAIM OR DAMAGE.
+
+# NYU SPECIFICALLY DISCLAIMS ANY WARRANTIES OF ANY KIND REGARDING THE SOFTWARE,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE, OR THE ACCURACY OR USEFULNESS,
+# OR COMPLETENESS OF THE SOFTWARE. THE SOFTWARE AND ACCOMPANYING DOCUMENTATION,
+# IF ANY, PROVIDED HEREUNDER IS PROVIDED COMPLETELY "AS IS". NYU HAS NO OBLIGATION TO PROVIDE
+# FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
+
+"""
+Cache File Module
+
+This module reads and writes MIMI cache files. A cache file is a stream of
+pickled objects: a small header holding the cache metadata, followed by the
+compounds in chunks and a terminating None. The header can therefore be read
+without loading any compounds, and the compounds can be streamed chunk by chunk.
+
+After the terminating None, the file holds a lookup index: sorted compound IDs,
+formulas and monoisotopic masses stored as raw arrays, the byte offset of every
+chunk, and a small pickled descriptor. A fixed-size footer at the very end of
+the file points to the descriptor. The arrays are memory-mapped on access, so a
+lookup only touches the pages it needs plus the chunks holding the results.
+
+Caches written before the header was introduced hold a single pickled dict with
+'metadata' and 'compounds' keys; they are still read transparently.
+
+Chunks can optionally be compressed with zlib or lzma. Each compressed chunk
+is stored as a pickled bytes object and decompressed as it is read, so loading
+still streams chunk by chunk. The header records the codec and stays
+uncompressed, which lets readers detect compressed caches automatically.
+
+Caches can also be stored as SQLite databases (see mimi.cache_sqlite). The
+reading functions below detect them from the file content and dispatch to the
+SQLite backend, so callers do not need to know how a cache is stored.
+
+Functions:
+    write_cache: Write metadata and compounds to a cache file
+    read_cache_header: Read the header of a cache file
+    iter_cache_chunks: Iterate over the compound chunks of a cache file
+    iter_cache_compounds: Iterate over (compound_id, data) pairs of a cache file
+    load_cache: Load the complete contents of a cache file
+    read_cache_index: Memory-map the lookup index of a cache file
+    lookup_ids: Find cache positions of compound IDs
+    lookup_formula: Find cache positions of a chemical formula
+    lookup_mass_range: Find cache positions within a monoisotopic mass range
+    read_compounds_at: Read the compounds at given cache positions
+    select_compounds: Select compounds matching ID, formula and mass filters
+    resolve_cache_file: Find the cache file for a cache name given without extension
+"""
+
+import lzma
+import os
+import pickle
+import struct
+import zlib
+import numpy as np
+from mimi.cache_sqlite import (is_sqlite_cache, write_sqlite_cache, read_sqlite_header,
+                               iter_sqlite_chunks, select_sqlite_compounds)
+
+CACHE_FORMAT = 'mimi-cache'
+CACHE_FORMAT_VERSION = 2
+CHUNK_SIZE = 1000
+
+INDEX_MAGIC = b'MIMIIDX1'
+INDEX_FOOTER = struct.Struct('<8sQ')
+
+# Chunk compression codecs; each provides compress() and decompress()
+COMPRESSION_CODECS = {
+    'zlib': zlib,
+    'lzma': lzma
+}
+
+# File extension per storage backend, in lookup order
+CACHE_EXTENSIONS = {
+    'pickle': '.pkl',
+    'sqlite': '.sqlite'
+}
+
+
+def resolve_cache_file(cache):
+    """Find the cache file for a cache name given without extension.
+
+    Args:
+        cache (str): Cache path without extension (e.g. 'outdir/nat')
+
+    Returns:
+        str: Path of the first existing file among the storage extensions, or
+            the pickle path if none exists
+    """
+    for extension in CACHE_EXTENSIONS.values():
+        if os.path.exists(cache + extension):
+            return cache + extension
+    return cache + CACHE_EXTENSIONS['pickle']
+
+
+def _sorted_keys(values, dtype):
+    """Return (sorted_values, positions) arrays for a list of values."""
+    array = np.asarray(values, dtype=dtype)
+    order = np.argsort(array, kind='stable')
+    return array[order], order.astype(np.int64)
+
+
+def _dump_chunk(chunk, f, compression=None):
+    """Pickle a chunk (or the terminating None) to an open cache file."""
+    if compression is None or chunk is None:
+        pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return
+    data = pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle.dump(COMPRESSION_CODECS[compression].compress(data), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_chunk(f, compression=None):
+    """Read the next chunk from an open cache file, or None at the end of the compounds."""
+    chunk = pickle.load(f)
+    if compression is None or chunk is None:
+        return chunk
+    return pickle.loads(COMPRESSION_CODECS[compression].decompress(chunk))
+
+
+def _write_index(f, compound_count, chunk_size, chunk_offsets, ids, formulas, masses, compression=None):
+    """Append the lookup index and footer to an open cache file."""
+    encoded_ids = [co.encode('utf-8') for co in ids]
+    encoded_formulas = [cf.encode('utf-8') for cf in formulas]
+    id_keys, id_pos = _sorted_keys(encoded_ids, np.bytes_ if encoded_ids else 'S1')
+    cf_keys, cf_pos = _sorted_keys(encoded_formulas, np.bytes_ if encoded_formulas else 'S1')
+    mass_keys, mass_pos = _sorted_keys(masses, np.float64)
+
+    arrays = {
+        'chunk_offsets': np.asarray(chunk_offsets, dtype=np.int64),
+        'ids': id_keys,
+        'id_pos': id_pos,
+        'cf': cf_keys,
+        'cf_pos': cf_pos,
+        'masses': mass_keys,
+        'mass_pos': mass_pos
+    }
+    layout = {}
+    for name, array in arrays.items():
+        layout[name] = (f.tell(), array.dtype.str, array.shape)
+        f.write(array.tobytes())
+
+    descriptor_offset = f.tell()
+    pickle.dump({
+        'compound_count': compound_count,
+        'chunk_size': chunk_size,
+        'compression': compression,
+        'arrays': layout
+    }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(INDEX_FOOTER.pack(INDEX_MAGIC, descriptor_offset))
+
+
+def write_cache(cache_file, metadata, compounds, chunk_size=CHUNK_SIZE, storage='pickle', compression=None):
+    """Write metadata and compounds to a cache file.
+
+    Args:
+        cache_file (str): Path to the output .pkl or .sqlite file
+        metadata (dict): Cache metadata (command line, creation date, version)
+        compounds (dict): Compound entries keyed by compound ID
+        chunk_size (int): Number of compounds stored per pickled chunk
+        storage (str): Storage backend, 'pickle' or 'sqlite'
+        compression (str, optional): Chunk compression codec, 'zlib' or 'lzma'
+            (pickle storage only)
+    """
+    header = {
+        'format': CACHE_FORMAT,
+        'format_version': CACHE_FORMAT_VERSION,
+        'metadata': metadata,
+        'compound_count': len(compounds),
+        'chunk_size': chunk_size,
+        'compression': compression
+    }
+    if storage == 'sqlite':
+        write_sqlite_cache(cache_file, header, compounds)
+        return
+
+    chunk_offsets = []
+    ids = []
+    formulas = []
+    masses = []
+    with open(cache_file, 'wb') as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        chunk = {}
+        for co, data in compounds.items():
+            chunk[co] = data
+            ids.append(co)
+            formulas.append(data['cf'])
+            masses.append(data['mass'])
+            if len(chunk) == chunk_size:
+                chunk_offsets.append(f.tell())
+                _dump_chunk(chunk, f, compression)
+                chunk = {}
+        if chunk:
+            chunk_offsets.append(f.tell())
+            _dump_chunk(chunk, f, compression)
+        _dump_chunk(None, f)
+
+        _write_index(f, len(compounds), chunk_size, chunk_offsets, ids, formulas, masses, compression)
+
+
+def _is_legacy(obj):
+    """Check whether the first object of a cache file is a legacy full cache."""
+    return not (isinstance(obj, dict) and obj.get('format') == CACHE_FORMAT)
+
+
+def _split_legacy(obj):
+    """Split a legacy cache object into (metadata, compounds).
+
+    The oldest caches are a bare compound dictionary without metadata.
+    """
+    if 'compounds' in obj:
+        return obj.get('metadata', {}), obj['compounds']
+    return {}, obj
+
+
+def read_cache_header(cache_file):
+    """Read the header of a cache file.
+
+    Only the header is unpickled, so this takes constant time regardless of the
+    number of compounds. Legacy caches have no header and are loaded in full.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+
+    Returns:
+        dict: Header with 'metadata', 'compound_count' and 'format_version' keys
+    """
+    if is_sqlite_cache(cache_file):
+        return read_sqlite_header(cache_file)
+
+    with open(cache_file, 'rb') as f:
+        first = pickle.load(f)
+
+    if _is_legacy(first):
+        metadata, compounds = _split_legacy(first)
+        return {
+            'format': CACHE_FORMAT,
+            'format_version': 1,
+            'metadata': metadata,
+            'compound_count': len(compounds)
+        }
+    return first
+
+
+def iter_cache_chunks(cache_file, isotope_mass_range=None):
+    """Iterate over the compound chunks of a cache file.
+
+    Args:
+        cache_file (str): Path to the .pkl or .sqlite cache file
+        isotope_mass_range (tuple, optional): (min, max) monoisotopic mass of
+            the compounds whose isotope variants are needed. SQLite caches then
+            return only the monoisotopic entry for other compounds; pickle
+            caches always return all variants.
+
+    Yields:
+        dict: Compound entries keyed by compound ID, at most chunk_size per chunk
+    """
+    if is_sqlite_cache(cache_file):
+        yield from iter_sqlite_chunks(cache_file, isotope_mass_range)
+        return
+
+    with open(cache_file, 'rb') as f:
+        first = pickle.load(f)
+        if _is_legacy(first):
+            yield _split_legacy(first)[1]
+            return
+
+        compression = first.get('compression')
+        while True:
+            chunk = _load_chunk(f, compression)
+            if chunk is None:
+                break
+            yield chunk
+
+
+def iter_cache_compounds(cache_file):
+    """Iterate over the compounds of a cache file without loading all of them.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+
+    Yields:
+        tuple: (compound_id, data) pairs in cache order
+    """
+    for chunk in iter_cache_chunks(cache_file):
+        yield from chunk.items()
+
+
+def load_cache(cache_file, isotope_mass_range=None):
+    """Load the complete contents of a cache file.
+
+    Args:
+        cache_file (str): Path to the .pkl or .sqlite cache file
+        isotope_mass_range (tuple, optional): (min, max) monoisotopic mass of
+            the compounds whose isotope variants are needed, see iter_cache_chunks
+
+    Returns:
+        dict: Cache data with 'metadata' and 'compounds' keys
+    """
+    if is_sqlite_cache(cache_file):
+        compounds = {}
+        for chunk in iter_sqlite_chunks(cache_file, isotope_mass_range):
+            compounds.update(chunk)
+        return {
+            'metadata': read_sqlite_header(cache_file).get('metadata', {}),
+            'compounds': compounds
+        }
+
+    with open(cache_file, 'rb') as f:
+        first = pickle.load(f)
+        if _is_legacy(first):
+            metadata, compounds = _split_legacy(first)
+            return {'metadata': metadata, 'compounds': compounds}
+
+        compression = first.get('compression')
+        compounds = {}
+        while True:
+            chunk = _load_chunk(f, compression)
+            if chunk is None:
+                break
+            compounds.update(chunk)
+
+    return {
+        'metadata': first.get('metadata', {}),
+        'compounds': compounds
+    }
+
+
+def read_cache_index(cache_file):
+    """Memory-map the lookup index of a cache file.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+
+    Returns:
+        dict: Index with 'compound_count', 'chunk_size', 'compression' and memory-mapped
+            'chunk_offsets', 'ids', 'id_pos', 'cf', 'cf_pos', 'masses' and
+            'mass_pos' arrays, or None if the cache has no index (legacy
+            caches and SQLite caches, which carry their own indexes)
+    """
+    if is_sqlite_cache(cache_file):
+        return None
+
+    with open(cache_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < INDEX_FOOTER.size:
+            return None
+        f.seek(-INDEX_FOOTER.size, os.SEEK_END)
+        magic, descriptor_offset = INDEX_FOOTER.unpack(f.read(INDEX_FOOTER.size))
+        if magic != INDEX_MAGIC:
+            return None
+        f.seek(descriptor_offset)
+        descriptor = pickle.load(f)
+
+    index = {
+        'compound_count': descriptor['compound_count'],
+        'chunk_size': descriptor['chunk_size'],
+        'compression': descriptor.get('compression')
+    }
+    for name, (offset, dtype, shape) in descriptor['arrays'].items():
+        if shape[0] == 0:
+            index[name] = np.empty(shape, dtype=dtype)
+        else:
+            index[name] = np.memmap(cache_file, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return index
+
+
+def _lookup_keys(keys, positions, values):
+    """Return the positions of all keys equal to any of the given values."""
+    found = []
+    for value in values:
+        lo = np.searchsorted(keys, value, side='left')
+        hi = np.searchsorted(keys, value, side='right')
+        found.append(np.asarray(positions[lo:hi]))
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(found)
+
+
+def lookup_ids(index, ids):
+    """Find the cache positions of compound IDs.
+
+    Args:
+        index (dict): Index from read_cache_index()
+        ids (list): Compound IDs to look up
+
+    Returns:
+        numpy.ndarray: Positions of the matching compounds (unordered)
+    """
+    return _lookup_keys(index['ids'], index['id_pos'], [co.encode('utf-8') for co in ids])
+
+
+def lookup_formula(index, formulas):
+    """Find the cache positions of compounds with the given chemical formulas.
+
+    Args:
+        index (dict): Index from read_cache_index()
+        formulas (list): Chemical formulas to look up (exact string match)
+
+    Returns:
+        numpy.ndarray: Positions of the matching compounds (unordered)
+    """
+    return _lookup_keys(index['cf'], index['cf_pos'], [cf.encode('utf-8') for cf in formulas])
+
+
+def lookup_mass_range(index, mass_min=None, mass_max=None):
+    """Find the cache positions of compounds within a monoisotopic mass range.
+
+    Args:
+        index (dict): Index from read_cache_index()
+        mass_min (float, optional): Lower bound (inclusive)
+        mass_max (float, optional): Upper bound (inclusive)
+
+    Returns:
+        numpy.ndarray: Positions of the matching compounds (unordered)
+    """
+    masses = index['masses']
+    lo = 0 if mass_min is None else np.searchsorted(masses, mass_min, side='left')
+    hi = len(masses) if mass_max is None else np.searchsorted(masses, mass_max, side='right')
+    return np.asarray(index['mass_pos'][lo:hi])
+
+
+def read_compounds_at(cache_file, index, positions):
+    """Read the compounds at the given cache positions.
+
+    Only the chunks that hold the requested compounds are unpickled (and
+    decompressed).
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+        index (dict): Index from read_cache_index()
+        positions (iterable): Cache positions (as returned by the lookup functions)
+
+    Yields:
+        tuple: (compound_id, data) pairs in cache order
+    """
+    chunk_size = index['chunk_size']
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    with open(cache_file, 'rb') as f:
+        chunk_number = None
+        chunk_items = None
+        for pos in positions:
+            if pos // chunk_size != chunk_number:
+                chunk_number = pos // chunk_size
+                f.seek(int(index['chunk_offsets'][chunk_number]))
+                chunk_items = list(_load_chunk(f, index['compression']).items())
+            yield chunk_items[pos % chunk_size]
+
+
+def select_compounds(cache_file, ids=None, formulas=None, mass_min=None, mass_max=None):
+    """Select compounds of a cache file matching all given filters.
+
+    Filters are resolved through the cache index when the cache has one, so
+    only the chunks holding matching compounds are read. SQLite caches are
+    queried through their own indexes. Caches without an
+    index are streamed and filtered compound by compound.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+        ids (list, optional): Compound IDs to select; an empty list selects none
+        formulas (list, optional): Chemical formulas to select (exact match)
+        mass_min (float, optional): Minimum monoisotopic mass (inclusive)
+        mass_max (float, optional): Maximum monoisotopic mass (inclusive)
+
+    Yields:
+        tuple: (compound_id, data) pairs in cache order
+    """
+    has_mass_filter = mass_min is not None or mass_max is not None
+    if ids is None and formulas is None and not has_mass_filter:
+        yield from iter_cache_compounds(cache_file)
+        return
+
+    if is_sqlite_cache(cache_file):
+        yield from select_sqlite_compounds(cache_file, ids, formulas, mass_min, mass_max)
+        return
+
+    index = read_cache_index(cache_file)
+    if index is not None:
+        selections = []
+        if ids is not None:
+            selections.append(lookup_ids(index, ids))
+        if formulas is not None:
+            selections.append(lookup_formula(index, formulas))
+        if has_mass_filter:
+            selections.append(lookup_mass_range(index, mass_min, mass_max))
+        positions = selections[0]
+        for selection in selections[1:]:
+            positions = np.intersect1d(positions, selection)
+        yield from read_compounds_at(cache_file, index, positions)
+        return
+
+    id_set = set(ids) if ids is not None else None
+    formula_set = set(formulas) if formulas is not None else None
+    for co, data in iter_cache_compounds(cache_file):
+        if id_set is not None and co not in id_set:
+            continue
+        if formula_set is not None and data['cf'] not in formula_set:
+            continue
+        if mass_min is not None and data['mass'] < mass_min:
+            continue
+        if mass_max is not None and data['mass'] > mass_max:
+            continue
+        yield co, data
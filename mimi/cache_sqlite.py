@@ -0,0 +1,231 @@
+# Copyright 2025 New York University. All Rights Reserved.
+
+# A license to use and copy this software and its documentation solely for your internal non-commercial
+# research and evaluation purposes, without fee and without a signed licensing agreement, is hereby granted
+# upon your download of the software, through which you agree to the following: 1) the above copyright
+# notice, this paragraph and the following three paragraphs will prominently appear in all internal copies
+# and modifications; 2) no rights to sublicense or further distribute this software are granted; 3) no rights
+# to modify this software are granted; and 4) no rights to assign this license are granted. Please contact
+# the NYU Technology Opportunities and Ventures TOVcommunications@nyulangone.org for commercial
+# licensing opportunities, or for further distribution, modification or license rights.
+
+# Created by Nabil Rahiman & Kristin Gunsalus
+
+# IN NO EVENT SHALL NYU, OR THEIR EMPLOYEES, OFFICERS, AGENTS OR TRUSTEES
+# ("COLLECTIVELY "NYU PARTIES") BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+# INCIDENTAL, OR CONSEQUENTIAL DAMAGES OF ANY KIND, INCLUDING LOST PROFITS, ARISING
+# OUT OF ANY CLAIM RESULTING FROM YOUR USE OF THIS SOFTWARE AND ITS
+# DOCUMENTATION, EVEN IF ANY OF NYU PARTIES HAS BEEN ADVISED OF THE POSSIBILITY
+# OF SUCH CLAIM OR DAMAGE.
+
+# NYU SPECIFICALLY DISCLAIMS ANY WARRANTIES OF ANY KIND REGARDING THE SOFTWARE,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE, OR THE ACCURACY OR USEFULNESS,
+# OR COMPLETENESS OF THE SOFTWARE. THE SOFTWARE AND ACCOMPANYING DOCUMENTATION,
+# IF ANY, PROVIDED HEREUNDER IS PROVIDED COMPLETELY "AS IS". NYU HAS NO OBLIGATION TO PROVIDE
+# FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
+
+"""
+SQLite Cache Module
+
+This module reads and writes MIMI caches stored as SQLite databases instead of
+pickle streams. The database holds three tables:
+
+    header:    the pickled cache header (format, metadata, compound count)
+    compounds: one row per compound (pos, id, cf, cname, mass, exp), with
+               B-tree indexes on id, cf and mass
+    variants:  one row per isotope variant (pos, rank, mass, abundance,
+               isotope_formula); rank 0 is the monoisotopic entry
+
+Readers open the database read-only, so any number of processes can query the
+same file and share it through the OS page cache. Monoisotopic mass ranges are
+answered by the mass index without reading the other compounds, and isotope
+variants are only read for the compounds that need them.
+
+The functions mirror those of mimi.cache, which dispatches to them when a
+cache file is an SQLite database.
+"""
+
+import json
+import pathlib
+import pickle
+import sqlite3
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+SCHEMA = """
+CREATE TABLE header (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+CREATE TABLE compounds (
+    pos INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    cf TEXT NOT NULL,
+    cname TEXT,
+    mass REAL NOT NULL,
+    exp BLOB NOT NULL
+);
+CREATE TABLE variants (
+    pos INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    mass REAL NOT NULL,
+    abundance REAL NOT NULL,
+    isotope_formula TEXT NOT NULL,
+    PRIMARY KEY (pos, rank)
+) WITHOUT ROWID;
+"""
+
+INDEXES = """
+CREATE INDEX compounds_cf ON compounds (cf);
+CREATE INDEX compounds_mass ON compounds (mass);
+"""
+
+
+def is_sqlite_cache(cache_file):
+    """Check whether a cache file is an SQLite database."""
+    with open(cache_file, 'rb') as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def _connect(cache_file):
+    """Open an SQLite cache read-only."""
+    # Opening a missing file in read-only mode raises OperationalError, so
+    # raise the same error the pickle reader would
+    path = pathlib.Path(cache_file).resolve()
+    if not path.exists():
+        raise FileNotFoundError(2, 'No such file or directory', cache_file)
+    return sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+
+
+def write_sqlite_cache(cache_file, header, compounds):
+    """Write a header and compounds to an SQLite cache file.
+
+    An existing file is replaced. Indexes are created after the bulk insert,
+    which is considerably faster than maintaining them row by row.
+
+    Args:
+        cache_file (str): Path to the output database
+        header (dict): Cache header (format, metadata, compound count)
+        compounds (dict): Compound entries keyed by compound ID
+    """
+    path = pathlib.Path(cache_file)
+    if path.exists():
+        path.unlink()
+
+    conn = sqlite3.connect(cache_file)
+    try:
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT INTO header (key, value) VALUES ('header', ?)",
+                     (pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL),))
+        for pos, (co, data) in enumerate(compounds.items()):
+            conn.execute("INSERT INTO compounds (pos, id, cf, cname, mass, exp) VALUES (?, ?, ?, ?, ?, ?)",
+                         (pos, co, data['cf'], data['cname'], data['mass'],
+                          pickle.dumps(data['exp'], protocol=pickle.HIGHEST_PROTOCOL)))
+            conn.executemany("INSERT INTO variants (pos, rank, mass, abundance, isotope_formula) VALUES (?, ?, ?, ?, ?)",
+                             ((pos, rank, mass, abundance, name)
+                              for rank, (mass, abundance, name) in enumerate(data['isotope_mass_list'])))
+        conn.executescript(INDEXES)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def read_sqlite_header(cache_file):
+    """Read the header of an SQLite cache file."""
+    conn = _connect(cache_file)
+    try:
+        row = conn.execute("SELECT value FROM header WHERE key = 'header'").fetchone()
+    finally:
+        conn.close()
+    return pickle.loads(row[0])
+
+
+def _read_rows(conn, where='', params=(), isotope_mass_range=None):
+    """Read compounds matching a WHERE clause as (compound_id, data) pairs in cache order.
+
+    Compounds outside isotope_mass_range get only their monoisotopic entry in
+    'isotope_mass_list'; their other variants are not read.
+    """
+    rows = conn.execute(f"SELECT pos, id, cf, cname, mass, exp FROM compounds {where} ORDER BY pos",
+                        params).fetchall()
+    if not rows:
+        return []
+
+    sql = ("SELECT v.pos, v.mass, v.abundance, v.isotope_formula FROM compounds AS c "
+           "JOIN variants AS v ON v.pos = c.pos "
+           f"WHERE c.pos IN (SELECT pos FROM compounds {where})")
+    variant_params = list(params)
+    if isotope_mass_range is not None:
+        sql += " AND (v.rank = 0 OR c.mass BETWEEN ? AND ?)"
+        variant_params.extend(isotope_mass_range)
+    variants = {}
+    for pos, mass, abundance, name in conn.execute(sql + " ORDER BY v.pos, v.rank", variant_params):
+        variants.setdefault(pos, []).append([mass, abundance, name])
+
+    return [(co, {
+        'cf': cf,
+        'cname': cname,
+        'exp': pickle.loads(exp),
+        'mass': mass,
+        'isotope_mass_list': variants.get(pos, [])
+    }) for pos, co, cf, cname, mass, exp in rows]
+
+
+def iter_sqlite_chunks(cache_file, isotope_mass_range=None):
+    """Iterate over the compounds of an SQLite cache file in chunks.
+
+    Args:
+        cache_file (str): Path to the database
+        isotope_mass_range (tuple, optional): (min, max) monoisotopic mass of
+            the compounds whose isotope variants are needed
+
+    Yields:
+        dict: Compound entries keyed by compound ID, in cache order
+    """
+    conn = _connect(cache_file)
+    try:
+        header = pickle.loads(conn.execute("SELECT value FROM header WHERE key = 'header'").fetchone()[0])
+        chunk_size = header['chunk_size']
+        count = conn.execute("SELECT COUNT(*) FROM compounds").fetchone()[0]
+        for start in range(0, count, chunk_size):
+            yield dict(_read_rows(conn, "WHERE pos BETWEEN ? AND ?", (start, start + chunk_size - 1),
+                                  isotope_mass_range))
+    finally:
+        conn.close()
+
+
+def select_sqlite_compounds(cache_file, ids=None, formulas=None, mass_min=None, mass_max=None):
+    """Select compounds of an SQLite cache file matching all given filters.
+
+    Args:
+        cache_file (str): Path to the database
+        ids (list, optional): Compound IDs to select; an empty list selects none
+        formulas (list, optional): Chemical formulas to select (exact match)
+        mass_min (float, optional): Minimum monoisotopic mass (inclusive)
+        mass_max (float, optional): Maximum monoisotopic mass (inclusive)
+
+    Yields:
+        tuple: (compound_id, data) pairs in cache order
+    """
+    conditions = []
+    params = []
+    if ids is not None:
+        conditions.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(ids)))
+    if formulas is not None:
+        conditions.append("cf IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(formulas)))
+    if mass_min is not None:
+        conditions.append("mass >= ?")
+        params.append(mass_min)
+    if mass_max is not None:
+        conditions.append("mass <= ?")
+        params.append(mass_max)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ''
+
+    conn = _connect(cache_file)
+    try:
+        yield from _read_rows(conn, where, params)
+    finally:
+        conn.close()
@@ -65,12 +65,14 @@ Functions:
 # FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
 
 from mimi.molecule import *
-import pickle
+from mimi.cache import load_cache, write_cache, resolve_cache_file, CACHE_EXTENSIONS, COMPRESSION_CODECS
 
 from mimi.analysis import *
+from mimi.hmdb import iter_hmdb_metabolites
 
 import json
 import argparse
+import multiprocessing
 import sys
 import datetime
 import pkg_resources
@@ -99,6 +101,231 @@ def load_mass_spectrometry_data(asc_file):
     return mass_intensity_pair_list
 
 
+def compute_compound_entry(cf, cname, ion, args):
+    """Compute the cache entry for a single compound.
+
+    Args:
+        cf (str): Chemical formula of the compound
+        cname (str): Human-readable compound name
+        ion (str): Ionisation mode ('pos' or 'neg')
+        args: Arguments object with noise_cutoff, masses_only, debug and debug_fp attributes
+
+    Returns:
+        dict: Cache entry with 'cf', 'cname', 'exp', 'mass' and 'isotope_mass_list' keys.
+            With args.masses_only, 'isotope_mass_list' is left empty; the parsed
+            formula in 'exp' holds the isotope data needed to expand it later.
+
+    Raises:
+        KeyError: If the formula contains an element without isotope data
+    """
+    exp = parse_molecular_formula(cf)  # First parse the formula
+
+    if args.debug:
+        args.debug_fp.write(f"Calculating nominal mass for {ion} mode...\n")
+
+    nominal_mass = calculate_nominal_mass(exp, ion)
+
+    if args.debug:
+        args.debug_fp.write(f"Nominal mass: {nominal_mass}\n")
+
+    if args.masses_only:
+        isotope_variants = []
+    else:
+        if args.debug:
+            args.debug_fp.write("Calculating isotope variants...\n")
+        isotope_variants = get_isotop_variants_mass(exp, ion, args)
+
+    return {
+        'cf': cf,
+        'cname': cname,
+        'exp': exp,
+        'mass': nominal_mass,
+        'isotope_mass_list': isotope_variants
+    }
+
+
+def is_affected_by_label(exp, labelled_elements):
+    """Check whether a parsed formula contains any labelled element.
+
+    Args:
+        exp (list): Parsed molecular expression from parse_molecular_formula()
+        labelled_elements (set): Element symbols overridden by the label file
+
+    Returns:
+        bool: True if the compound contains at least one labelled element
+    """
+    for each_atom in exp:
+        if each_atom[0][0]['element_symbol'] in labelled_elements:
+            return True
+    return False
+
+
+def derive_compounds(source_compounds, labelled_elements, ion, args, skipped_compounds):
+    """Derive labelled cache entries from a natural abundance cache.
+
+    Only compounds containing a labelled element are recomputed; all other
+    entries are copied from the source cache unchanged, sharing the same
+    objects rather than duplicating them.
+
+    Args:
+        source_compounds (dict): Compound entries of the natural abundance cache
+        labelled_elements (set): Element symbols overridden by the label file
+        ion (str): Ionisation mode of the source cache
+        args: Arguments object with noise_cutoff, debug and debug_fp attributes
+        skipped_compounds (list): Collects formulas that could not be recomputed
+
+    Returns:
+        tuple: (compounds, recomputed_count) where compounds is the derived
+            compound dictionary in source order
+    """
+    compounds = {}
+    recomputed_count = 0
+
+    progress_bar = tqdm.tqdm(source_compounds.items(), desc="Deriving compounds", unit="compound")
+    for co, data in progress_bar:
+        if not is_affected_by_label(data['exp'], labelled_elements):
+            compounds[co] = data
+            continue
+
+        cf = data['cf']
+        try:
+            if args.debug:
+                args.debug_fp.write(f"\nRecomputing compound: {cf} ({co})\n")
+                args.debug_fp.write("-" * 50 + "\n")
+
+            compounds[co] = compute_compound_entry(cf, data['cname'], ion, args)
+            recomputed_count += 1
+        except KeyError as e:
+            if args.debug:
+                args.debug_fp.write(f"ERROR: Unsupported molecular formula format: {cf}\n")
+                args.debug_fp.write(f"Exception: {str(e)}\n")
+            skipped_compounds.append(cf)
+
+    return compounds, recomputed_count
+
+
+SOURCE_TYPES = ('hmdb', 'kegg', 'tsv')
+
+
+def parse_source_spec(spec):
+    """Parse a --source specification.
+
+    Args:
+        spec (str): 'hmdb:FILE.xml', 'kegg:MIN-MAX' (exact mass range in Da) or 'tsv:FILE'
+
+    Returns:
+        tuple: (source_type, value) where value is a file path, or a
+            (min_mass, max_mass) tuple for kegg
+
+    Raises:
+        ValueError: If the specification is malformed
+    """
+    source_type, sep, value = spec.partition(':')
+    if not sep or source_type not in SOURCE_TYPES or not value:
+        raise ValueError(f"invalid source '{spec}'; expected hmdb:FILE.xml, kegg:MIN-MAX or tsv:FILE")
+    if source_type == 'kegg':
+        try:
+            min_mass, max_mass = (float(x) for x in value.split('-'))
+        except ValueError:
+            raise ValueError(f"invalid KEGG mass range '{value}'; expected MIN-MAX in Da")
+        if min_mass >= max_mass:
+            raise ValueError(f"invalid KEGG mass range '{value}'; MIN must be below MAX")
+        return source_type, (min_mass, max_mass)
+    return source_type, value
+
+
+def iter_source_compounds(sources, counts):
+    """Stream (cf, id, name) records from compound sources in order.
+
+    Records are produced while the sources are being read, without
+    validating the formulas; compute_compound_entry() parses each formula
+    once and rejects unsupported ones.
+
+    Args:
+        sources (list): (source_type, value) tuples from parse_source_spec()
+        counts (dict): Updated in place with 'processed' and 'skipped' counts
+            reported by the HMDB and KEGG readers
+
+    Yields:
+        tuple: (cf, compound_id, name)
+    """
+    for source_type, value in sources:
+        if source_type == 'tsv':
+            for cf, co, cname in iter_molecular_mass_database(value):
+                yield cf, co, cname
+        elif source_type == 'hmdb':
+            yield from iter_hmdb_metabolites(value, counts=counts, progress=False)
+        elif source_type == 'kegg':
+            # KEGG access needs the network libraries, so only import it when used
+            from mimi.kegg import iter_kegg_compounds
+            yield from iter_kegg_compounds(mass_range=value, counts=counts)
+
+
+# Per-process builder settings, set by _init_builder_worker()
+_builder_options = {}
+
+
+def _init_builder_worker(ion, noise_cutoff, masses_only, jsonfile):
+    """Load isotope data in a cache builder worker process."""
+    atom.load_isotope()
+    if jsonfile:
+        atom.load_labelled_atoms(jsonfile)
+    _builder_options['ion'] = ion
+    _builder_options['args'] = argparse.Namespace(noise_cutoff=noise_cutoff, masses_only=masses_only,
+                                                  debug=False, debug_fp=None)
+
+
+def _build_entry(record):
+    """Compute one cache entry in a builder worker; returns (cf, co, entry or None)."""
+    cf, co, cname = record
+    try:
+        return cf, co, compute_compound_entry(cf, cname, _builder_options['ion'], _builder_options['args'])
+    except KeyError:
+        return cf, co, None
+
+
+def build_compounds(records, ion, args, skipped_compounds, jobs=1):
+    """Compute cache entries for a stream of compound records.
+
+    With jobs > 1 the records are consumed by a feeder thread while worker
+    processes compute the isotope variants, so reading the sources overlaps
+    with the computation. Entries come back in input order either way, so the
+    resulting cache does not depend on the number of jobs.
+
+    Args:
+        records: Iterable of (cf, compound_id, name) tuples
+        ion (str): Ionisation mode ('pos' or 'neg')
+        args: Arguments object with noise_cutoff, masses_only, jsonfile, debug and debug_fp attributes
+        skipped_compounds (list): Collects formulas that could not be parsed
+        jobs (int): Number of worker processes
+
+    Yields:
+        tuple: (compound_id, entry)
+    """
+    # The debug log is a single open file, so debug runs stay in-process
+    if jobs <= 1 or args.debug:
+        for cf, co, cname in records:
+            try:
+                if args.debug:
+                    args.debug_fp.write(f"\nProcessing compound: {cf} ({co})\n")
+                    args.debug_fp.write("-" * 50 + "\n")
+                yield co, compute_compound_entry(cf, cname, ion, args)
+            except KeyError as e:
+                # Log unsupported formula to debug file and continue
+                if args.debug:
+                    args.debug_fp.write(f"ERROR: Unsupported molecular formula format: {cf}\n")
+                    args.debug_fp.write(f"Exception: {str(e)}\n")
+                skipped_compounds.append(cf)
+        return
+
+    initargs = (ion, args.noise_cutoff, args.masses_only, args.jsonfile)
+    with multiprocessing.Pool(jobs, initializer=_init_builder_worker, initargs=initargs) as pool:
+        for cf, co, entry in pool.imap(_build_entry, records, chunksize=64):
+            if entry is None:
+                skipped_compounds.append(cf)
+            else:
+                yield co, entry
+
 
 def main():
     """Main entry point for the cache creation tool.
@@ -111,12 +338,24 @@ def main():
     4. Stores results in a dictionary
     5. Saves the cache to a pickle file
     
+    With --derive, an existing natural abundance cache is used as the source
+    instead of compound DB files, and only compounds containing an element
+    from the label file are recomputed.
+
     Command line arguments:
         -i, --ion: Ionisation mode (pos/neg/)
         -l, --label: Path to JSON file containing labeled atoms configuration
         -g, --debug: Enable debug output
         -d, --dbfile: Input database TSV file(s) with compound information (can specify multiple)
-        -c, --cache: Output path for the binary cache file (.pkl extension will be added)
+        --source: Compound source(s) streamed straight into the builder
+            (hmdb:FILE.xml, kegg:MIN-MAX or tsv:FILE)
+        -j, --jobs: Number of worker processes computing isotope variants
+        -c, --cache: Output path for the binary cache file (.pkl or .sqlite extension will be added)
+        --derive: Natural abundance cache to derive a labelled cache from (with or without extension)
+        --storage: Cache storage backend (pickle/sqlite)
+        --compress: Compress the cache chunks (zlib/lzma, pickle storage only)
+        --masses-only: Store only formulas and monoisotopic masses; isotope variants
+            are expanded by mimi_mass_analysis for matching compounds only
     """
     ap = argparse.ArgumentParser(
         description="Molecular Isotope Mass Identifier",
@@ -131,25 +370,101 @@ def main():
     ap.add_argument("-l", "--label", dest="jsonfile", required=False,
                     help="Labeled atoms", metavar="JSON")
     
-    ap.add_argument("-n", "--noise", dest="noise_cutoff", type=float, default=1e-5, metavar="CUTOFF",
+    ap.add_argument("-n", "--noise", dest="noise_cutoff", type=float, default=None, metavar="CUTOFF",
                     help="Threshold for filtering molecular isotope variants with relative abundance below CUTOFF w.r.t. the monoisotopic mass (defaults to 1e-5)", required=False)
     
 
 
     ap.add_argument("-d", "--dbfile", dest="dbfile", nargs='+',
-                    help="File(s) with list of compounds", metavar="DBTSV", required=True)
+                    help="File(s) with list of compounds", metavar="DBTSV", required=False)
     
+    ap.add_argument("--source", dest="sources", nargs='+', metavar="SOURCE",
+                    help="Compound source(s) read directly, without an intermediate TSV: hmdb:FILE.xml, kegg:MIN-MAX (exact mass range in Da) or tsv:FILE")
+    
+    ap.add_argument("--derive", dest="derive", required=False, metavar="NATBINARY",
+                    help="Derive a labelled cache from an existing natural abundance cache (with or without extension), recomputing only compounds that contain a labelled element")
     
     # Processing options
     ap.add_argument("-i", '--ion', dest="ion",
-                    help="Ionisation mode", choices=['pos','neg'], required=True)
+                    help="Ionisation mode", choices=['pos','neg'], required=False)
+    ap.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, metavar="N",
+                    help="Number of worker processes computing isotope variants while the compound sources are read (default: 1)")
     
     # Output
     ap.add_argument("-c", "--cache", dest="cache", required=True,
                     help="Binary DB output file (if not specified, will use base name from JSON file)", metavar="DBBINARY")
+    ap.add_argument("--storage", dest="storage", choices=list(CACHE_EXTENSIONS), default='pickle',
+                    help="Cache storage backend; sqlite writes a .sqlite database with a mass index that many processes can query concurrently (default: pickle)")
+    ap.add_argument("--compress", dest="compression", choices=list(COMPRESSION_CODECS), default=None,
+                    help="Compress the cache chunks; zlib loads faster, lzma gives smaller files (pickle storage only)")
+    ap.add_argument("--masses-only", dest="masses_only", action='store_true', default=False,
+                    help="Store only formulas and monoisotopic masses; mimi_mass_analysis expands the isotope variants of matching compounds on demand")
 
     args = ap.parse_args()
 
+    if args.compression and args.storage != 'pickle':
+        ap.error("--compress is only supported with --storage pickle")
+
+    source_cache = None
+    source_cmd_line = {}
+    if args.derive:
+        if not args.jsonfile:
+            ap.error("--derive requires -l/--label")
+        if args.dbfile or args.sources:
+            ap.error("--derive cannot be combined with -d/--dbfile or --source")
+        # Accept the cache name without extension, as -c does in the other tools
+        if not os.path.isfile(args.derive):
+            args.derive = resolve_cache_file(args.derive)
+        try:
+            source_cache = load_cache(args.derive)
+        except FileNotFoundError:
+            print(f"Error: Source cache file not found: '{args.derive}'", file=sys.stderr)
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error loading source cache file '{args.derive}': {str(e)}", file=sys.stderr)
+            sys.exit(1)
+
+        source_cmd_line = source_cache['metadata'].get('command_line', {})
+        if source_cmd_line.get('labeled_atoms_file'):
+            print(f"Error: Source cache '{args.derive}' is labelled ({source_cmd_line['labeled_atoms_file']}); "
+                  "--derive requires a natural abundance cache", file=sys.stderr)
+            sys.exit(1)
+
+        source_ion = source_cmd_line.get('ionization_mode')
+        if args.ion and source_ion and args.ion != source_ion:
+            print(f"Error: Ionisation mode '{args.ion}' does not match source cache mode '{source_ion}'", file=sys.stderr)
+            sys.exit(1)
+        args.ion = args.ion or source_ion
+        # Unaffected compounds are copied, so a masses-only source gives a masses-only cache
+        args.masses_only = args.masses_only or bool(source_cmd_line.get('masses_only'))
+        if not args.ion:
+            ap.error("-i/--ion is required when the source cache does not record its ionisation mode")
+
+        source_noise = source_cmd_line.get('noise_cutoff')
+        if args.noise_cutoff is not None and source_noise is not None and args.noise_cutoff != source_noise:
+            print(f"Error: Noise cutoff {args.noise_cutoff} does not match source cache cutoff {source_noise}", file=sys.stderr)
+            sys.exit(1)
+        if args.noise_cutoff is None:
+            args.noise_cutoff = source_noise
+    else:
+        if not args.dbfile and not args.sources:
+            ap.error("one of the arguments -d/--dbfile --source is required")
+        if not args.ion:
+            ap.error("the following arguments are required: -i/--ion")
+
+    if args.noise_cutoff is None:
+        args.noise_cutoff = 1e-5
+
+    if args.jobs < 1:
+        ap.error("-j/--jobs must be at least 1")
+
+    # -d FILE is shorthand for --source tsv:FILE
+    source_specs = [f"tsv:{dbfile}" for dbfile in args.dbfile or []] + (args.sources or [])
+    try:
+        sources = [parse_source_spec(spec) for spec in source_specs]
+    except ValueError as e:
+        ap.error(str(e))
+
     # If cache not specified, derive it from JSON file
     if not args.cache:
         if not args.jsonfile:
@@ -181,8 +496,12 @@ def main():
         'command_line': {
             'ionization_mode': args.ion,
             'labeled_atoms_file': args.jsonfile if args.jsonfile else None,
-            'compound_db_files': args.dbfile,
-            'cache_output_file': args.cache + '.pkl',
+            'compound_db_files': (list(args.dbfile or []) + list(args.sources or [])) if sources
+                                 else source_cmd_line.get('compound_db_files', []),
+            'noise_cutoff': args.noise_cutoff,
+            'masses_only': args.masses_only,
+            'derived_from': args.derive,
+            'cache_output_file': args.cache + CACHE_EXTENSIONS[args.storage],
             'isotope_data_file': 'mimi/data/natural_isotope_abundance_NIST.json',
             'full_command': ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:])
         },
@@ -203,25 +522,16 @@ def main():
     # Use default isotope file path
     atom.load_isotope()
 
+    labelled_atoms = {}
     if args.jsonfile:
         try:
-            atom.load_labelled_atoms(args.jsonfile)
+            labelled_atoms = atom.load_labelled_atoms(args.jsonfile)
         except ValueError as e:
             print(f"Error: {str(e)}", file=sys.stderr)
             sys.exit(1)
+    # Keep the label data itself, so the cache is self-describing without the JSON file
+    metadata['labelled_atoms'] = labelled_atoms or None
     
-
-
-    compound_list = []
-    for dbfile in args.dbfile:
-        try:
-            compound_list.extend(load_molecular_mass_database(dbfile))
-        except FileNotFoundError:
-            print(f"Error: Database file not found: '{dbfile}'", file=sys.stderr)
-            sys.exit(1)
-
-
-   
     ion = args.ion
     compound_precompute = {
         'metadata': metadata,  # Add metadata to cache
@@ -229,47 +539,31 @@ def main():
     }
 
     skipped_compounds = []  # Track skipped compounds
-    
-    # Add progress bar
-    progress_bar = tqdm.tqdm(compound_list, desc="Processing compounds", unit="compound")
-    for cf, co, cname in progress_bar:
-        try:
-            if args.debug:
-                args.debug_fp.write(f"\nProcessing compound: {cf} ({co})\n")
-                args.debug_fp.write("-" * 50 + "\n")
-            
-            # Update progress bar description with current compound
-            progress_bar.set_description(f"Processing {co}")
-
-            exp = parse_molecular_formula(cf)  # First parse the formula
-            
-            if args.debug:
-                args.debug_fp.write(f"Calculating nominal mass for {ion} mode...\n")
 
-            nominal_mass = calculate_nominal_mass(exp, ion)
-
-            if args.debug:
-                args.debug_fp.write(f"Nominal mass: {nominal_mass}\n")
-                args.debug_fp.write("Calculating isotope variants...\n")
-
-            isotope_variants = get_isotop_variants_mass(exp, ion, args)
-
-
-            compound_precompute['compounds'][co] = {
-                'cf': cf,
-                'cname': cname,
-                'exp': exp,
-                'mass': nominal_mass,
-                'isotope_mass_list': isotope_variants
-            }
+    if source_cache is not None:
+        source_compounds = source_cache['compounds']
+        compound_precompute['compounds'], recomputed_count = derive_compounds(
+            source_compounds, set(labelled_atoms), ion, args, skipped_compounds)
+        print(f"Recomputed {recomputed_count} of {len(source_compounds)} compounds "
+              f"containing labelled elements ({', '.join(sorted(labelled_atoms))})")
+
+    source_counts = {}
+    records = iter_source_compounds(sources, source_counts)
+    progress_bar = tqdm.tqdm(build_compounds(records, ion, args, skipped_compounds, args.jobs),
+                             desc="Processing compounds", unit="compound", disable=not sources)
+    try:
+        for co, entry in progress_bar:
+            compound_precompute['compounds'][co] = entry
+    except FileNotFoundError as e:
+        print(f"Error: Compound source file not found: '{e.filename}'", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error reading compound sources: {str(e)}", file=sys.stderr)
+        sys.exit(1)
 
-        except KeyError as e:
-            # Log unsupported formula to debug file and continue
-            if args.debug:
-                args.debug_fp.write(f"ERROR: Unsupported molecular formula format: {cf}\n")
-                args.debug_fp.write(f"Exception: {str(e)}\n")
-            skipped_compounds.append(cf)
-            continue
+    if source_counts.get('skipped'):
+        print(f"Skipped {source_counts['skipped']} of {source_counts['processed']} source records "
+              "that were incomplete or outside the requested mass range")
 
     if skipped_compounds and args.debug:
         args.debug_fp.write("\nSummary of skipped compounds:\n")
@@ -293,10 +587,10 @@ def main():
                 print(f"Error: Failed to create cache directory '{cache_dir}': {str(e)}")
                 sys.exit(1)
 
-        with open(args.cache + '.pkl','wb') as f:
-            pickle.dump(compound_precompute, f)
+        write_cache(args.cache + CACHE_EXTENSIONS[args.storage], compound_precompute['metadata'],
+                    compound_precompute['compounds'], storage=args.storage, compression=args.compression)
     except IOError as e:
-        print(f"Error: Failed to write cache file '{args.cache}.pkl': {str(e)}")
+        print(f"Error: Failed to write cache file '{args.cache}{CACHE_EXTENSIONS[args.storage]}': {str(e)}")
         sys.exit(1)
     except Exception as e:
         print(f"Error: An unexpected error occurred: {str(e)}")
@@ -0,0 +1,221 @@
+# Copyright 2025 New York University. All Rights Reserved.
+
+# A license to use and copy this software and its documentation solely for your internal non-commercial
+# research and evaluation purposes, without fee and without a signed licensing agreement, is hereby granted
+# upon your download of the software, through which you agree to the following: 1) the above copyright
+# notice, this paragraph and the following three paragraphs will prominently appear in all internal copies
+# and modifications; 2) no rights to sublicense or further distribute this software are granted; 3) no rights
+# to modify this software are granted; and 4) no rights to assign this license are granted. Please contact
+# the NYU Technology Opportunities and Ventures TOVcommunications@nyulangone.org for commercial
+# licensing opportunities, or for further distribution, modification or license rights.
+
+# Created by Nabil Rahiman & Kristin Gunsalus
+
+# IN NO EVENT SHALL NYU, OR THEIR EMPLOYEES, OFFICERS, AGENTS OR TRUSTEES
+# ("COLLECTIVELY "NYU PARTIES") BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+# INCIDENTAL, OR CONSEQUENTIAL DAMAGES OF ANY KIND, INCLUDING LOST PROFITS, ARISING
+# OUT OF ANY CLAIM RESULTING FROM YOUR USE OF THIS SOFTWARE AND ITS
+# DOCUMENTATION, EVEN IF ANY OF NYU PARTIES HAS BEEN ADVISED OF THE POSSIBILITY
+# OF SUCH CLAIM OR DAMAGE.
+
+# NYU SPECIFICALLY DISCLAIMS ANY WARRANTIES OF ANY KIND REGARDING THE SOFTWARE,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE, OR THE ACCURACY OR USEFULNESS,
+# OR COMPLETENESS OF THE SOFTWARE. THE SOFTWARE AND ACCOMPANYING DOCUMENTATION,
+# IF ANY, PROVIDED HEREUNDER IS PROVIDED COMPLETELY "AS IS". NYU HAS NO OBLIGATION TO PROVIDE
+# FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
+
+"""
+Cache Diff Module
+
+This module compares two MIMI cache files, for example before and after a KEGG
+or HMDB refresh or a change of the NIST isotope table. Compounds are joined on
+their ID; compounds whose ID only occurs in one cache are joined on their
+chemical formula to detect renamed IDs. Monoisotopic masses and isotope
+variants are compared numerically within tolerances.
+"""
+
+import argparse
+import sys
+import numpy as np
+from mimi.cache import read_cache_header, iter_cache_compounds
+
+CHANGE_TYPES = ['ADDED', 'REMOVED', 'ID_CHANGED', 'FORMULA_CHANGED', 'MASS_CHANGED',
+                'VARIANTS_GAINED', 'VARIANTS_LOST', 'VARIANTS_CHANGED']
+METADATA_FIELDS = ['ionization_mode', 'labeled_atoms_file', 'noise_cutoff', 'masses_only', 'isotope_data_file']
+
+
+def load_cache_summary(cache_file):
+    """Load the fields of a cache needed for comparison.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+
+    Returns:
+        dict: (cf, mass, isotope_mass_list) tuples keyed by compound ID, in cache order
+    """
+    return {co: (data['cf'], data['mass'], data['isotope_mass_list'])
+            for co, data in iter_cache_compounds(cache_file)}
+
+
+def diff_variants(old_list, new_list, mass_tol, abundance_tol):
+    """Compare the isotope variants of one compound in two caches.
+
+    Variants are matched on their isotope formula (e.g. '[12]C5 [13]C1 [1]H10').
+
+    Args:
+        old_list (list): isotope_mass_list from the old cache
+        new_list (list): isotope_mass_list from the new cache
+        mass_tol (float): Relative mass tolerance (e.g. 1e-9 for 0.001 ppm)
+        abundance_tol (float): Absolute tolerance on relative abundance
+
+    Returns:
+        tuple: (gained, lost, changed) lists of isotope formulas
+    """
+    old = {name.strip(): (mass, abundance) for mass, abundance, name in old_list[1:]}
+    new = {name.strip(): (mass, abundance) for mass, abundance, name in new_list[1:]}
+
+    gained = [name for name in new if name not in old]
+    lost = [name for name in old if name not in new]
+    common = [name for name in new if name in old]
+    if not common:
+        return gained, lost, []
+
+    old_values = np.array([old[name] for name in common], dtype=np.float64)
+    new_values = np.array([new[name] for name in common], dtype=np.float64)
+    mass_changed = np.abs(new_values[:, 0] - old_values[:, 0]) > old_values[:, 0] * mass_tol
+    abundance_changed = np.abs(new_values[:, 1] - old_values[:, 1]) > abundance_tol
+    changed = [name for name, flag in zip(common, mass_changed | abundance_changed) if flag]
+    return gained, lost, changed
+
+
+def diff_caches(old_file, new_file, mass_tol=1e-9, abundance_tol=1e-6):
+    """Compare two cache files.
+
+    Args:
+        old_file (str): Path to the old .pkl cache file
+        new_file (str): Path to the new .pkl cache file
+        mass_tol (float): Relative mass tolerance (e.g. 1e-9 for 0.001 ppm)
+        abundance_tol (float): Absolute tolerance on relative abundance
+
+    Returns:
+        tuple: (changes, compared) where changes is a list of
+            (compound_id, change_type, old_value, new_value) tuples and compared
+            is the number of compounds present in both caches
+    """
+    old = load_cache_summary(old_file)
+    new = load_cache_summary(new_file)
+    changes = []
+
+    # Join on ID
+    common_ids = [co for co in new if co in old]
+    removed_ids = [co for co in old if co not in new]
+    added_ids = [co for co in new if co not in old]
+
+    if common_ids:
+        old_masses = np.array([old[co][1] for co in common_ids], dtype=np.float64)
+        new_masses = np.array([new[co][1] for co in common_ids], dtype=np.float64)
+        mass_changed = np.abs(new_masses - old_masses) > old_masses * mass_tol
+    else:
+        mass_changed = np.zeros(0, dtype=bool)
+
+    for co, mass_flag in zip(common_ids, mass_changed.tolist()):
+        old_cf, old_mass, old_list = old[co]
+        new_cf, new_mass, new_list = new[co]
+        if old_cf != new_cf:
+            changes.append((co, 'FORMULA_CHANGED', old_cf, new_cf))
+        if mass_flag:
+            changes.append((co, 'MASS_CHANGED', f"{old_mass:.6f}", f"{new_mass:.6f}"))
+        if old_list == new_list:
+            continue
+        gained, lost, changed = diff_variants(old_list, new_list, mass_tol, abundance_tol)
+        if gained:
+            changes.append((co, 'VARIANTS_GAINED', str(len(old_list) - 1), ';'.join(gained)))
+        if lost:
+            changes.append((co, 'VARIANTS_LOST', ';'.join(lost), str(len(new_list) - 1)))
+        if changed:
+            changes.append((co, 'VARIANTS_CHANGED', '', ';'.join(changed)))
+
+    # Join the remaining IDs on formula to detect renamed compounds
+    added_by_cf = {}
+    for co in added_ids:
+        added_by_cf.setdefault(new[co][0], []).append(co)
+
+    renamed = set()
+    for co in removed_ids:
+        candidates = added_by_cf.get(old[co][0])
+        if candidates:
+            new_co = candidates.pop(0)
+            renamed.add(new_co)
+            changes.append((co, 'ID_CHANGED', co, new_co))
+        else:
+            changes.append((co, 'REMOVED', old[co][0], ''))
+
+    for co in added_ids:
+        if co not in renamed:
+            changes.append((co, 'ADDED', '', new[co][0]))
+
+    return changes, len(common_ids)
+
+
+def diff_metadata(old_file, new_file):
+    """Compare the creation parameters of two cache files.
+
+    Returns:
+        list: (field, old_value, new_value) tuples for differing parameters
+    """
+    old_cmd = read_cache_header(old_file).get('metadata', {}).get('command_line', {})
+    new_cmd = read_cache_header(new_file).get('metadata', {}).get('command_line', {})
+    return [(field, old_cmd.get(field), new_cmd.get(field))
+            for field in METADATA_FIELDS if old_cmd.get(field) != new_cmd.get(field)]
+
+
+def main():
+    """Main entry point for the cache diff tool."""
+    ap = argparse.ArgumentParser(description="MIMI Cache Diff Tool")
+
+    ap.add_argument("old_cache", help="Old cache file (.pkl)")
+    ap.add_argument("new_cache", help="New cache file (.pkl)")
+    ap.add_argument("--mass-tol", dest="mass_tol", type=float, default=0.001,
+                    help="Mass tolerance in PPM (default: 0.001)")
+    ap.add_argument("--abundance-tol", dest="abundance_tol", type=float, default=1e-6,
+                    help="Absolute tolerance on relative isotope abundance (default: 1e-6)")
+    ap.add_argument("--summary-only", dest="summary_only", action='store_true', default=False,
+                    help="Print only the summary, not the per-compound change list")
+    ap.add_argument("-o", "--output", help="Output file (default: stdout)")
+
+    args = ap.parse_args()
+
+    try:
+        metadata_changes = diff_metadata(args.old_cache, args.new_cache)
+        changes, compared = diff_caches(args.old_cache, args.new_cache,
+                                        args.mass_tol / 1000000, args.abundance_tol)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        print(f"# Old Cache: {args.old_cache}", file=out)
+        print(f"# New Cache: {args.new_cache}", file=out)
+        for field, old_value, new_value in metadata_changes:
+            print(f"# Parameter Changed: {field}: {old_value} -> {new_value}", file=out)
+        print(f"# Compounds In Both: {compared}", file=out)
+        changed_ids = set()
+        for change_type in CHANGE_TYPES:
+            ids = {co for co, t, o, n in changes if t == change_type}
+            changed_ids.update(ids)
+            print(f"# {change_type}: {len(ids)}", file=out)
+        print(f"# Compounds With Changes: {len(changed_ids)}", file=out)
+
+        if not args.summary_only:
+            out.write('ID\tChange\tOld\tNew\n')
+            for change in changes:
+                out.write('\t'.join(change) + '\n')
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
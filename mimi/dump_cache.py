@@ -29,17 +29,44 @@
 Cache Dump Module
 
 This module provides functionality for dumping the contents of a MIMI cache file
-to TSV format for inspection.
+in human-readable, TSV or JSONL format for inspection.
 """
 
 # Copyright 2025 New York University. All Rights Reserved.
 # ... [License text skipped for brevity] ...
 
 import argparse
+import heapq
+import json
 import pickle
 import sys
 from itertools import islice
+import numpy as np
 from mimi import atom
+from mimi.cache import read_cache_header, iter_cache_chunks, select_compounds
+from mimi.analysis import filter_isotope_variants, expand_isotope_variants
+
+STATS_FIELDS = ['cf', 'cname', 'exp', 'isotope_mass_list']
+STATS_NOISE_CUTOFFS = [1e-5, 1e-4, 1e-3, 1e-2]
+TSV_FIELDS = ['ID', 'Name', 'CF', 'Variant', 'Isotope_Formula', 'Mass', 'Relative_Abundance']
+
+# Nominal mass of the most abundant isotope per element, filled on first use
+_nominal_masses = {}
+
+
+def get_nominal_mass(atom_name):
+    """Get the nominal mass of the most abundant isotope of an element.
+
+    Args:
+        atom_name (str): Element symbol
+
+    Returns:
+        int: Nominal mass of the element's most abundant isotope
+    """
+    if atom_name not in _nominal_masses:
+        _nominal_masses[atom_name] = atom.get_atom(atom_name)[0]['nominal_mass']
+    return _nominal_masses[atom_name]
+
 
 def format_cf_with_masses(cf):
     """Format chemical formula with nominal masses in square brackets.
@@ -72,9 +99,7 @@ def format_cf_with_masses(cf):
             
         # If we have an existing atom_name, process it before starting new one
         if atom_name:
-            atom_data = atom.get_atom(atom_name)
-            nominal_mass = atom_data[0]['nominal_mass']
-            formatted += f'[{nominal_mass}]{atom_name}'
+            formatted += f'[{get_nominal_mass(atom_name)}]{atom_name}'
             if count:
                 formatted += count
                 count = ''
@@ -88,94 +113,294 @@ def format_cf_with_masses(cf):
     
     # Handle the last atom
     if atom_name:
-        atom_data = atom.get_atom(atom_name)
-        nominal_mass = atom_data[0]['nominal_mass']
-        formatted += f'[{nominal_mass}]{atom_name}'
+        formatted += f'[{get_nominal_mass(atom_name)}]{atom_name}'
         if count:
             formatted += count
     
     return formatted
 
-def dump_cache(cache_file, num_compounds=None, output_file=None, num_isotopes=None):
-    """Dump contents of a MIMI cache file to TSV format.
+def print_metadata(metadata, out, compound_count=None):
+    """Print cache metadata as commented lines.
+
+    Args:
+        metadata (dict): Cache metadata as stored by mimi_cache_create
+        out: Output file handle
+        compound_count (int, optional): Number of compounds in the cache
+    """
+    print("# Cache Metadata:", file=out)
+    # Print creation info
+    print(f"# Creation Date: {metadata.get('creation_date', 'Unknown')}", file=out)
+    print(f"# MIMI Version: {metadata.get('mimi_version', 'Unknown')}", file=out)
+    if compound_count is not None:
+        print(f"# Compounds: {compound_count}", file=out)
+    
+    # Print command line parameters
+    cmd_line = metadata.get('command_line', {})
+    if cmd_line:
+        print("\n# Creation Parameters:", file=out)
+        print(f"# Full Command: {cmd_line.get('full_command', 'Unknown')}", file=out)
+        print(f"# Ionization Mode: {cmd_line.get('ionization_mode', 'Unknown')}", file=out)
+        print(f"# Labeled Atoms File: {cmd_line.get('labeled_atoms_file', 'None')}", file=out)
+        print(f"# Compound DB Files: {', '.join(cmd_line.get('compound_db_files') or ['Unknown'])}", file=out)
+        print(f"# Noise Cutoff: {cmd_line.get('noise_cutoff', 'Unknown')}", file=out)
+        if cmd_line.get('masses_only'):
+            print("# Masses Only: Yes (isotope variants are expanded during analysis)", file=out)
+        if cmd_line.get('derived_from'):
+            print(f"# Derived From: {cmd_line['derived_from']}", file=out)
+        if cmd_line.get('merged_from'):
+            print(f"# Merged From: {', '.join(cmd_line['merged_from'])}", file=out)
+        print(f"# Cache Output File: {cmd_line.get('cache_output_file', 'Unknown')}", file=out)
+        print(f"# Isotope Data File: {cmd_line.get('isotope_data_file', 'Unknown')}", file=out)
+
+    for element, isotopes in (metadata.get('labelled_atoms') or {}).items():
+        abundances = ', '.join(f"[{isotope['nominal_mass']}]{element} {isotope['abundance']}" for isotope in isotopes)
+        print(f"# Labelled {element}: {abundances}", file=out)
+    
+    print(file=out)
+
+
+def dump_cache_info(cache_file, output_file=None):
+    """Print only the metadata of a MIMI cache file.
+
+    Reads the cache header without loading any compounds.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+        output_file (str, optional): Path to output file. If None, prints to stdout.
+    """
+    header = read_cache_header(cache_file)
+
+    out = open(output_file, 'w') if output_file else sys.stdout
+    try:
+        print(f"# Cache File: {cache_file}", file=out)
+        print(f"# Cache Format Version: {header.get('format_version', 'Unknown')}", file=out)
+        print(f"# Compression: {header.get('compression') or 'None'}", file=out)
+        print_metadata(header.get('metadata', {}), out, header.get('compound_count'))
+    finally:
+        if output_file:
+            out.close()
+
+
+def cache_stats(cache_file, output_file=None, top=10, mass_bin=100.0):
+    """Report size and verification-cost statistics of a MIMI cache file.
+
+    The cache is streamed chunk by chunk, so only per-compound counters are
+    kept in memory. Masses-only caches store no isotope variants, so their
+    variant and probe sections are left out.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+        output_file (str, optional): Path to output file. If None, prints to stdout.
+        top (int): Number of compounds with the most isotope variants to list
+        mass_bin (float): Width of the mass histogram bins in Da
+    """
+    header = read_cache_header(cache_file)
+    cmd_line = header.get('metadata', {}).get('command_line', {})
+    cache_noise = cmd_line.get('noise_cutoff')
+    masses_only = bool(cmd_line.get('masses_only'))
+    noise_cutoffs = [c for c in STATS_NOISE_CUTOFFS if cache_noise is None or c >= cache_noise]
+
+    variant_counts = []
+    masses = []
+    heaviest = []  # min-heap of (variant_count, compound_id, cf)
+    field_bytes = dict.fromkeys(STATS_FIELDS, 0)
+    probes = dict.fromkeys(noise_cutoffs, 0)
+
+    for chunk in iter_cache_chunks(cache_file):
+        for co, data in chunk.items():
+            masses.append(data['mass'])
+            for field in STATS_FIELDS:
+                field_bytes[field] += len(pickle.dumps(data[field], protocol=pickle.HIGHEST_PROTOCOL))
+            if masses_only:
+                continue
+
+            isotope_mass_list = data['isotope_mass_list']
+            n_variants = len(isotope_mass_list) - 1
+            variant_counts.append(n_variants)
+
+            if len(heaviest) < top:
+                heapq.heappush(heaviest, (n_variants, co, data['cf']))
+            elif top and n_variants > heaviest[0][0]:
+                heapq.heapreplace(heaviest, (n_variants, co, data['cf']))
+
+            for cutoff in noise_cutoffs:
+                probes[cutoff] += len(filter_isotope_variants(isotope_mass_list, cutoff))
+
+    out = open(output_file, 'w') if output_file else sys.stdout
+    try:
+        print(f"# Cache File: {cache_file}", file=out)
+        print(f"# Noise Cutoff: {cache_noise if cache_noise is not None else 'Unknown'}", file=out)
+        compound_count = len(masses)
+        print(f"Compounds:        {compound_count}", file=out)
+        if not compound_count:
+            return
+
+        counts = np.asarray(variant_counts)
+        if masses_only:
+            print("Total variants:   not stored (masses-only cache)", file=out)
+        else:
+            print(f"Total variants:   {int(counts.sum())}", file=out)
+        print(file=out)
+
+        if not masses_only:
+            print("VARIANTS PER COMPOUND:", file=out)
+            print(f"  Min:            {int(counts.min())}", file=out)
+            print(f"  Median:         {float(np.median(counts)):.1f}", file=out)
+            print(f"  Mean:           {float(counts.mean()):.2f}", file=out)
+            print(f"  90th pct:       {float(np.percentile(counts, 90)):.1f}", file=out)
+            print(f"  99th pct:       {float(np.percentile(counts, 99)):.1f}", file=out)
+            print(f"  Max:            {int(counts.max())}", file=out)
+            edges = [0, 1, 2, 6, 11, 21, 51, 101]
+            for lo, hi in zip(edges, edges[1:] + [None]):
+                if hi is None:
+                    label, n = f">={lo}", int((counts >= lo).sum())
+                elif hi - lo == 1:
+                    label, n = f"{lo}", int((counts == lo).sum())
+                else:
+                    label, n = f"{lo}-{hi - 1}", int(((counts >= lo) & (counts < hi)).sum())
+                print(f"  {label:<16}{n}", file=out)
+            print("-" * 60, file=out)
+
+            print(f"HEAVIEST COMPOUNDS (top {len(heaviest)} by variant count):", file=out)
+            for n_variants, co, cf in sorted(heaviest, reverse=True):
+                print(f"  {co:<16}{cf:<24}{n_variants}", file=out)
+            print("-" * 60, file=out)
+
+        print(f"MASS HISTOGRAM ({mass_bin:g} Da bins):", file=out)
+        bins = np.floor(np.asarray(masses) / mass_bin).astype(np.int64)
+        for b, n in zip(*np.unique(bins, return_counts=True)):
+            print(f"  {b * mass_bin:>8g}-{(b + 1) * mass_bin:<8g}{int(n)}", file=out)
+        print("-" * 60, file=out)
+
+        total_bytes = sum(field_bytes.values())
+        print("BYTES PER FIELD (each value pickled on its own):", file=out)
+        for field in STATS_FIELDS:
+            share = 100.0 * field_bytes[field] / total_bytes if total_bytes else 0.0
+            print(f"  {field:<20}{field_bytes[field]:>14}  ({share:.1f}%)", file=out)
+        print(f"  {'total':<20}{total_bytes:>14}", file=out)
+        print("-" * 60, file=out)
+
+        if masses_only:
+            print("ESTIMATED VERIFICATION PROBES PER MATCH: variants not stored (masses-only cache)", file=out)
+        else:
+            print("ESTIMATED VERIFICATION PROBES PER MATCH:", file=out)
+            print(f"  {'all cached':<16}{float(counts.mean()):.2f}", file=out)
+            for cutoff in noise_cutoffs:
+                print(f"  {'-n ' + format(cutoff, 'g'):<16}{probes[cutoff] / compound_count:.2f}", file=out)
+    finally:
+        if output_file:
+            out.close()
+
+
+def write_compound_text(out, compound_id, data, num_isotopes=None):
+    """Write one compound and its isotope variants in the human-readable layout."""
+    formatted_cf = format_cf_with_masses(data['cf'])
+    
+    print("=" * 60, file=out)
+    print(f"Compound ID:      {compound_id}", file=out)
+    print(f"Name:             {data['cname']}", file=out)
+    print(f"Formula:          {formatted_cf}", file=out)
+    print(f"Mono-isotopic:    Yes (most abundant isotope)", file=out)
+    print(f"Mass:             {data['mass']:.6f}", file=out)
+    print(f"Relative Abund:   1.000000 (reference)", file=out)
+    print("-" * 60, file=out)
+    
+    # Print isotope variants
+    isotopes = data['isotope_mass_list'][1:]  # Skip first entry (main compound)
+    if num_isotopes is not None:
+        isotopes = isotopes[:num_isotopes]
+    
+    if isotopes:
+        print("ISOTOPE VARIANTS:", file=out)
+        
+    for i, (mass, abundance, isotope_formula) in enumerate(isotopes, 1):
+        print(f"  Variant #{i}:", file=out)
+        print(f"  Formula:        {isotope_formula.strip()}", file=out)
+        print(f"  Mono-isotopic:  No (isotope variant)", file=out)
+        print(f"  Mass:           {mass:.6f}", file=out)
+        print(f"  Relative Abund: {abundance:.6f} (expected)", file=out)
+        print("-" * 60, file=out)
+    
+    print(file=out)  # Add extra line between compounds
+
+
+def write_compound_tsv(out, compound_id, data, num_isotopes=None):
+    """Write one TSV row per isotope entry; variant 0 is the monoisotopic entry."""
+    isotopes = data['isotope_mass_list']
+    if num_isotopes is not None:
+        isotopes = isotopes[:num_isotopes + 1]
+    for i, (mass, abundance, isotope_formula) in enumerate(isotopes):
+        out.write(f"{compound_id}\t{data['cname']}\t{data['cf']}\t{i}\t"
+                  f"{isotope_formula.strip()}\t{mass:.6f}\t{abundance:.6f}\n")
+
+
+def write_compound_jsonl(out, compound_id, data, num_isotopes=None):
+    """Write one JSON object per compound with its isotope variants."""
+    isotopes = data['isotope_mass_list'][1:]
+    if num_isotopes is not None:
+        isotopes = isotopes[:num_isotopes]
+    record = {
+        'id': compound_id,
+        'name': data['cname'],
+        'cf': data['cf'],
+        'mass': data['mass'],
+        'variants': [{'formula': isotope_formula.strip(), 'mass': mass, 'abundance': abundance}
+                     for mass, abundance, isotope_formula in isotopes]
+    }
+    out.write(json.dumps(record) + '\n')
+
+
+def dump_cache(cache_file, num_compounds=None, output_file=None, num_isotopes=None,
+               ids=None, formulas=None, mass_min=None, mass_max=None, output_format='text'):
+    """Dump contents of a MIMI cache file.
+    
+    Compounds are streamed and written one at a time, so the output starts
+    immediately and -n stops reading the cache after the requested count.
+    Entries of masses-only caches are written with their isotope variants
+    expanded as in mimi_mass_analysis.
     
     Args:
         cache_file (str): Path to the .pkl cache file
         num_compounds (int, optional): Number of compounds to output. If None, outputs all.
         output_file (str, optional): Path to output file. If None, prints to stdout.
         num_isotopes (int, optional): Number of isotopes per compound to output. If None, outputs all.
+        ids (list, optional): Only output compounds with these IDs
+        formulas (list, optional): Only output compounds with these chemical formulas
+        mass_min (float, optional): Only output compounds with monoisotopic mass >= mass_min
+        mass_max (float, optional): Only output compounds with monoisotopic mass <= mass_max
+        output_format (str): 'text' (human-readable), 'tsv' (one row per isotope entry)
+            or 'jsonl' (one JSON object per compound)
     """
     # Load isotope data with default isotope file
     atom.load_isotope()
     
-    # Load cache data
-    with open(cache_file, 'rb') as f:
-        cache_data = pickle.load(f)
-        
-    # Handle metadata if present (newer cache format)
-    compounds = cache_data.get('compounds', cache_data)
-    metadata = cache_data.get('metadata', {})
-    
     # Prepare output file handle
     out = open(output_file, 'w') if output_file else sys.stdout
     
     try:
-        # Print metadata if available
-        if metadata:
-            print("# Cache Metadata:", file=out)
-            # Print creation info
-            print(f"# Creation Date: {metadata.get('creation_date', 'Unknown')}", file=out)
-            print(f"# MIMI Version: {metadata.get('mimi_version', 'Unknown')}", file=out)
-            
-            # Print command line parameters
-            cmd_line = metadata.get('command_line', {})
-            if cmd_line:
-                print("\n# Creation Parameters:", file=out)
-                print(f"# Full Command: {cmd_line.get('full_command', 'Unknown')}", file=out)
-                print(f"# Ionization Mode: {cmd_line.get('ionization_mode', 'Unknown')}", file=out)
-                print(f"# Labeled Atoms File: {cmd_line.get('labeled_atoms_file', 'None')}", file=out)
-                print(f"# Compound DB Files: {', '.join(cmd_line.get('compound_db_files', ['Unknown']))}", file=out)
-                print(f"# Cache Output File: {cmd_line.get('cache_output_file', 'Unknown')}", file=out)
-                print(f"# Isotope Data File: {cmd_line.get('isotope_data_file', 'Unknown')}", file=out)
-            
-            print(file=out)
+        metadata = read_cache_header(cache_file).get('metadata', {})
+        cmd_line = metadata.get('command_line', {})
+        if output_format == 'text':
+            # Print metadata if available
+            if metadata:
+                print_metadata(metadata, out)
+            write_compound = write_compound_text
+        elif output_format == 'tsv':
+            out.write('\t'.join(TSV_FIELDS) + '\n')
+            write_compound = write_compound_tsv
+        else:
+            write_compound = write_compound_jsonl
         
         # Get compounds to process
-        compounds_iter = compounds.items()
+        compounds_iter = select_compounds(cache_file, ids, formulas, mass_min, mass_max)
         if num_compounds:
             compounds_iter = islice(compounds_iter, num_compounds)
             
-        # Print compound data with improved formatting
         for compound_id, data in compounds_iter:
-            # Print main compound entry (mono-isotopic mass)
-            formatted_cf = format_cf_with_masses(data['cf'])
-            
-            print("=" * 60, file=out)
-            print(f"Compound ID:      {compound_id}", file=out)
-            print(f"Name:             {data['cname']}", file=out)
-            print(f"Formula:          {formatted_cf}", file=out)
-            print(f"Mono-isotopic:    Yes (most abundant isotope)", file=out)
-            print(f"Mass:             {data['mass']:.6f}", file=out)
-            print(f"Relative Abund:   1.000000 (reference)", file=out)
-            print("-" * 60, file=out)
-            
-            # Print isotope variants
-            isotopes = data['isotope_mass_list'][1:]  # Skip first entry (main compound)
-            if num_isotopes:
-                isotopes = isotopes[:num_isotopes]
-            
-            if isotopes:
-                print("ISOTOPE VARIANTS:", file=out)
-                
-            for i, (mass, abundance, isotope_formula) in enumerate(isotopes, 1):
-                print(f"  Variant #{i}:", file=out)
-                print(f"  Formula:        {isotope_formula.strip()}", file=out)
-                print(f"  Mono-isotopic:  No (isotope variant)", file=out)
-                print(f"  Mass:           {mass:.6f}", file=out)
-                print(f"  Relative Abund: {abundance:.6f} (expected)", file=out)
-                print("-" * 60, file=out)
-            
-            print(file=out)  # Add extra line between compounds
+            if cmd_line.get('masses_only') and not data['isotope_mass_list']:
+                data = dict(data, isotope_mass_list=expand_isotope_variants(
+                    data, cmd_line['ionization_mode'], cmd_line.get('noise_cutoff') or 1e-5))
+            write_compound(out, compound_id, data, num_isotopes)
             
     finally:
         if output_file:
@@ -191,12 +416,36 @@ def main():
     ap.add_argument("-i", "--num-isotopes", type=int,
                     help="Number of isotopes per compound to output (default: all)")
     ap.add_argument("-o", "--output", help="Output file (default: stdout)")
+    ap.add_argument("--id", dest="ids", nargs='+', metavar="ID",
+                    help="Only output compounds with these IDs")
+    ap.add_argument("--formula", dest="formulas", nargs='+', metavar="CF",
+                    help="Only output compounds with these chemical formulas")
+    ap.add_argument("--mass-min", dest="mass_min", type=float,
+                    help="Only output compounds with monoisotopic mass >= MASS_MIN")
+    ap.add_argument("--mass-max", dest="mass_max", type=float,
+                    help="Only output compounds with monoisotopic mass <= MASS_MAX")
+    ap.add_argument("-f", "--format", dest="output_format", choices=['text', 'tsv', 'jsonl'], default='text',
+                    help="Output format (default: text)")
+    ap.add_argument("--info", action='store_true', default=False,
+                    help="Print only the cache metadata without loading compounds")
+    ap.add_argument("--stats", action='store_true', default=False,
+                    help="Print size and verification-cost statistics instead of compounds")
+    ap.add_argument("--top", type=int, default=10,
+                    help="Number of compounds with the most isotope variants listed by --stats (default: 10)")
+    ap.add_argument("--mass-bin", dest="mass_bin", type=float, default=100.0,
+                    help="Mass histogram bin width in Da for --stats (default: 100)")
     
     
     args = ap.parse_args()
     
     try:
-        dump_cache(args.cache_file, args.num_compounds, args.output, args.num_isotopes)
+        if args.info:
+            dump_cache_info(args.cache_file, args.output)
+        elif args.stats:
+            cache_stats(args.cache_file, args.output, args.top, args.mass_bin)
+        else:
+            dump_cache(args.cache_file, args.num_compounds, args.output, args.num_isotopes,
+                       args.ids, args.formulas, args.mass_min, args.mass_max, args.output_format)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
@@ -35,6 +35,124 @@ from mimi.atom import load_isotope
 from datetime import datetime
 
 
+def iter_hmdb_metabolites(xml_file, min_mass=None, max_mass=None, preferred_id="accession", counts=None, progress=True):
+    """
+    Stream metabolites from an HMDB metabolites XML file.
+
+    Metabolites are yielded as soon as their element has been parsed, so a
+    consumer can start working before the whole file has been read. Formulas
+    are not validated here; that is left to the consumer, which usually parses
+    them anyway.
+
+    Args:
+        xml_file: Path to the HMDB metabolites XML file
+        min_mass: Minimum molecular weight to include (optional)
+        max_mass: Maximum molecular weight to include (optional)
+        preferred_id: ID tag to use, falling back to the accession
+        counts: Optional dict updated in place with 'processed' and 'skipped' counts
+        progress: Print a running count of processed metabolites
+
+    Yields:
+        tuple: (chemical_formula, metabolite_id, name)
+
+    Raises:
+        FileNotFoundError: If the XML file does not exist
+    """
+    # Define the namespace
+    ns = {'hmdb': 'http://www.hmdb.ca'}
+
+    if counts is None:
+        counts = {}
+    counts.setdefault('processed', 0)
+    counts.setdefault('skipped', 0)
+
+    # Use iterparse to process the XML file incrementally
+    context = ET.iterparse(xml_file, events=('start', 'end'))
+
+    # Track current metabolite data
+    metabolite_id = None
+    name = None
+    chemical_formula = None
+    mol_weight = None
+    preferred_id_val = None
+
+    # Track XML path to avoid capturing disease names
+    path_stack = []
+
+    if progress:
+        print("Parsing metabolites...")
+
+    for event, elem in context:
+        if event == 'start':
+            path_stack.append(elem.tag)
+        elif event == 'end':
+            # Check if this is a metabolite element before processing others
+            if elem.tag == f"{{{ns['hmdb']}}}metabolite":
+                # Process the complete metabolite
+                counts['processed'] += 1
+
+                # Determine which ID to use
+                final_id = preferred_id_val if preferred_id_val else metabolite_id
+
+                record = None
+                if not all(x is not None for x in [final_id, name, chemical_formula, mol_weight]):
+                    counts['skipped'] += 1
+                elif (min_mass is not None and mol_weight < min_mass) or \
+                     (max_mass is not None and mol_weight > max_mass):
+                    counts['skipped'] += 1
+                else:
+                    record = (chemical_formula, final_id, name)
+
+                # Update progress
+                if progress and counts['processed'] % 100 == 0:
+                    print(f"\rProcessed metabolites in HMDB file...{counts['processed']}", end="", flush=True)
+
+                # Reset for next metabolite
+                metabolite_id = None
+                name = None
+                chemical_formula = None
+                mol_weight = None
+                preferred_id_val = None
+
+                # Clear the element to free memory
+                elem.clear()
+
+                if record is not None:
+                    yield record
+
+            elif elem.tag == f"{{{ns['hmdb']}}}accession" and elem.text:
+                # Only capture if parent is metabolite
+                if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
+                    metabolite_id = elem.text
+            elif elem.tag == f"{{{ns['hmdb']}}}{preferred_id}" and elem.text:
+                # Only capture if parent is metabolite
+                if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
+                    preferred_id_val = elem.text
+            elif elem.tag == f"{{{ns['hmdb']}}}name" and elem.text:
+                # Only capture if parent is metabolite (not under diseases or other sub-elements)
+                if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
+                    name = elem.text
+            elif elem.tag == f"{{{ns['hmdb']}}}chemical_formula" and elem.text:
+                # Only capture if parent is metabolite
+                if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
+                    chemical_formula = elem.text
+            elif elem.tag == f"{{{ns['hmdb']}}}average_molecular_weight" and elem.text:
+                # Only capture if parent is metabolite
+                if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
+                    try:
+                        mol_weight = float(elem.text)
+                    except ValueError:
+                        mol_weight = None
+
+            # Remove the tag from path stack after processing
+            if path_stack:
+                path_stack.pop()
+
+    # Print newline after progress bar completes
+    if progress:
+        print()
+
+
 def parse_hmdb_xml(xml_file, min_mass=None, max_mass=None, preferred_id="accession"):
     """
     Parse HMDB metabolites XML file and extract relevant information.
@@ -50,133 +168,20 @@ def parse_hmdb_xml(xml_file, min_mass=None, max_mass=None, preferred_id="accessi
         - Number of skipped metabolites
         - Total number of processed metabolites
     """
-    # Define the namespace
-    ns = {'hmdb': 'http://www.hmdb.ca'}
-    
     metabolites = []
-    skipped_count = 0
-    incomplete_count = 0
-    
+    counts = {}
+
     try:
-        # Use iterparse to process the XML file incrementally
-        context = ET.iterparse(xml_file, events=('start', 'end'))
-        
-        # Track current metabolite data
-        metabolite_id = None
-        name = None
-        chemical_formula = None
-        mol_weight = None
-        preferred_id_val = None
-        
-        # Track XML path to avoid capturing disease names
-        path_stack = []
-        current_metabolite_elem = None
-        
-        # Setup progress tracking
-        processed_count = 0
-        print("Parsing metabolites...")
-        
-        for event, elem in context:
-            if event == 'start':
-                path_stack.append(elem.tag)
-            elif event == 'end':
+        for chemical_formula, final_id, name in iter_hmdb_metabolites(xml_file, min_mass, max_mass,
+                                                                      preferred_id, counts):
+            # Only include if formula can be parsed successfully
+            try:
+                parse_molecular_formula(chemical_formula)
+                metabolites.append((chemical_formula, final_id, name))
+            except KeyError:
+                counts['skipped'] += 1
 
-                
-                # Check if this is a metabolite element before processing others
-                if elem.tag == f"{{{ns['hmdb']}}}metabolite":
-                    # Process the complete metabolite
-                    processed_count += 1
-                    
-
-                    # Determine which ID to use
-                    final_id = preferred_id_val if preferred_id_val else metabolite_id
-
-                    # print(f"final_id: {final_id}, name: {name}, chemical_formula: {chemical_formula}, mol_weight: {mol_weight}")
-
-
-                    if not all(x is not None for x in [final_id, name, chemical_formula, mol_weight]):
-                        incomplete_count += 1
-                    else:
-                        # Check mass range if filtering is enabled
-                        if min_mass is not None or max_mass is not None:
-                            if mol_weight is None or \
-                               (min_mass is not None and mol_weight < min_mass) or \
-                               (max_mass is not None and mol_weight > max_mass):
-                                skipped_count += 1
-                            else:
-                                # Only include if formula can be parsed successfully
-                                try:
-                                    # Attempt to parse the formula
-                                    parse_molecular_formula(chemical_formula)
-                                    
-                                    # If successful, add to metabolites list
-                                    metabolites.append((chemical_formula, final_id, name))
-                                except KeyError:
-                                    skipped_count += 1
-                        else:
-                            # No mass filtering, just check formula
-                            try:
-                                parse_molecular_formula(chemical_formula)
-                                metabolites.append((chemical_formula, final_id, name))
-                            except KeyError:
-                                skipped_count += 1
-                    
-                    # Update progress
-                    if processed_count % 100 == 0:
-                        print(f"\rProcessed metabolites in HMDB file...{processed_count}", end="", flush=True)
-                    
-                    # Reset for next metabolite
-                    metabolite_id = None
-                    name = None
-                    chemical_formula = None
-                    mol_weight = None
-                    preferred_id_val = None
-                    current_metabolite_elem = None
-                    
-                    # Clear the element to free memory
-                    elem.clear()
-                    
-                elif elem.tag == f"{{{ns['hmdb']}}}accession" and elem.text:
-                    # Only capture if parent is metabolite
-                    if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
-                        metabolite_id = elem.text
-                elif elem.tag == f"{{{ns['hmdb']}}}{preferred_id}" and elem.text:
-                    # Only capture if parent is metabolite
-                    if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
-                        preferred_id_val = elem.text
-                elif elem.tag == f"{{{ns['hmdb']}}}name" and elem.text:
-                    
-                    # Only capture if parent is metabolite (not under diseases or other sub-elements)
-                    if len(path_stack) ==3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
-                        name = elem.text
-                        if name == 'Parkinson\'s disease':
-                            print(f"Parkinson's disease: {elem.text}")
-                elif elem.tag == f"{{{ns['hmdb']}}}chemical_formula" and elem.text:
-                    # Only capture if parent is metabolite
-                    if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
-                        chemical_formula = elem.text
-                elif elem.tag == f"{{{ns['hmdb']}}}average_molecular_weight" and elem.text:
-                    # Only capture if parent is metabolite
-                    if len(path_stack) == 3 and path_stack[-2] == f"{{{ns['hmdb']}}}metabolite":
-                        try:
-                            mol_weight = float(elem.text)
-                        except ValueError:
-                            mol_weight = None
-
-
-               
-                
-                # Remove the tag from path stack after processing
-                if path_stack:
-                    path_stack.pop()
-        
-        # Print newline after progress bar completes
-        print()
-        
-        # Add incomplete count to skipped count for total
-        skipped_count += incomplete_count
-        
-        return metabolites, skipped_count, processed_count
+        return metabolites, counts['skipped'], counts['processed']
         
     except FileNotFoundError:
         print(f"Error: File '{xml_file}' not found.")
@@ -360,4 +365,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main() 
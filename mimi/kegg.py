@@ -181,6 +181,45 @@ def get_compound_info_batch(compound_ids, max_retries=5):
                 print(f"Error: {str(e)}")
                 return []
 
+def iter_kegg_compounds(compound_ids=None, mass_range=None, batch_size=5, counts=None):
+    """
+    Stream KEGG compounds batch by batch.
+
+    Each batch is yielded as soon as it has been fetched, so a consumer can
+    work on it while the next request is in flight. Formulas are not
+    validated here; that is left to the consumer, which usually parses them
+    anyway.
+
+    Args:
+        compound_ids: List of KEGG compound IDs (optional)
+        mass_range: Tuple of (min_mass, max_mass) in Da (optional)
+        batch_size: Number of compounds to request at a time
+        counts: Optional dict updated in place with 'processed' and 'skipped' counts
+
+    Yields:
+        tuple: (chemical_formula, compound_id, name)
+    """
+    if counts is None:
+        counts = {}
+    counts.setdefault('processed', 0)
+    counts.setdefault('skipped', 0)
+
+    if mass_range:
+        min_mass, max_mass = mass_range
+        compound_ids = get_compounds_by_mass_range(min_mass, max_mass)
+        print(f"Found {len(compound_ids)} compounds in mass range {min_mass}-{max_mass} Da")
+
+    for i in range(0, len(compound_ids or []), batch_size):
+        batch = compound_ids[i:i + batch_size]
+        for formula, cpd_id, name, exact_mass in get_compound_info_batch(batch):
+            counts['processed'] += 1
+            if formula == "N/A":
+                counts['skipped'] += 1
+                continue
+            yield formula, cpd_id, name
+        time.sleep(0.1)  # Be nice to KEGG server
+
+
 def get_kegg_db_info():
     """
     Get KEGG database information from the REST API.
@@ -0,0 +1,329 @@
+# Copyright 2025 New York University. All Rights Reserved.
+
+# A license to use and copy this software and its documentation solely for your internal non-commercial
+# research and evaluation purposes, without fee and without a signed licensing agreement, is hereby granted
+# upon your download of the software, through which you agree to the following: 1) the above copyright
+# notice, this paragraph and the following three paragraphs will prominently appear in all internal copies
+# and modifications; 2) no rights to sublicense or further distribute this software are granted; 3) no rights
+# to modify this software are granted; and 4) no rights to assign this license are granted. Please contact
+# the NYU Technology Opportunities and Ventures TOVcommunications@nyulangone.org for commercial
+# licensing opportunities, or for further distribution, modification or license rights.
+
+# Created by Nabil Rahiman & Kristin Gunsalus
+
+# IN NO EVENT SHALL NYU, OR THEIR EMPLOYEES, OFFICERS, AGENTS OR TRUSTEES
+# ("COLLECTIVELY "NYU PARTIES") BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+# INCIDENTAL, OR CONSEQUENTIAL DAMAGES OF ANY KIND, INCLUDING LOST PROFITS, ARISING
+# OUT OF ANY CLAIM RESULTING FROM YOUR USE OF THIS SOFTWARE AND ITS
+# DOCUMENTATION, EVEN IF ANY OF NYU PARTIES HAS BEEN ADVISED OF THE POSSIBILITY
+# OF SUCH CLAIM OR DAMAGE.
+
+# NYU SPECIFICALLY DISCLAIMS ANY WARRANTIES OF ANY KIND REGARDING THE SOFTWARE,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE, OR THE ACCURACY OR USEFULNESS,
+# OR COMPLETENESS OF THE SOFTWARE. THE SOFTWARE AND ACCOMPANYING DOCUMENTATION,
+# IF ANY, PROVIDED HEREUNDER IS PROVIDED COMPLETELY "AS IS". NYU HAS NO OBLIGATION TO PROVIDE
+# FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
+
+"""
+Mass Matching Module
+
+This module matches masses against a sorted array of sample peak masses within
+a PPM tolerance. All queries are answered at once with np.searchsorted, so
+matching the compounds of a cache against a sample costs a few NumPy calls
+instead of one Python loop per compound.
+
+A query mass q hits a peak mass m when q > m - eps and q < m + eps, with
+eps = q * ppm. The tolerance windows are first located with np.searchsorted on
+slightly widened bounds, and the candidates are then checked with exactly this
+comparison, so the hits do not depend on rounding in the bounds.
+
+Several tolerances can be evaluated in one pass: the pairs are searched once
+at the widest tolerance, and the pairs of every tighter tolerance are selected
+from them with the same exact comparison, so each tolerance gives exactly the
+hits of a search at that tolerance alone.
+
+Isotope envelopes are verified the same way: the variant masses of all matched
+compounds are looked up together, the intensity ratios are checked with array
+operations, and the results are summed per compound with np.bincount.
+
+A very large sample can be split into m/z partitions that are matched
+independently. Each partition gets the peaks of its own mass range plus
+overlap margins covering the PPM windows and isotope offsets of its queries,
+so every hit of a query lies inside its partition and the partitions together
+give exactly the hits of the whole sample.
+
+Functions:
+    ppm_window_bounds: Candidate index ranges of the PPM windows of query masses
+    ppm_window_pairs: All (query, peak) pairs within the PPM tolerance
+    ppm_pair_mask: Select the pairs within a tighter PPM tolerance
+    first_pair_hits: Lowest matching peak index of every query from its pairs
+    first_ppm_hits: Lowest matching peak index of every query mass
+    first_ppm_hits_grid: Lowest matching peak indices for several PPM tolerances
+    segment_indices: Flat indices of a set of contiguous segments
+    mz_partitions: Split query masses into m/z partitions with overlapping peak ranges
+    blank_peak_mask: Find the sample peaks not explained by blank peaks
+    verify_isotope_envelopes: Count matched and valid isotope variants per compound
+"""
+
+import numpy as np
+
+# Relative widening of the searchsorted bounds; the exact test is applied afterwards
+_BOUND_SLACK = 1e-9
+
+# Maximum relative error between expected and measured isotope ratio of a valid variant
+ISOTOPE_RATIO_TOLERANCE = 0.3
+
+
+def segment_indices(starts, lengths):
+    """Concatenate the index ranges starts[i]:starts[i] + lengths[i].
+
+    Args:
+        starts (array-like): First index of every segment
+        lengths (array-like): Length of every segment
+
+    Returns:
+        np.ndarray: int64 indices of all segments, in segment order
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    # Position of every element within its segment, added to the segment start
+    segment_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + (np.arange(lengths.sum()) - segment_offsets)
+
+
+def ppm_window_bounds(query_masses, target_masses, ppm):
+    """Locate the candidate index range of the PPM window of every query mass.
+
+    Args:
+        query_masses (array-like): Masses to look up, in any order
+        target_masses (np.ndarray): Sorted float64 peak masses
+        ppm (float): Tolerance as a fraction (e.g. 5e-6 for 5 ppm)
+
+    Returns:
+        tuple: (lo, hi) int64 arrays; the candidates of query i are
+            target_masses[lo[i]:hi[i]]
+    """
+    query_masses = np.asarray(query_masses, dtype=np.float64)
+    eps = query_masses * ppm
+    slack = eps * _BOUND_SLACK + np.abs(query_masses) * np.finfo(np.float64).eps
+    lo = np.searchsorted(target_masses, query_masses - eps - slack, side='left')
+    hi = np.searchsorted(target_masses, query_masses + eps + slack, side='right')
+    return lo, hi
+
+
+def ppm_window_pairs(query_masses, target_masses, ppm):
+    """Find all (query, peak) pairs within the PPM tolerance.
+
+    Args:
+        query_masses (array-like): Masses to look up, in any order
+        target_masses (np.ndarray): Sorted float64 peak masses
+        ppm (float): Tolerance as a fraction (e.g. 5e-6 for 5 ppm)
+
+    Returns:
+        tuple: (query_idx, target_idx) int64 arrays, ordered by query index
+            and, within a query, by ascending peak index
+    """
+    query_masses = np.asarray(query_masses, dtype=np.float64)
+    lo, hi = ppm_window_bounds(query_masses, target_masses, ppm)
+    counts = hi - lo
+    query_idx = np.repeat(np.arange(len(query_masses)), counts)
+    target_idx = segment_indices(lo, counts)
+
+    hit = ppm_pair_mask(query_masses, target_masses, query_idx, target_idx, ppm)
+    return query_idx[hit], target_idx[hit]
+
+
+def ppm_pair_mask(query_masses, target_masses, query_idx, target_idx, ppm):
+    """Test which (query, peak) pairs are within the PPM tolerance.
+
+    Args:
+        query_masses (np.ndarray): float64 query masses
+        target_masses (np.ndarray): Sorted float64 peak masses
+        query_idx (np.ndarray): Query index of every pair
+        target_idx (np.ndarray): Peak index of every pair
+        ppm (float): Tolerance as a fraction (e.g. 5e-6 for 5 ppm)
+
+    Returns:
+        np.ndarray: Boolean mask of the pairs within tolerance
+    """
+    query = query_masses[query_idx]
+    target = target_masses[target_idx]
+    eps = query * ppm
+    return (query < target + eps) & (query > target - eps)
+
+
+def first_pair_hits(query_idx, target_idx, count):
+    """Find the lowest peak index of every query from its (query, peak) pairs.
+
+    Args:
+        query_idx (np.ndarray): Query index of every pair, ordered by query and,
+            within a query, by ascending peak index
+        target_idx (np.ndarray): Peak index of every pair
+        count (int): Number of queries
+
+    Returns:
+        np.ndarray: int64 array with the first hit of every query, or -1
+            where a query has no pair
+    """
+    first = np.full(count, -1, dtype=np.int64)
+    # Pairs are ordered by query, so the first pair of every query is its lowest peak
+    queries, starts = np.unique(query_idx, return_index=True)
+    first[queries] = target_idx[starts]
+    return first
+
+
+def first_ppm_hits(query_masses, target_masses, ppm):
+    """Find the lowest matching peak index of every query mass.
+
+    Args:
+        query_masses (array-like): Masses to look up, in any order
+        target_masses (np.ndarray): Sorted float64 peak masses
+        ppm (float): Tolerance as a fraction (e.g. 5e-6 for 5 ppm)
+
+    Returns:
+        np.ndarray: int64 array with the first hit of every query, or -1
+            where no peak is within tolerance
+    """
+    query_idx, target_idx = ppm_window_pairs(query_masses, target_masses, ppm)
+    return first_pair_hits(query_idx, target_idx, len(query_masses))
+
+
+def first_ppm_hits_grid(query_masses, target_masses, ppms):
+    """Find the lowest matching peak index of every query mass for several tolerances.
+
+    The pairs are searched once at the widest tolerance; the hits of each
+    tolerance are the same as those of first_ppm_hits at that tolerance.
+
+    Args:
+        query_masses (array-like): Masses to look up, in any order
+        target_masses (np.ndarray): Sorted float64 peak masses
+        ppms (list): Tolerances as fractions
+
+    Returns:
+        list: One first_ppm_hits result per tolerance, in the order of ppms
+    """
+    query_masses = np.asarray(query_masses, dtype=np.float64)
+    query_idx, target_idx = ppm_window_pairs(query_masses, target_masses, max(ppms))
+    hits = []
+    for ppm in ppms:
+        hit = ppm_pair_mask(query_masses, target_masses, query_idx, target_idx, ppm)
+        hits.append(first_pair_hits(query_idx[hit], target_idx[hit], len(query_masses)))
+    return hits
+
+
+def mz_partitions(query_masses, target_masses, count, ppm, offset_range=(0.0, 0.0)):
+    """Split query masses into m/z partitions of about equal size.
+
+    The peak range of a partition covers the PPM windows of its queries and of
+    every mass offset_range away from them (e.g. isotope variants), so matching
+    a partition against its peak range finds the same hits as matching it
+    against all peaks.
+
+    Args:
+        query_masses (array-like): Masses to look up, in any order
+        target_masses (np.ndarray): Sorted float64 peak masses
+        count (int): Number of partitions
+        ppm (float): Largest tolerance used for the partition, as a fraction
+        offset_range (tuple): (lowest, highest) mass offset from a query that
+            is looked up as well; the monoisotopic query itself is always covered
+
+    Returns:
+        list: (query_idx, lo, hi) per non-empty partition in ascending m/z order,
+            where query_idx are the query indices of the partition and
+            target_masses[lo:hi] is its peak range
+    """
+    query_masses = np.asarray(query_masses, dtype=np.float64)
+    low_offset = min(offset_range[0], 0.0)
+    high_offset = max(offset_range[1], 0.0)
+
+    partitions = []
+    for query_idx in np.array_split(np.argsort(query_masses, kind='stable'), count):
+        if not len(query_idx):
+            continue
+        lo, _ = ppm_window_bounds([query_masses[query_idx[0]] + low_offset], target_masses, ppm)
+        _, hi = ppm_window_bounds([query_masses[query_idx[-1]] + high_offset], target_masses, ppm)
+        partitions.append((np.sort(query_idx), int(lo[0]), int(hi[0])))
+    return partitions
+
+
+def blank_peak_mask(masses, intensities, blank_masses, blank_intensities, ppm, fold=None):
+    """Find the sample peaks that are not explained by blank peaks.
+
+    A sample peak is explained by the blanks when a blank peak lies within the
+    PPM tolerance of its mass and, with fold, the sample peak is less than
+    fold times as intense as the most intense such blank peak.
+
+    Args:
+        masses (np.ndarray): float64 sample peak masses
+        intensities (np.ndarray): Sample peak intensities
+        blank_masses (np.ndarray): Sorted float64 masses of the merged blank peaks
+        blank_intensities (np.ndarray): Blank peak intensities, aligned with blank_masses
+        ppm (float): Tolerance as a fraction (e.g. 5e-6 for 5 ppm)
+        fold (float, optional): Keep sample peaks at least this many times as
+            intense as the blank peaks they match
+
+    Returns:
+        np.ndarray: Boolean mask of the sample peaks to keep
+    """
+    peak_idx, blank_idx = ppm_window_pairs(masses, blank_masses, ppm)
+    explained = np.zeros(len(masses), dtype=bool)
+    if fold is None:
+        explained[peak_idx] = True
+    else:
+        blank_max = np.zeros(len(masses), dtype=np.float64)
+        np.maximum.at(blank_max, peak_idx, blank_intensities[blank_idx])
+        explained[peak_idx] = True
+        explained &= intensities < fold * blank_max
+    return ~explained
+
+
+def verify_isotope_envelopes(variant_masses, variant_abundances, variant_owner, first_intensities,
+                             peak_masses, peak_intensities, ppm, pairs=None):
+    """Verify the isotope variants of many matched compounds against one sample.
+
+    A variant is matched when at least one peak lies within the PPM tolerance
+    of its mass, and valid when the intensity of one of those peaks relative
+    to the monoisotopic peak of its compound is within
+    ISOTOPE_RATIO_TOLERANCE of the expected relative abundance.
+
+    Args:
+        variant_masses (array-like): Masses of all variants, flattened over compounds
+        variant_abundances (array-like): Expected relative abundance of every variant
+        variant_owner (array-like): Index of the matched compound of every variant
+        first_intensities (array-like): Intensity of the monoisotopic peak of every
+            matched compound
+        peak_masses (np.ndarray): Sorted float64 peak masses of the sample
+        peak_intensities (np.ndarray): Peak intensities, aligned with peak_masses
+        ppm (float): Verification tolerance as a fraction
+        pairs (tuple, optional): (variant_idx, peak_idx) of all variant/peak
+            pairs within ppm, e.g. selected from a search at a wider tolerance
+            with ppm_pair_mask; searched with ppm_window_pairs if not given
+
+    Returns:
+        tuple: (iso_count, iso_valid, hits) where iso_count and iso_valid are
+            int64 arrays with the number of matched and valid variants of every
+            compound, and hits is a (variant_idx, peak_idx, ratio, error_rate)
+            tuple of arrays describing every variant/peak pair
+    """
+    variant_abundances = np.asarray(variant_abundances, dtype=np.float64)
+    variant_owner = np.asarray(variant_owner, dtype=np.int64)
+    first_intensities = np.asarray(first_intensities, dtype=np.float64)
+
+    if pairs is None:
+        pairs = ppm_window_pairs(variant_masses, peak_masses, ppm)
+    variant_idx, peak_idx = pairs
+    abundance = variant_abundances[variant_idx]
+    # A zero intensity or abundance gives an infinite or NaN error, i.e. an invalid hit
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = peak_intensities[peak_idx] / first_intensities[variant_owner[variant_idx]]
+        error_rate = np.abs(abundance - ratio) / np.abs(abundance)
+
+    matched = np.zeros(len(variant_abundances), dtype=bool)
+    matched[variant_idx] = True
+    valid = np.zeros(len(variant_abundances), dtype=bool)
+    valid[variant_idx[error_rate < ISOTOPE_RATIO_TOLERANCE]] = True
+
+    iso_count = np.bincount(variant_owner[matched], minlength=len(first_intensities))
+    iso_valid = np.bincount(variant_owner[valid], minlength=len(first_intensities))
+    return iso_count, iso_valid, (variant_idx, peak_idx, ratio, error_rate)
@@ -0,0 +1,210 @@
+# Copyright 2025 New York University. All Rights Reserved.
+
+# A license to use and copy this software and its documentation solely for your internal non-commercial
+# research and evaluation purposes, without fee and without a signed licensing agreement, is hereby granted
+# upon your download of the software, through which you agree to the following: 1) the above copyright
+# notice, this paragraph and the following three paragraphs will prominently appear in all internal copies
+# and modifications; 2) no rights to sublicense or further distribute this software are granted; 3) no rights
+# to modify this software are granted; and 4) no rights to assign this license are granted. Please contact
+# the NYU Technology Opportunities and Ventures TOVcommunications@nyulangone.org for commercial
+# licensing opportunities, or for further distribution, modification or license rights.
+
+# Created by Nabil Rahiman & Kristin Gunsalus
+
+# IN NO EVENT SHALL NYU, OR THEIR EMPLOYEES, OFFICERS, AGENTS OR TRUSTEES
+# ("COLLECTIVELY "NYU PARTIES") BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+# INCIDENTAL, OR CONSEQUENTIAL DAMAGES OF ANY KIND, INCLUDING LOST PROFITS, ARISING
+# OUT OF ANY CLAIM RESULTING FROM YOUR USE OF THIS SOFTWARE AND ITS
+# DOCUMENTATION, EVEN IF ANY OF NYU PARTIES HAS BEEN ADVISED OF THE POSSIBILITY
+# OF SUCH CLAIM OR DAMAGE.
+
+# NYU SPECIFICALLY DISCLAIMS ANY WARRANTIES OF ANY KIND REGARDING THE SOFTWARE,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE, OR THE ACCURACY OR USEFULNESS,
+# OR COMPLETENESS OF THE SOFTWARE. THE SOFTWARE AND ACCOMPANYING DOCUMENTATION,
+# IF ANY, PROVIDED HEREUNDER IS PROVIDED COMPLETELY "AS IS". NYU HAS NO OBLIGATION TO PROVIDE
+# FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
+
+"""
+Cache Merge Module
+
+This module combines several MIMI cache files into one, or writes a subset of
+a cache restricted to an ID list or a monoisotopic mass window. Compound entries
+are copied unchanged, so no isotope variants are recomputed.
+
+Only caches built with the same ionization mode, labelled atoms, noise cutoff
+and isotope data can be merged. Compounds are deduplicated by ID; the first
+cache listed wins. A compound ID that occurs with formulas of different mass is
+reported as a CF_CONFLICT, like in mimi_mass_analysis.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import pkg_resources
+from mimi import atom
+from mimi.cache import read_cache_header, select_compounds, write_cache, resolve_cache_file, COMPRESSION_CODECS
+from mimi.analysis import calculate_formula_mass, read_ids_file
+
+# Creation parameters that must agree for caches to be merged
+MERGE_FIELDS = ['ionization_mode', 'labeled_atoms_file', 'noise_cutoff', 'masses_only', 'isotope_data_file']
+
+
+def check_compatible(cache_files):
+    """Check that cache files were built with the same parameters.
+
+    Labelled caches are compared by the label data recorded in their metadata,
+    so caches built from the same label file on different machines merge, and
+    caches built from different files of the same name do not. Caches without
+    recorded label data are compared by the labelled atoms file path.
+
+    Args:
+        cache_files (list): Paths to the .pkl cache files
+
+    Returns:
+        list: Metadata of each cache file
+
+    Raises:
+        ValueError: If any creation parameter in MERGE_FIELDS differs
+    """
+    metadatas = [read_cache_header(cache_file).get('metadata', {}) for cache_file in cache_files]
+    reference = metadatas[0].get('command_line', {})
+    for cache_file, metadata in zip(cache_files[1:], metadatas[1:]):
+        cmd_line = metadata.get('command_line', {})
+        for field in MERGE_FIELDS:
+            expected = reference.get(field)
+            found = cmd_line.get(field)
+            if field == 'labeled_atoms_file' and 'labelled_atoms' in metadatas[0] and 'labelled_atoms' in metadata:
+                if metadatas[0]['labelled_atoms'] != metadata['labelled_atoms']:
+                    raise ValueError(f"Cache '{cache_file}' was built with label data from '{found}' that differs "
+                                     f"from the label data of '{cache_files[0]}' (from '{expected}')")
+                continue
+            if field == 'masses_only':
+                expected = bool(expected)
+                found = bool(found)
+            if expected != found:
+                raise ValueError(f"Cache '{cache_file}' has {field} '{found}', "
+                                 f"but '{cache_files[0]}' has '{expected}'")
+    return metadatas
+
+
+def merge_caches(cache_files, ids=None, mass_min=None, mass_max=None):
+    """Merge the compounds of several cache files.
+
+    Args:
+        cache_files (list): Paths to the .pkl cache files, in priority order
+        ids (list, optional): Compound IDs to keep
+        mass_min (float, optional): Minimum monoisotopic mass (inclusive)
+        mass_max (float, optional): Maximum monoisotopic mass (inclusive)
+
+    Returns:
+        tuple: (compounds, duplicates, conflicts) where compounds maps compound
+            IDs to their unchanged cache entries, duplicates is the number of
+            dropped repeated IDs and conflicts lists (compound_id, kept_file,
+            kept_cf, dropped_file, dropped_cf) tuples for CF_CONFLICT cases
+    """
+    compounds = {}
+    source = {}
+    duplicates = 0
+    conflicts = []
+    for cache_file in cache_files:
+        for co, data in select_compounds(cache_file, ids=ids, mass_min=mass_min, mass_max=mass_max):
+            if co not in compounds:
+                compounds[co] = data
+                source[co] = cache_file
+                continue
+
+            duplicates += 1
+            existing_formula = compounds[co]['cf']
+            current_formula = data['cf']
+            if existing_formula == current_formula:
+                continue
+            existing_mass = calculate_formula_mass(existing_formula)
+            current_mass = calculate_formula_mass(current_formula)
+            if existing_mass is None or current_mass is None or abs(current_mass - existing_mass) > 1e-6:
+                conflicts.append((co, source[co], existing_formula, cache_file, current_formula))
+    return compounds, duplicates, conflicts
+
+
+def main():
+    """Main entry point for the cache merge tool."""
+    ap = argparse.ArgumentParser(description="MIMI Cache Merge and Subset Tool")
+
+    ap.add_argument("-c", "--cache", dest="cache_files", nargs='+', required=True, metavar="DBBINARY",
+                    help="Binary DB input file(s), without extension; on duplicate IDs the first file wins")
+    ap.add_argument("-o", "--output", required=True,
+                    help="Output cache file, without .pkl")
+    ap.add_argument("--ids-file", dest="ids_file",
+                    help="Keep only the compound IDs listed in this file, one per line")
+    ap.add_argument("--mass-min", dest="mass_min", type=float,
+                    help="Keep only compounds with monoisotopic mass >= MASS_MIN")
+    ap.add_argument("--mass-max", dest="mass_max", type=float,
+                    help="Keep only compounds with monoisotopic mass <= MASS_MAX")
+    ap.add_argument("--compress", dest="compression", choices=list(COMPRESSION_CODECS), default=None,
+                    help="Compress the output cache chunks")
+
+    args = ap.parse_args()
+
+    cache_files = [resolve_cache_file(cache) for cache in args.cache_files]
+    output_file = args.output + '.pkl'
+    if output_file in cache_files:
+        ap.error("the output cache must differ from the input caches")
+
+    # Isotope data is needed to compare the masses of conflicting formulas
+    atom.load_isotope()
+
+    try:
+        ids = read_ids_file(args.ids_file) if args.ids_file else None
+        metadatas = check_compatible(cache_files)
+        compounds, duplicates, conflicts = merge_caches(cache_files, ids, args.mass_min, args.mass_max)
+    except FileNotFoundError as e:
+        print(f"Error: File not found: '{e.filename}'", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    reference = metadatas[0].get('command_line', {})
+    compound_db_files = []
+    for metadata in metadatas:
+        for db_file in metadata.get('command_line', {}).get('compound_db_files', []) or []:
+            if db_file not in compound_db_files:
+                compound_db_files.append(db_file)
+
+    metadata = {
+        'command_line': {
+            'ionization_mode': reference.get('ionization_mode'),
+            'labeled_atoms_file': reference.get('labeled_atoms_file'),
+            'compound_db_files': compound_db_files,
+            'noise_cutoff': reference.get('noise_cutoff'),
+            'masses_only': bool(reference.get('masses_only')),
+            'derived_from': None,
+            'merged_from': cache_files,
+            'cache_output_file': output_file,
+            'isotope_data_file': reference.get('isotope_data_file'),
+            'full_command': ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:])
+        },
+        'labelled_atoms': metadatas[0].get('labelled_atoms'),
+        'creation_date': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'mimi_version': pkg_resources.get_distribution('mimi').version
+    }
+
+    for co, kept_file, kept_cf, dropped_file, dropped_cf in conflicts:
+        print(f"CF_CONFLICT detected for compound ID: {co}", file=sys.stderr)
+        for label, cache_file, cf in (('Kept', kept_file, kept_cf), ('Dropped', dropped_file, dropped_cf)):
+            mass = calculate_formula_mass(cf)
+            mass = f"{mass:.6f}" if mass is not None else 'unknown'
+            print(f"  {label} from {cache_file}: {cf} (mass: {mass})", file=sys.stderr)
+
+    write_cache(output_file, metadata, compounds, compression=args.compression)
+
+    print(f"Wrote {len(compounds)} compounds to {output_file}")
+    if duplicates:
+        print(f"Dropped {duplicates} duplicate compound ID(s)")
+    if conflicts:
+        print(f"\nWARNING: {len(conflicts)} CF_CONFLICT(s) were detected; the entry of the first cache was kept.")
+
+
+if __name__ == '__main__':
+    main()
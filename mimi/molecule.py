@@ -38,8 +38,6 @@ Functions:
     calculate_mass: Calculate mass with ion adjustments
     get_isotop_variants_mass: Calculate mass variants for isotopes
     parse_molecular_formula: Parse a molecular formula string
-    get_hashed_index: Create index for fast lookup
-    search: Search molecular mass data within PPM tolerance
 """
 
 # Copyright 2025 New York University. All Rights Reserved.
@@ -369,109 +367,3 @@ def parse_molecular_formula(molecular_expression):
         exp[-1][1] = int(count)
 
     return exp
-
-
-def get_hashed_index(mi_pair_list):
-    """Create a hash-based index for efficient mass lookup.
-
-    :noindex:
-
-    Args:
-        mi_pair_list (list): List of [mass, intensity] pairs, sorted by mass
-
-    Returns:
-        list: Index structure where each element contains start/end indices for
-            masses falling into that integer mass bin
-
-    Note:
-        Creates an auxiliary data structure to enable fast binary search within
-        a smaller range when looking up masses
-    """
-
-    aux_index_list = [None] * int(float(mi_pair_list[-1][0]) + 1.0)
-    index = 0
-    for i in mi_pair_list:
-        num = int(float(i[0]))
-        if num not in aux_index_list:
-            aux_index_list[num] = {}
-        if('start' not in aux_index_list[num]):
-            if index == 0:
-                aux_index_list[num]['start'] = 0
-            else:
-                aux_index_list[num]['start'] = index - 1
-
-        index += 1
-        aux_index_list[num]['end'] = index
-
-    return aux_index_list
-
-
-def search(mi_pair_list, preculated_mass, aux_index_list, ppm):
-    """Search for masses within a PPM tolerance range.
-
-    :noindex:
-
-    Args:
-        mi_pair_list (list): List of [mass, intensity] pairs sorted by mass
-        preculated_mass (float): Target mass to search for
-        aux_index_list (list): Index structure from get_hashed_index()
-        ppm (float): Parts per million tolerance for matching
-
-    Returns:
-        list: Indices of all masses in mi_pair_list that fall within the PPM
-            tolerance range of the target mass
-
-    Note:
-        Uses the auxiliary index to narrow the search range before doing
-        detailed PPM tolerance comparisons
-    """
-    # eps = preculated_mass * 0.000001
-    # eps = preculated_mass * 0.0000005
-    eps = preculated_mass * ppm
-    # https://www.as.uky.edu/sites/default/files/jeolelemental.pdf
-
-    hash_value = float(preculated_mass)
-    start_hash = int(hash_value - 1.0)
-    end_hash = int(hash_value + 1.0)
-
-    if start_hash >= len(aux_index_list):
-        return []
-
-    if end_hash >= len(aux_index_list):
-        end_hash = len(aux_index_list)
-
-    # Search start index
-    start = 0
-    while True:
-        # print(start_hash, end_hash, len(aux_index_list), preculated_mass)
-        if aux_index_list[start_hash] == None:
-            start_hash -= 1
-        else:
-            start = aux_index_list[start_hash]['start']
-            break
-
-        if start_hash == 0:
-            break
-
-    # Search end index
-    end = len(mi_pair_list)
-    while True:
-        if end_hash == len(aux_index_list):
-            break
-        if aux_index_list[end_hash] == None:
-            end_hash += 1
-        else:
-            end = aux_index_list[end_hash]['end']
-            break
-
-    # max_intensity = -1
-    # max_index = -1
-    index_list = []
-    for index in range(start, end):
-   
-        mass = float(mi_pair_list[index][0])
-
-        if preculated_mass < (mass + eps) and preculated_mass > (mass - eps):
-            index_list.append(index)
-
-    return index_list
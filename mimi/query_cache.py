@@ -0,0 +1,219 @@
+# Copyright 2025 New York University. All Rights Reserved.
+
+# A license to use and copy this software and its documentation solely for your internal non-commercial
+# research and evaluation purposes, without fee and without a signed licensing agreement, is hereby granted
+# upon your download of the software, through which you agree to the following: 1) the above copyright
+# notice, this paragraph and the following three paragraphs will prominently appear in all internal copies
+# and modifications; 2) no rights to sublicense or further distribute this software are granted; 3) no rights
+# to modify this software are granted; and 4) no rights to assign this license are granted. Please contact
+# the NYU Technology Opportunities and Ventures TOVcommunications@nyulangone.org for commercial
+# licensing opportunities, or for further distribution, modification or license rights.
+
+# Created by Nabil Rahiman & Kristin Gunsalus
+
+# IN NO EVENT SHALL NYU, OR THEIR EMPLOYEES, OFFICERS, AGENTS OR TRUSTEES
+# ("COLLECTIVELY "NYU PARTIES") BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+# INCIDENTAL, OR CONSEQUENTIAL DAMAGES OF ANY KIND, INCLUDING LOST PROFITS, ARISING
+# OUT OF ANY CLAIM RESULTING FROM YOUR USE OF THIS SOFTWARE AND ITS
+# DOCUMENTATION, EVEN IF ANY OF NYU PARTIES HAS BEEN ADVISED OF THE POSSIBILITY
+# OF SUCH CLAIM OR DAMAGE.
+
+# NYU SPECIFICALLY DISCLAIMS ANY WARRANTIES OF ANY KIND REGARDING THE SOFTWARE,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE, OR THE ACCURACY OR USEFULNESS,
+# OR COMPLETENESS OF THE SOFTWARE. THE SOFTWARE AND ACCOMPANYING DOCUMENTATION,
+# IF ANY, PROVIDED HEREUNDER IS PROVIDED COMPLETELY "AS IS". NYU HAS NO OBLIGATION TO PROVIDE
+# FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
+
+"""
+Cache Query Module
+
+This module answers "what could this peak be" questions: it looks up a batch of
+m/z values against one or more MIMI cache files and reports every candidate
+compound within a PPM tolerance, with its error and expected isotope envelope.
+
+Candidates are found with a vectorized binary search over the sorted
+monoisotopic mass array of each cache index, so only the cache chunks that
+hold candidates are read.
+"""
+
+import argparse
+import os
+import sys
+import numpy as np
+from mimi.cache import read_cache_header, read_cache_index, read_compounds_at, iter_cache_compounds, resolve_cache_file
+from mimi.analysis import expand_isotope_variants
+from mimi.matching import ppm_pair_mask, segment_indices
+
+OUTPUT_FIELDS = ['Query_mz', 'Cache', 'ID', 'CF', 'Name', 'Mass', 'Error_ppm', 'Isotope_Envelope']
+
+
+def read_query_masses(input_file=None):
+    """Read m/z values, one per line, from a file or stdin.
+
+    Only the first tab- or whitespace-separated field of each line is used, so
+    peak lists and spreadsheet exports can be passed directly. Empty lines,
+    comment lines starting with '#' and non-numeric header lines are skipped.
+
+    Args:
+        input_file (str, optional): Path to the input file. If None, reads stdin.
+
+    Returns:
+        list: (original_text, value) pairs in input order
+    """
+    fd = open(input_file) if input_file else sys.stdin
+    queries = []
+    try:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            field = line.split()[0]
+            try:
+                queries.append((field, float(field)))
+            except ValueError:
+                continue
+    finally:
+        if input_file:
+            fd.close()
+    return queries
+
+
+def load_query_table(cache_file):
+    """Load the sorted mass table used to answer queries against a cache.
+
+    Uses the cache index when present; caches without an index are streamed
+    once to build the table in memory.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+
+    Returns:
+        dict: Table with sorted 'masses', their cache positions 'mass_pos', the
+            cache 'index' (or None) and, for caches without an index, the
+            loaded 'compounds' as a list of (compound_id, data) pairs
+    """
+    index = read_cache_index(cache_file)
+    if index is not None:
+        return {'masses': index['masses'], 'mass_pos': index['mass_pos'], 'index': index, 'compounds': None}
+
+    compounds = list(iter_cache_compounds(cache_file))
+    masses = np.array([data['mass'] for co, data in compounds], dtype=np.float64)
+    order = np.argsort(masses, kind='stable')
+    return {'masses': masses[order], 'mass_pos': order, 'index': None, 'compounds': compounds}
+
+
+def find_candidates(masses, query_masses, ppm):
+    """Find all compound masses within a PPM tolerance of each query mass.
+
+    A compound of mass M matches a query q when M - M * ppm < q < M + M * ppm,
+    the same criterion, evaluated the same way, as monoisotopic matching in
+    mimi_mass_analysis.
+
+    Args:
+        masses (numpy.ndarray): Sorted compound masses
+        query_masses (numpy.ndarray): Query m/z values
+        ppm (float): Tolerance as a fraction (e.g. 1e-6 for 1 ppm)
+
+    Returns:
+        tuple: (query_idx, mass_idx) arrays of matching pairs, grouped by query
+            and ordered by mass within each query
+    """
+    # The bounds are widened slightly; the exact test is applied afterwards
+    slack = query_masses * ppm * 1e-9 + np.abs(query_masses) * np.finfo(np.float64).eps
+    lo = np.searchsorted(masses, query_masses / (1.0 + ppm) - slack, side='left')
+    hi = np.searchsorted(masses, query_masses / (1.0 - ppm) + slack, side='right')
+    counts = hi - lo
+    query_idx = np.repeat(np.arange(len(query_masses)), counts)
+    mass_idx = segment_indices(lo, counts)
+
+    keep = ppm_pair_mask(masses, query_masses, mass_idx, query_idx, ppm)
+    return query_idx[keep], mass_idx[keep]
+
+
+def format_envelope(isotope_mass_list, num_isotopes):
+    """Format the expected isotope envelope as 'mass:abundance' pairs."""
+    variants = isotope_mass_list[1:num_isotopes + 1]
+    return ';'.join(f"{mass:.6f}:{abundance:.6f}" for mass, abundance, isotope_formula in variants)
+
+
+def query_cache(cache_file, method_name, queries, ppm, num_isotopes, out):
+    """Write all candidate compounds of one cache for a batch of queries.
+
+    For masses-only caches the isotope variants of each candidate are expanded
+    once, as in mimi_mass_analysis.
+
+    Args:
+        cache_file (str): Path to the .pkl cache file
+        method_name (str): Cache name written to the Cache column
+        queries (list): (original_text, value) pairs from read_query_masses()
+        ppm (float): Tolerance as a fraction (e.g. 1e-6 for 1 ppm)
+        num_isotopes (int): Number of isotope variants listed per candidate
+        out: Output file handle
+
+    Returns:
+        int: Number of candidate rows written
+    """
+    table = load_query_table(cache_file)
+    cmd_line = read_cache_header(cache_file).get('metadata', {}).get('command_line', {})
+    expanded = {}
+    query_masses = np.array([value for text, value in queries], dtype=np.float64)
+    query_idx, mass_idx = find_candidates(table['masses'], query_masses, ppm)
+    positions = np.asarray(table['mass_pos'])[mass_idx]
+
+    if table['index'] is not None:
+        compounds = dict(zip(np.unique(positions).tolist(),
+                             read_compounds_at(cache_file, table['index'], positions)))
+    else:
+        compounds = table['compounds']
+
+    for q, pos in zip(query_idx.tolist(), positions.tolist()):
+        co, data = compounds[pos]
+        isotope_mass_list = data['isotope_mass_list']
+        if cmd_line.get('masses_only') and not isotope_mass_list:
+            if co not in expanded:
+                expanded[co] = expand_isotope_variants(data, cmd_line['ionization_mode'],
+                                                       cmd_line.get('noise_cutoff') or 1e-5)
+            isotope_mass_list = expanded[co]
+        mass = data['mass']
+        error = ((mass - query_masses[q]) / mass) * 1000000
+        out.write('\t'.join([queries[q][0], method_name, co, data['cf'], data['cname'], str(mass), str(error),
+                             format_envelope(isotope_mass_list, num_isotopes)]) + '\n')
+    return len(query_idx)
+
+
+def main():
+    """Main entry point for the cache query tool."""
+    ap = argparse.ArgumentParser(description="MIMI Cache Query Tool")
+
+    ap.add_argument("-p", "--ppm", dest="ppm", type=float, required=True,
+                    help="Parts per million tolerance for the monoisotopic mass")
+    ap.add_argument("-c", "--cache", dest="cache_files", help="Binary DB input file(s)",
+                    metavar="DBBINARY", nargs='+', required=True)
+    ap.add_argument("-m", "--mz", dest="input_file", metavar="MZFILE",
+                    help="File with one m/z value per line (default: stdin)")
+    ap.add_argument("-k", "--num-isotopes", dest="num_isotopes", type=int, default=5,
+                    help="Number of isotope variants listed per candidate (default: 5)")
+    ap.add_argument("-o", "--output", help="Output file (default: stdout)")
+
+    args = ap.parse_args()
+
+    queries = read_query_masses(args.input_file)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        out.write('\t'.join(OUTPUT_FIELDS) + '\n')
+        if not queries:
+            return
+        for cache in args.cache_files:
+            query_cache(resolve_cache_file(cache), os.path.basename(cache), queries, args.ppm / 1000000,
+                        args.num_isotopes, out)
+    except FileNotFoundError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
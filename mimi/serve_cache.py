@@ -0,0 +1,353 @@
+# Copyright 2025 New York University. All Rights Reserved.
+
+# A license to use and copy this software and its documentation solely for your internal non-commercial
+# research and evaluation purposes, without fee and without a signed licensing agreement, is hereby granted
+# upon your download of the software, through which you agree to the following: 1) the above copyright
+# notice, this paragraph and the following three paragraphs will prominently appear in all internal copies
+# and modifications; 2) no rights to sublicense or further distribute this software are granted; 3) no rights
+# to modify this software are granted; and 4) no rights to assign this license are granted. Please contact
+# the NYU Technology Opportunities and Ventures TOVcommunications@nyulangone.org for commercial
+# licensing opportunities, or for further distribution, modification or license rights.
+
+# Created by Nabil Rahiman & Kristin Gunsalus
+
+# IN NO EVENT SHALL NYU, OR THEIR EMPLOYEES, OFFICERS, AGENTS OR TRUSTEES
+# ("COLLECTIVELY "NYU PARTIES") BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+# INCIDENTAL, OR CONSEQUENTIAL DAMAGES OF ANY KIND, INCLUDING LOST PROFITS, ARISING
+# OUT OF ANY CLAIM RESULTING FROM YOUR USE OF THIS SOFTWARE AND ITS
+# DOCUMENTATION, EVEN IF ANY OF NYU PARTIES HAS BEEN ADVISED OF THE POSSIBILITY
+# OF SUCH CLAIM OR DAMAGE.
+
+# NYU SPECIFICALLY DISCLAIMS ANY WARRANTIES OF ANY KIND REGARDING THE SOFTWARE,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE, OR THE ACCURACY OR USEFULNESS,
+# OR COMPLETENESS OF THE SOFTWARE. THE SOFTWARE AND ACCOMPANYING DOCUMENTATION,
+# IF ANY, PROVIDED HEREUNDER IS PROVIDED COMPLETELY "AS IS". NYU HAS NO OBLIGATION TO PROVIDE
+# FURTHER DOCUMENTATION, MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS
+
+"""
+Shared-Memory Cache Module
+
+This module serves MIMI caches from shared memory, so that many analysis jobs
+on the same node can use one copy of a cache instead of each unpickling its
+own. `mimi_cache_serve` loads the caches once and publishes each of them as a
+`multiprocessing.shared_memory` segment; `mimi_mass_analysis` attaches to a
+published segment read-only and falls back to loading the cache file when no
+server is running.
+
+A segment stores a cache in a columnar layout: compound IDs, formulas and
+names as UTF-8 blobs with offset arrays, monoisotopic masses and atom counts as
+numeric arrays, and all isotope variants as flat mass/abundance arrays with
+per-compound offsets. A small header at the start of the segment points to a
+pickled descriptor with the array layout and the cache metadata.
+
+The segment name is derived from the real path, size and modification time of
+the cache file, so a rebuilt cache is never matched to a stale segment.
+"""
+
+import argparse
+import atexit
+import hashlib
+import os
+import pickle
+import signal
+import struct
+import sys
+from collections.abc import Mapping
+from functools import lru_cache
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from mimi.cache import load_cache, resolve_cache_file
+
+SEGMENT_MAGIC = b'MIMISHM1'
+SEGMENT_HEADER = struct.Struct('<8sQQ')
+SEGMENT_ALIGN = 64
+ATOM_COUNT_ELEMENTS = ['C', 'H', 'N', 'O', 'P', 'S']
+
+
+def shared_cache_name(cache_file):
+    """Get the shared-memory segment name under which a cache file is published."""
+    path = os.path.realpath(cache_file)
+    st = os.stat(path)
+    key = f"{path}:{st.st_size}:{st.st_mtime_ns}".encode('utf-8')
+    return 'mimi_' + hashlib.sha1(key).hexdigest()[:24]
+
+
+def _encode_strings(values):
+    """Encode strings as a (uint8 blob, int64 offsets) pair."""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def build_table_arrays(compounds):
+    """Convert cache compounds to the columnar arrays stored in a segment.
+
+    Args:
+        compounds (dict): Compound entries keyed by compound ID
+
+    Returns:
+        dict: numpy arrays keyed by name
+    """
+    arrays = {}
+    arrays['ids'], arrays['id_offsets'] = _encode_strings(list(compounds))
+    arrays['cf'], arrays['cf_offsets'] = _encode_strings([data['cf'] for data in compounds.values()])
+    arrays['cname'], arrays['cname_offsets'] = _encode_strings([data['cname'] for data in compounds.values()])
+    arrays['mass'] = np.array([data['mass'] for data in compounds.values()], dtype=np.float64)
+
+    # Same counts as mimi.analysis.get_atom_counts
+    atom_counts = np.zeros((len(compounds), len(ATOM_COUNT_ELEMENTS)), dtype=np.int64)
+    for pos, data in enumerate(compounds.values()):
+        for each_atom in data['exp']:
+            symbol = each_atom[0][0]['element_symbol']
+            if symbol in ATOM_COUNT_ELEMENTS:
+                atom_counts[pos, ATOM_COUNT_ELEMENTS.index(symbol)] = each_atom[1]
+    arrays['atom_counts'] = atom_counts
+
+    variant_lists = [data['isotope_mass_list'] for data in compounds.values()]
+    arrays['variant_offsets'] = np.zeros(len(variant_lists) + 1, dtype=np.int64)
+    np.cumsum([len(variants) for variants in variant_lists], out=arrays['variant_offsets'][1:])
+    flat = [variant for variants in variant_lists for variant in variants]
+    arrays['variant_mass'] = np.array([variant[0] for variant in flat], dtype=np.float64)
+    arrays['variant_abundance'] = np.array([variant[1] for variant in flat], dtype=np.float64)
+    arrays['variant_name'], arrays['variant_name_offsets'] = _encode_strings([variant[2] for variant in flat])
+    return arrays
+
+
+def publish_cache(cache_file):
+    """Load a cache file and publish it as a shared-memory segment.
+
+    Args:
+        cache_file (str): Path to the cache file
+
+    Returns:
+        SharedMemory: The created segment; it stays published until unlinked
+
+    Raises:
+        FileExistsError: If the cache is already published
+    """
+    cache = load_cache(cache_file)
+    if cache['metadata'].get('command_line', {}).get('masses_only'):
+        raise ValueError("masses-only caches cannot be served; their isotope variants are expanded during analysis")
+    arrays = build_table_arrays(cache['compounds'])
+
+    layout = {}
+    offset = SEGMENT_ALIGN
+    for name, array in arrays.items():
+        layout[name] = (offset, array.dtype.str, array.shape)
+        offset += -(-array.nbytes // SEGMENT_ALIGN) * SEGMENT_ALIGN
+    descriptor = pickle.dumps({
+        'cache_file': os.path.realpath(cache_file),
+        'metadata': cache['metadata'],
+        'compound_count': len(cache['compounds']),
+        'arrays': layout
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    shm = shared_memory.SharedMemory(name=shared_cache_name(cache_file), create=True,
+                                     size=offset + len(descriptor))
+    for name, array in arrays.items():
+        start = layout[name][0]
+        shm.buf[start:start + array.nbytes] = array.tobytes()
+    shm.buf[offset:offset + len(descriptor)] = descriptor
+    # The magic is written last, so readers never attach to a half-filled segment
+    shm.buf[:SEGMENT_HEADER.size] = SEGMENT_HEADER.pack(SEGMENT_MAGIC, offset, len(descriptor))
+    return shm
+
+
+class SharedCompoundEntry(Mapping):
+    """A read-only cache entry backed by the arrays of a shared-memory segment.
+
+    Provides the 'cf', 'cname', 'mass', 'isotope_mass_list' and 'atom_counts'
+    fields; the isotope variants are only decoded when requested.
+    """
+
+    KEYS = ('cf', 'cname', 'mass', 'atom_counts', 'isotope_mass_list')
+
+    def __init__(self, table, pos):
+        self._table = table
+        self._pos = pos
+        self._isotope_mass_list = None
+
+    def __getitem__(self, key):
+        table = self._table
+        pos = self._pos
+        if key == 'cf':
+            return table.string('cf', pos)
+        if key == 'cname':
+            return table.string('cname', pos)
+        if key == 'mass':
+            return float(table.arrays['mass'][pos])
+        if key == 'atom_counts':
+            return tuple(str(count) for count in table.arrays['atom_counts'][pos].tolist())
+        if key == 'isotope_mass_list':
+            if self._isotope_mass_list is None:
+                self._isotope_mass_list = table.isotope_mass_list(pos)
+            return self._isotope_mass_list
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+
+class SharedCompoundTable(Mapping):
+    """Read-only mapping of compound IDs to entries of a shared-memory segment.
+
+    Iterates in cache order like the compounds dict returned by load_cache.
+    Only the compound IDs are copied into the attaching process.
+    """
+
+    def __init__(self, shm, descriptor):
+        self._shm = shm
+        self.arrays = {}
+        for name, (offset, dtype, shape) in descriptor['arrays'].items():
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            self.arrays[name] = array
+        self._ids = [self.string('ids', pos) for pos in range(descriptor['compound_count'])]
+        self._positions = {co: pos for pos, co in enumerate(self._ids)}
+        self._entry = lru_cache(maxsize=1024)(self._make_entry)
+
+    def string(self, name, pos):
+        """Decode the string at position pos of a string column."""
+        offsets = self.arrays['id_offsets' if name == 'ids' else name + '_offsets']
+        return self.arrays[name][offsets[pos]:offsets[pos + 1]].tobytes().decode('utf-8')
+
+    def isotope_mass_list(self, pos):
+        """Rebuild the [mass, abundance, isotope_name] list of the compound at pos."""
+        offsets = self.arrays['variant_offsets']
+        start, end = int(offsets[pos]), int(offsets[pos + 1])
+        name_offsets = self.arrays['variant_name_offsets']
+        names = self.arrays['variant_name'][name_offsets[start]:name_offsets[end]].tobytes().decode('utf-8')
+        bounds = (name_offsets[start:end + 1] - name_offsets[start]).tolist()
+        return [[mass, abundance, names[bounds[i]:bounds[i + 1]]]
+                for i, (mass, abundance) in enumerate(zip(self.arrays['variant_mass'][start:end].tolist(),
+                                                          self.arrays['variant_abundance'][start:end].tolist()))]
+
+    def _make_entry(self, pos):
+        return SharedCompoundEntry(self, pos)
+
+    def __getitem__(self, co):
+        return self._entry(self._positions[co])
+
+    def __contains__(self, co):
+        return co in self._positions
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def close(self):
+        """Release the arrays and detach from the segment."""
+        self._entry.cache_clear()
+        self.arrays = {}
+        self._shm.close()
+
+
+def _attach_segment(name):
+    """Attach to an existing segment without taking ownership of it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with the resource
+        # tracker, which would unlink it when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def attach_shared_cache(cache_file):
+    """Attach to the published shared-memory copy of a cache file.
+
+    The segment is looked up by the path, size and modification time of
+    cache_file, so the cache file itself must still exist.
+
+    Args:
+        cache_file (str): Path to the cache file
+
+    Returns:
+        dict: Cache data with 'metadata' and 'compounds' keys like load_cache(),
+            plus the 'segment' name, or None if the cache is not being served
+    """
+    name = shared_cache_name(cache_file)
+    try:
+        shm = _attach_segment(name)
+    except FileNotFoundError:
+        return None
+
+    magic, descriptor_offset, descriptor_size = SEGMENT_HEADER.unpack(bytes(shm.buf[:SEGMENT_HEADER.size]))
+    if magic != SEGMENT_MAGIC:
+        shm.close()
+        return None
+    descriptor = pickle.loads(bytes(shm.buf[descriptor_offset:descriptor_offset + descriptor_size]))
+
+    table = SharedCompoundTable(shm, descriptor)
+    # Detach before interpreter shutdown, while no array views are left
+    atexit.register(table.close)
+    return {
+        'metadata': descriptor['metadata'],
+        'compounds': table,
+        'segment': name
+    }
+
+
+def main():
+    """Main entry point for the cache server."""
+    ap = argparse.ArgumentParser(description="MIMI Shared-Memory Cache Server")
+
+    ap.add_argument("-c", "--cache", dest="cache_files", help="Binary DB input file(s)",
+                    metavar="DBBINARY", nargs='+', required=True)
+    ap.add_argument("--replace", action='store_true', default=False,
+                    help="Replace segments left behind by a server that did not shut down cleanly")
+
+    args = ap.parse_args()
+
+    segments = []
+
+    def unpublish():
+        while segments:
+            shm = segments.pop()
+            shm.close()
+            shm.unlink()
+
+    # Stop cleanly on SIGTERM as well, e.g. when the scheduler ends the job
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        for cache in args.cache_files:
+            cache_file = resolve_cache_file(cache)
+            if args.replace:
+                try:
+                    stale = shared_memory.SharedMemory(name=shared_cache_name(cache_file))
+                    stale.close()
+                    stale.unlink()
+                except FileNotFoundError:
+                    pass
+            try:
+                shm = publish_cache(cache_file)
+            except FileExistsError:
+                print(f"Error: Cache file '{cache_file}' is already being served "
+                      f"(use --replace if its server is no longer running)", file=sys.stderr)
+                sys.exit(1)
+            except Exception as e:
+                print(f"Error loading cache file '{cache_file}': {e}", file=sys.stderr)
+                sys.exit(1)
+            segments.append(shm)
+            print(f"Serving {cache_file} as {shm.name} ({shm.size / 1e6:.1f} MB)", flush=True)
+
+        print("Press Ctrl+C to stop serving.", flush=True)
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        unpublish()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark cache load time against file size for each chunk compression codec.
+
+The compounds of an existing cache are rewritten uncompressed, with zlib and
+with lzma into a temporary directory, and each variant is loaded several times.
+Labelled caches compress best, e.g. one built with the C13 fixture:
+
+    mimi_cache_create -i neg -l data/processed/C13_95.json -d compounds.tsv -c outdir/C13_95
+    python scripts/benchmark_cache_compression.py outdir/C13_95.pkl --bandwidth 200
+
+Local runs read from the page cache, so the measured times are mostly unpickling
+and decompression. --bandwidth adds the time needed to read each file at the
+given rate (MB/s) to estimate load time from a network filesystem.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from mimi.cache import load_cache, write_cache, COMPRESSION_CODECS
+
+
+def time_load(cache_file, repeat):
+    """Return the best load time in seconds over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load_cache(cache_file)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cache load time against file size per compression codec')
+    parser.add_argument('cache_file', help='Existing cache file (.pkl)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of loads per codec (default: 3)')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='Read bandwidth in MB/s used to estimate network filesystem load time')
+    args = parser.parse_args()
+
+    cache = load_cache(args.cache_file)
+    print(f"Cache: {args.cache_file} ({len(cache['compounds'])} compounds)")
+
+    header = f"{'Codec':<8}{'Size (MB)':>12}{'Ratio':>8}{'Write (s)':>12}{'Load (s)':>12}"
+    if args.bandwidth:
+        header += f"{'Est. load (s)':>16}"
+    print(header)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_size = None
+        for codec in [None] + list(COMPRESSION_CODECS):
+            cache_file = os.path.join(tmp_dir, f"{codec or 'none'}.pkl")
+            start = time.perf_counter()
+            write_cache(cache_file, cache['metadata'], cache['compounds'], compression=codec)
+            write_time = time.perf_counter() - start
+
+            size = os.path.getsize(cache_file)
+            base_size = base_size or size
+            load_time = time_load(cache_file, args.repeat)
+
+            row = f"{codec or 'none':<8}{size / 1e6:>12.2f}{base_size / size:>8.2f}{write_time:>12.2f}{load_time:>12.3f}"
+            if args.bandwidth:
+                row += f"{load_time + size / 1e6 / args.bandwidth:>16.3f}"
+            print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark monoisotopic mass matching of a cache against a sample.
+
+Times the searchsorted engine of mimi.matching against the two Python loops it
+replaced in mimi_mass_analysis: the compound-driven search over the integer
+bins of get_hashed_index, and the peak-driven probe of a per-Dalton compound
+index. Both legacy loops are reproduced below for reference. The first hit of
+every compound is compared between the compound-driven loop and the engine.
+
+    mimi_cache_create -i neg -d compounds.tsv -c outdir/nat
+    python scripts/benchmark_mass_matching.py outdir/nat.pkl data/processed/testdata1.asc --ppm 1
+
+The times cover matching only; loading the cache and the sample is excluded.
+"""
+
+import argparse
+import time
+import numpy as np
+from mimi.analysis import load_sample_peaks
+from mimi.cache import load_cache, resolve_cache_file
+from mimi.matching import first_ppm_hits
+
+
+def legacy_hashed_index(mi_pair_list):
+    """Integer mass bins of a sorted peak list, as built by the removed get_hashed_index.
+
+    The original also tested `num not in aux_index_list`, which scans the
+    whole list for every peak; that quadratic step is left out here so the
+    comparison covers the search itself.
+    """
+    aux_index_list = [None] * int(float(mi_pair_list[-1][0]) + 1.0)
+    for index, row in enumerate(mi_pair_list):
+        num = int(float(row[0]))
+        if aux_index_list[num] is None:
+            aux_index_list[num] = {'start': max(index - 1, 0)}
+        aux_index_list[num]['end'] = index + 1
+    return aux_index_list
+
+
+def legacy_search(mi_pair_list, mass, aux_index_list, ppm):
+    """PPM window search over the integer bins, as done by the removed search()."""
+    eps = mass * ppm
+    start_hash, end_hash = int(mass - 1.0), int(mass + 1.0)
+    if start_hash >= len(aux_index_list):
+        return []
+    end_hash = min(end_hash, len(aux_index_list))
+    while start_hash > 0 and aux_index_list[start_hash] is None:
+        start_hash -= 1
+    start = aux_index_list[start_hash]['start'] if aux_index_list[start_hash] else 0
+    while end_hash < len(aux_index_list) and aux_index_list[end_hash] is None:
+        end_hash += 1
+    end = aux_index_list[end_hash]['end'] if end_hash < len(aux_index_list) else len(mi_pair_list)
+    return [i for i in range(start, end)
+            if mass < float(mi_pair_list[i][0]) + eps and mass > float(mi_pair_list[i][0]) - eps]
+
+
+def legacy_compound_driven(compounds, mi_pair_list, ppm):
+    """First hit per compound by searching the sample once per compound."""
+    aux_index_list = legacy_hashed_index(mi_pair_list)
+    first = []
+    for co in compounds:
+        hits = legacy_search(mi_pair_list, compounds[co]['mass'], aux_index_list, ppm)
+        first.append(hits[0] if hits else -1)
+    return first
+
+
+def legacy_peak_driven(compounds, mi_pair_list, ppm):
+    """First hit per compound by probing a per-Dalton compound index once per peak."""
+    mass_index = {}
+    for co in compounds:
+        mass_int = int(compounds[co]['mass'])
+        for m in (mass_int - 1, mass_int, mass_int + 1):
+            mass_index.setdefault(m, []).append(co)
+    matches = {}
+    for mass_idx, row in enumerate(mi_pair_list):
+        mass = float(row[0])
+        for m in range(int(mass) - 1, int(mass) + 2):
+            for co in mass_index.get(m, []):
+                if co not in matches and abs(mass - compounds[co]['mass']) <= compounds[co]['mass'] * ppm:
+                    matches[co] = mass_idx
+    return [matches.get(co, -1) for co in compounds]
+
+
+def engine(compounds, sample_masses, ppm):
+    """First hit per compound with the searchsorted engine."""
+    compound_masses = np.fromiter((compounds[co]['mass'] for co in compounds), dtype=np.float64,
+                                  count=len(compounds))
+    return first_ppm_hits(compound_masses, sample_masses, ppm).tolist()
+
+
+def best_time(func, repeat, *func_args):
+    """Return (result, best time in seconds over repeat runs)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*func_args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the searchsorted mass matching engine against the legacy loops')
+    parser.add_argument('cache_file', help='Existing cache file')
+    parser.add_argument('sample', help='Sample peak list (.asc)')
+    parser.add_argument('--ppm', type=float, default=1.0, help='Mass tolerance in ppm (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per method (default: 3)')
+    args = parser.parse_args()
+
+    compounds = load_cache(resolve_cache_file(args.cache_file))['compounds']
+    peaks, _ = load_sample_peaks(args.sample)
+    # The legacy loops work on the sorted [mass, intensity] text rows
+    mi_pair_list = [[mass, intensity] for mass, intensity in zip(peaks['mass_text'], peaks['intensity_text'])]
+    ppm = args.ppm / 1000000
+    print(f"Cache: {args.cache_file} ({len(compounds)} compounds)")
+    print(f"Sample: {args.sample} ({len(mi_pair_list)} peaks), tolerance {args.ppm} ppm")
+
+    reference, reference_time = best_time(legacy_compound_driven, args.repeat, compounds, mi_pair_list, ppm)
+    _, peak_time = best_time(legacy_peak_driven, args.repeat, compounds, mi_pair_list, ppm)
+    result, engine_time = best_time(engine, args.repeat, compounds, peaks['mass'], ppm)
+
+    print(f"{'Method':<28}{'Time (s)':>10}{'Speedup':>10}")
+    for name, elapsed in (('legacy compound-driven', reference_time),
+                          ('legacy peak-driven', peak_time),
+                          ('searchsorted engine', engine_time)):
+        print(f"{name:<28}{elapsed:>10.3f}{reference_time / elapsed:>10.1f}")
+    print(f"Matched compounds: {sum(hit >= 0 for hit in result)}")
+    print(f"First hits identical to compound-driven loop: {'yes' if result == reference else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -45,18 +45,19 @@ vp_values=(0.1 0.5 1)
 # Loop through each test file
 for test_file in "${test_files[@]}"; do
     base_name=$(basename "$test_file" .asc)
-    
-    # Analysis for top graph (fixed vp=0.5, varying p)
+
+    # Analyse all p / vp combinations in one run; it writes one report per
+    # combination, named n<base>_combined_p<p>_vp<vp>.tsv
+    mimi_mass_analysis --ppm-grid "${p_values[@]}" --vppm-grid "${vp_values[@]}" -c "$outdir/nat_nist" -s "$datadir/$test_file" --iso-valid -o "$outdir/n${base_name}_combined.tsv"
+
+    # Rename the reports as the plot scripts expect them: the top graph uses
+    # a fixed vp=0.5 and varying p, the bottom graph a fixed p=0.5 and varying vp
     for p in "${p_values[@]}"; do
-        p_str=$(echo $p | tr -d '.')
-        mimi_mass_analysis -p $p -vp 0.5 -c "$outdir/nat_nist"  -s "$datadir/$test_file" --iso-valid -o "$outdir/n${base_name}_p${p_str}_vp05_combined.tsv"
-    done
-    
-    # Analysis for bottom graph (fixed p=0.5, varying vp)
-    for vp in "${vp_values[@]}"; do
-        # Format vp value without underscore, just remove the dot
-        vp_str=$(echo $vp | tr -d '.')
-        mimi_mass_analysis -p 0.5 -vp $vp -c "$outdir/nat_nist"  -s "$datadir/$test_file" --iso-valid -o "$outdir/n${base_name}_p05_vp${vp_str}_combined.tsv"
+        for vp in "${vp_values[@]}"; do
+            p_str=$(echo $p | tr -d '.')
+            vp_str=$(echo $vp | tr -d '.')
+            mv "$outdir/n${base_name}_combined_p${p}_vp${vp}.tsv" "$outdir/n${base_name}_p${p_str}_vp${vp_str}_combined.tsv"
+        done
     done
 done
 
@@ -91,6 +91,10 @@ setup(
             'mimi_cache_create=mimi.create_cache:main',
             'mimi_hmdb_extract=mimi.hmdb:main',
             'mimi_cache_dump=mimi.dump_cache:main',
+            'mimi_cache_query=mimi.query_cache:main',
+            'mimi_cache_diff=mimi.diff_cache:main',
+            'mimi_cache_merge=mimi.merge_cache:main',
+            'mimi_cache_serve=mimi.serve_cache:main',
             'mimi_kegg_extract=mimi.kegg:main'
         ],
     },